@@ -1,266 +1,277 @@
 # Libraries
-import datetime
-# Pandas for data manipulation
-import pandas as pd
-# Plotly for making visuals
-import plotly.graph_objs as go
 # Dash for generating HTML
 import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
 # Dash dependencies for interactivity
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
+# Flask for the readiness endpoint
+import flask
+# Per-request figures
+from covid_figures import map_template, map_base, map_view, graph_base, graph_view, compare_view, data_axes, \
+    variable_options, graph_options, graph_window, MaxRegions
+from covid_store import AVERAGE_PERIODS, region_key
+# Current data & background refresh
+from covid_refresh import BackgroundLoad, SharedData, current, current_versions, ready, load_scopes, \
+    load_in_background, on_publish, start_refresher, start_watcher
+# Region hierarchies served (the US, the world)
+from covid_scopes import SCOPES, Scopes
+# Cache of finished figures
+from covid_cache import ExportDir, FigureCache, modifier_key
+# Opt-in timing & profiling
+import covid_instrument as instrument
+# JSON/CSV data API
+import covid_api
 
 # Create app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.DARKLY])
-
-# State abbreviations
-us_state_abbrev = {
-    'Alabama': 'AL',
-    'Alaska': 'AK',
-    'American Samoa': 'AS',
-    'Arizona': 'AZ',
-    'Arkansas': 'AR',
-    'California': 'CA',
-    'Colorado': 'CO',
-    'Connecticut': 'CT',
-    'Delaware': 'DE',
-    'District of Columbia': 'DC',
-    'Florida': 'FL',
-    'Georgia': 'GA',
-    'Guam': 'GU',
-    'Hawaii': 'HI',
-    'Idaho': 'ID',
-    'Illinois': 'IL',
-    'Indiana': 'IN',
-    'Iowa': 'IA',
-    'Kansas': 'KS',
-    'Kentucky': 'KY',
-    'Louisiana': 'LA',
-    'Maine': 'ME',
-    'Maryland': 'MD',
-    'Massachusetts': 'MA',
-    'Michigan': 'MI',
-    'Minnesota': 'MN',
-    'Mississippi': 'MS',
-    'Missouri': 'MO',
-    'Montana': 'MT',
-    'Nebraska': 'NE',
-    'Nevada': 'NV',
-    'New Hampshire': 'NH',
-    'New Jersey': 'NJ',
-    'New Mexico': 'NM',
-    'New York': 'NY',
-    'North Carolina': 'NC',
-    'North Dakota': 'ND',
-    'Northern Mariana Islands': 'MP',
-    'Ohio': 'OH',
-    'Oklahoma': 'OK',
-    'Oregon': 'OR',
-    'Pennsylvania': 'PA',
-    'Puerto Rico': 'PR',
-    'Rhode Island': 'RI',
-    'South Carolina': 'SC',
-    'South Dakota': 'SD',
-    'Tennessee': 'TN',
-    'Texas': 'TX',
-    'Utah': 'UT',
-    'Vermont': 'VT',
-    'Virgin Islands': 'VI',
-    'Virginia': 'VA',
-    'Washington': 'WA',
-    'West Virginia': 'WV',
-    'Wisconsin': 'WI',
-    'Wyoming': 'WY'
-}
-
-# Pull cases & deaths by county
-CasesFileName = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_confirmed_US.csv'
-DeathsFileName = 'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/time_series_covid19_deaths_US.csv'
-CtyCases = pd.read_csv(CasesFileName)
-CtyDeaths = pd.read_csv(DeathsFileName)
-
-# Remove anything that isn't a state/district/territory (e.g. cruise ships, prisons, etc)
-CtyCases = CtyCases[CtyCases['Province_State'].isin(us_state_abbrev.keys())]
-CtyDeaths = CtyDeaths[CtyDeaths['Province_State'].isin(us_state_abbrev.keys())]
-
-# Extract population
-CtyPops = CtyDeaths[['Admin2', 'Province_State', 'Country_Region', 'Population']]
-
-# Trim unnecessary columns
-drop_cols = ['UID', 'iso2', 'iso3', 'code3', 'FIPS', 'Lat', 'Long_', 'Combined_Key', '1/22/20', '1/23/20', '1/24/20', '1/25/20', '1/26/20', '1/27/20', '1/28/20', '1/29/20', '1/30/20', '1/31/20', '2/1/20', '2/2/20', '2/3/20', '2/4/20', '2/5/20', '2/6/20', '2/7/20', '2/8/20', '2/9/20', '2/10/20', '2/11/20', '2/12/20', '2/13/20', '2/14/20', '2/15/20', '2/16/20', '2/17/20', '2/18/20', '2/19/20', '2/20/20', '2/21/20', '2/22/20', '2/23/20', '2/24/20', '2/25/20', '2/26/20', '2/27/20', '2/28/20']
-CtyCases = CtyCases.drop(columns=drop_cols)
-drop_cols.append('Population')
-CtyDeaths = CtyDeaths.drop(columns=drop_cols)
-
-# Apply index -- Index = Country, State, County -- Columns = dates
-CtyCases.set_index(['Country_Region', 'Province_State', 'Admin2'], inplace=True)
-CtyDeaths.set_index(['Country_Region', 'Province_State', 'Admin2'], inplace=True)
-CtyPops.set_index(['Country_Region', 'Province_State', 'Admin2'], inplace=True)
-CtyCases = CtyCases.rename_axis(index=['Country', 'State', 'County'])
-CtyDeaths = CtyDeaths.rename_axis(index=['Country', 'State', 'County'])
-CtyPops = CtyPops.rename_axis(index=['Country', 'State', 'County'])
-
-# Get populations by state and reformat
-StPops = CtyPops.groupby(level='State').sum().transpose()
-
-# Get dictionary of dates in dataset for date slider
-DateList = list(CtyCases.columns.values)
-DateMarks = dict(list(enumerate(CtyCases.columns.values)))
-num_dates = len(DateMarks)
-for i in range(num_dates):
-    if i % 7 != 0:
-        del DateMarks[num_dates - 1 - i]                                    # Only keep marks on a weekly basis
-    else:
-        DateMarks[num_dates - 1 - i] = DateMarks[num_dates - 1 - i][:-3]    # Remove year to save space
-
-# US map frame
-usmap = go.Figure()
-usmap.layout.template = 'plotly_dark'
-usmap.add_trace(go.Choropleth())
-usmap.update_layout(
-    geo=dict(
-        scope='usa',
-        projection=go.layout.geo.Projection(type='albers usa'),
-        showlakes=False
-    )
-)
-
-# Map & graph
-app.layout = \
-    html.Div(
+instrument.install(app.server)
+covid_api.install(app.server)
+
+# Figures are cached per data version -- drop them whenever new data is swapped in (keeping every other scope's)
+figure_cache = FigureCache()
+on_publish(lambda data: figure_cache.invalidate(*current_versions()))
+instrument.add_collector(lambda: [
+    ('covid_figure_cache_hits_total', 'Figures served from the cache', 'counter', {(): figure_cache.hits}),
+    ('covid_figure_cache_misses_total', 'Figures that had to be built', 'counter', {(): figure_cache.misses}),
+    ('covid_figure_cache_coalesced_total', 'Requests that waited for an identical request\'s build', 'counter',
+     {(): figure_cache.coalesced}),
+])
+
+# Pull cases & deaths by county for every scope (from the local snapshots when they're current), then keep checking for
+# new data
+# In background load mode the server starts answering straight away and /ready reports when the data has arrived
+# In shared data mode a separate loader process (covid_loader.py) does all that & this worker maps what it publishes
+if SharedData:
+    start_watcher()
+elif BackgroundLoad:
+    load_in_background(then=map_template)
+    start_refresher()
+else:
+    load_scopes()
+    start_refresher()
+
+
+# Readiness check for the WSGI host / load balancer -- 503 until the data has loaded
+@app.server.route('/ready')
+def readiness():
+    if not ready():
+        return flask.jsonify(ready=False), 503
+    data = current(0)
+    return flask.jsonify(ready=True, scope=data.scope, version=data.version, dates=data.num_dates,
+                         latest=data.DateList[-1], versions={scope: current(0, scope).version for scope in Scopes})
+
+
+# Views pre-rendered by covid_export.py, for a CDN or static host to mirror -- they never change once written, as each
+# data version gets its own folder
+if ExportDir is not None:
+    @app.server.route('/views/<path:path>')
+    def exported_view(path):
+        return flask.send_from_directory(ExportDir, path, max_age=365 * 24 * 3600)
+
+
+# Map & graph of one scope's data -- swapped out whole when another scope is picked
+def dashboard(data):
+    Scope = data.Scope
+    counties = [{'label': 'Counties', 'value': 'county'}] if Scope.subregion_map else []
+    return dbc.Row(
         [
-            # Title section
-            dbc.NavbarSimple(children=[dbc.Button('Show Tutorial', id='show_tutorial')
-                                       ], brand='United States vs COVID-19', color='dark', dark=True, id='navbar'),
-            # Everything
-            dbc.Row(
+            # Scope the page shows, read by every callback
+            dcc.Store(id='scope', data=data.scope),
+            # Choropleth map with radio buttons
+            dbc.Col(
                 [
-                    # USA choropleth map with radio buttons
-                    dbc.Col(
+                    # Choropleth map (of the USA or the world) -- drawn in the browser from the stores below
+                    dcc.Graph(figure=map_template(data.scope), id='usmap'),
+                    dcc.Store(id='map_base', data=map_base(app.get_asset_url('us_counties.json'), data.scope)),
+                    dcc.Store(id='map_frames'),
+                    # Dates & map locations of this version of the data, shared by the map & graph
+                    dcc.Store(id='axes', data=data_axes(data)),
+                    # Choose date and variable
+                    dbc.Card(
                         [
-                            # USA choropleth map
-                            dcc.Graph(figure=usmap, id='usmap'),
-                            # Choose date and variable
-                            dbc.Card(
+                            # Slider to choose date
+                            dbc.CardHeader('Date Selection'),
+                            dbc.CardBody(
                                 [
-                                    # Slider to choose date
-                                    dbc.CardHeader('Date Selection'),
-                                    dbc.CardBody(
-                                        [
-                                            dbc.Row(
-                                                [
-                                                    dbc.Col([dbc.Button('Play', id='play_button', disabled=False)], width={'size': 1}),
-                                                    dbc.Col(
-                                                        [
-                                                            dcc.Slider(
-                                                                id='date_slider',
-                                                                min=1,
-                                                                max=num_dates - 1,
-                                                                value=num_dates - 1,
-                                                                marks=DateMarks
-                                                            )
-                                                        ], width={'size': 10}
-                                                    ),
-                                                    dcc.Interval(
-                                                        id='interval',
-                                                        interval=0.5*1000,     # sec * 1000 = milliseconds
-                                                        n_intervals=0,
-                                                        max_intervals=0        # Disabled until enabled by play button
-                                                    )
-                                                ]
-                                            )
-                                        ]
-                                    ),
-                                    # Radio buttons to select variable & switches to apply variable modifiers
-                                    dbc.CardHeader("Variable Selection"),
-                                    dbc.CardBody(
+                                    dbc.Row(
                                         [
-                                            dbc.Row(
+                                            dbc.Col([dbc.Button('Play', id='play_button', disabled=False)], width={'size': 1}),
+                                            dbc.Col(
                                                 [
-                                                    dbc.Col(
-                                                        # Radio buttons to choose variable
-                                                        dbc.RadioItems(
-                                                            id='variable-picker',
-                                                            options=[
-                                                                {'label': 'Cases', 'value': 'Cases'},
-                                                                {'label': 'Deaths', 'value': 'Deaths'}
-                                                            ],
-                                                            value='Cases',
-                                                            inline=True
-                                                        )
+                                                    dcc.Slider(
+                                                        id='date_slider',
+                                                        min=data.SliderDays[0],
+                                                        max=data.num_dates - 1,
+                                                        value=data.num_dates - 1,
+                                                        marks=data.DateMarks,
+                                                        # Long histories stop only at the marks -- the last
+                                                        # day of every week or month
+                                                        step=1 if data.SliderTier == 'day' else None,
+                                                        # Redraw while dragging -- the state map is drawn in
+                                                        # the browser & the county map only asks for the
+                                                        # latest date (see map_date)
+                                                        updatemode='drag'
                                                     ),
-                                                    dbc.Col(
-                                                        # Switches to toggle variable modifiers
-                                                        dbc.Checklist(
-                                                            options=[
-                                                                {'label': 'Per Capita', 'value': 'percap'},
-                                                                {'label': 'Totals', 'value': 'totals'},
-                                                            ],
-                                                            value=['', ''],
-                                                            id='modifiers',
-                                                            inline=True,
-                                                            switch=True,
-                                                        )
-                                                    )
-                                                ], form=True
+                                                    # Date the county map was last asked for, & the timer
+                                                    # catching it up with the slider
+                                                    dcc.Store(id='map_date', data=data.num_dates - 1),
+                                                    dcc.Interval(id='map_date_timer', interval=100,
+                                                                 disabled=True)
+                                                ], width={'size': 10}
+                                            ),
+                                            dcc.Interval(
+                                                id='interval',
+                                                interval=0.5*1000,     # sec * 1000 = milliseconds
+                                                n_intervals=0,
+                                                max_intervals=0        # Disabled until enabled by play button
                                             )
                                         ]
                                     )
-                                ], id='map_vars'
-                            )
-                        ], width={'size': 5}  # Map graph gets 5/12 of website
-                    ),
-                    # Line graph of recent data for subset of country
-                    dbc.Col(
-                        [
-                            # Line graph
-                            dcc.Graph(id='line_graph'),
-                            # Multiple inputs to change region being considered
-                            dbc.Card(
+                                ]
+                            ),
+                            # Radio buttons to select variable & switches to apply variable modifiers
+                            dbc.CardHeader("Variable Selection"),
+                            dbc.CardBody(
                                 [
-                                    dbc.CardHeader('Region Selection'),
-                                    # Select region
-                                    dbc.Row(
-                                        [
-                                            # Aggregate level drop-down selection
-                                            dbc.Col(dbc.Button(id='country_toggle', color='info', block=True)),
-                                            # State drop-down selection
-                                            dbc.Col(dbc.Select(id='state_dd', options=[
-                                                {'label': 'Select a state', 'value': 'unused'}], value='unused')),
-                                            # County drop-down selection
-                                            dbc.Col(dbc.Select(id='county_dd', options=[
-                                                {'label': 'Select a county', 'value': 'unused'}], value='unused')),
-                                        ], form=True
-                                    ),
-                                    # Determine how drop down menus are sorted
                                     dbc.Row(
                                         [
-                                            dbc.Col(dbc.RadioItems(
-                                                id='dd-sort',
-                                                options=[
-                                                    {'label': 'Sort state & county drop-downs alphabetically', 'value': 'abc'},
-                                                    {'label': 'Sort state & county drop-downs by number of cases', 'value': 'cases'}
-                                                ], value='abc'), width={'offset': 4}
+                                            dbc.Col(
+                                                # Radio buttons to choose variable
+                                                dbc.RadioItems(
+                                                    id='variable-picker',
+                                                    options=variable_options(),
+                                                    value='Cases',
+                                                    inline=True
+                                                )
                                             ),
+                                            dbc.Col(
+                                                # Switches to toggle variable modifiers
+                                                dbc.Checklist(
+                                                    options=[
+                                                        {'label': 'Per Capita', 'value': 'percap'},
+                                                        {'label': 'Totals', 'value': 'totals'},
+                                                    ] + counties,
+                                                    value=['', ''],
+                                                    id='modifiers',
+                                                    inline=True,
+                                                    switch=True,
+                                                )
+                                            )
                                         ], form=True
-                                    ),
-                                    # Box for adjusting the moving average period
-                                    dbc.CardHeader('Moving Average Period Selection'),
-                                    dbc.Row(
-                                        dbc.Col(
-                                            dbc.Input(id='moving_avg', value='7', bs_size='lg', type='number',
-                                                      inputMode='numeric', min=2, step=1, max=14),
-                                            width={'size': 2, 'offset': 1}
-                                        )
                                     )
-                                ], id='region_sel'
+                                ]
                             )
-                        ], width={'size': 7}  # Line graph gets 7/12 of website
+                        ], id='map_vars'
                     )
-                ], no_gutters=False  # Squish the map & graph together
+                ], width={'size': 5}  # Map graph gets 5/12 of website
             ),
+            # Line graph of recent data for subset of country
+            dbc.Col(
+                [
+                    # Line graph -- drawn in the browser like the map
+                    dcc.Graph(id='line_graph'),
+                    dcc.Store(id='graph_base', data=graph_base()),
+                    dcc.Store(id='graph_data'),
+                    # Dates the line graph is zoomed to (None for the whole history)
+                    dcc.Store(id='graph_window'),
+                    # Multiple inputs to change region being considered
+                    dbc.Card(
+                        [
+                            dbc.CardHeader('Region Selection'),
+                            # Select region
+                            dbc.Row(
+                                [
+                                    # Aggregate level drop-down selection
+                                    dbc.Col(dbc.Button(id='country_toggle', color='info', block=True)),
+                                    # State drop-down selection
+                                    dbc.Col(dbc.Select(id='state_dd', options=[
+                                        {'label': 'Select a ' + Scope.regions, 'value': 'unused'}],
+                                        value='unused')),
+                                    # County drop-down selection
+                                    dbc.Col(dbc.Select(id='county_dd', options=[
+                                        {'label': 'Select a ' + Scope.subregions, 'value': 'unused'}],
+                                        value='unused')),
+                                ], form=True
+                            ),
+                            # Determine how drop down menus are sorted
+                            dbc.Row(
+                                [
+                                    dbc.Col(dbc.RadioItems(
+                                        id='dd-sort',
+                                        options=[
+                                            {'label': 'Sort %s & %s drop-downs alphabetically' % (Scope.regions, Scope.subregions), 'value': 'abc'},
+                                            {'label': 'Sort %s & %s drop-downs by number of cases' % (Scope.regions, Scope.subregions), 'value': 'cases'}
+                                        ], value='abc'), width={'offset': 4}
+                                    ),
+                                ], form=True
+                            ),
+                            # Box for adjusting the moving average period
+                            dbc.CardHeader('Moving Average Period Selection'),
+                            dbc.Row(
+                                dbc.Col(
+                                    dbc.Input(id='moving_avg', value='7', bs_size='lg', type='number',
+                                              inputMode='numeric', min=2, step=1, max=14),
+                                    width={'size': 2, 'offset': 1}
+                                )
+                            ),
+                            # Regions to compare on the line graph instead of the one region above
+                            dbc.CardHeader('Compare Regions'),
+                            dbc.Row(
+                                [
+                                    dbc.Col(dcc.Dropdown(id='compare_dd', options=data.RegionOptions, value=[],
+                                                         multi=True,
+                                                         placeholder='Pick up to %d %s or %s to compare' %
+                                                                     ((MaxRegions,) + Scope.plurals)),
+                                            width={'size': 8, 'offset': 1}),
+                                    dbc.Col(dbc.RadioItems(
+                                        id='compare_variable',
+                                        options=[
+                                            {'label': 'Cases', 'value': 'Cases'},
+                                            {'label': 'Deaths', 'value': 'Deaths'}
+                                        ], value='Cases', inline=True)
+                                    ),
+                                ], form=True
+                            ),
+                            # What the line graph shows -- daily new values or one of the derived metrics
+                            dbc.CardHeader('Line Graph Variable'),
+                            dbc.Row(
+                                dbc.Col(
+                                    dbc.RadioItems(id='graph_metric', options=graph_options(country=True), value='new',
+                                                   inline=True),
+                                    width={'offset': 1}
+                                )
+                            )
+                        ], id='region_sel'
+                    )
+                ], width={'size': 7}  # Line graph gets 7/12 of website
+            )
+        ], no_gutters=False  # Squish the map & graph together
+    )
+
+
+# Title, scope picker & tutorial popovers around the dashboard -- built on each page load so the date slider always
+# matches the current data
+def serve_layout():
+    data = current(0)
+    if data is None:
+        # Still loading -- ask the user to come back straight away rather than hold the page (& a worker) up
+        return html.Div(dbc.Alert('The latest COVID data is still loading, please refresh in a moment.',
+                                  color='warning'))
+    return html.Div(
+        [
+            # Title section -- the scope picker only shows when there's more than one scope to pick from
+            dbc.NavbarSimple(children=[dbc.RadioItems(id='scope_picker', value=data.scope, inline=True,
+                                                      options=[{'label': SCOPES[scope].name, 'value': scope}
+                                                               for scope in Scopes],
+                                                      style={} if len(Scopes) > 1 else {'display': 'none'}),
+                                       dbc.Button('Show Tutorial', id='show_tutorial')
+                                       ], brand=data.Scope.name + ' vs COVID-19', color='dark', dark=True,
+                             id='navbar'),
+            # Everything
+            html.Div(dashboard(data), id='page'),
             # Tutorial elements as popovers - can be toggled by button in navbar
             dbc.Popover(
                 [
@@ -268,6 +279,7 @@ app.layout = \
                     dbc.PopoverBody("Use the drop down menus to specify a region."),
                     dbc.PopoverBody("Clicking the button on the left will graph the whole country."),
                     dbc.PopoverBody("The radio buttons can change how the drop down menus are sorted"),
+                    dbc.PopoverBody("Pick several states or counties under 'Compare Regions' to graph them side by side."),
                 ],
                 id='region_sel_popover', target='region_sel', placement='top', is_open=False
             ),
@@ -291,6 +303,7 @@ app.layout = \
                 [
                     dbc.PopoverHeader("Change the Map Variable"),
                     dbc.PopoverBody("The radio buttons control whether the map is showing the number of cases or deaths."),
+                    dbc.PopoverBody("The other radio buttons show growth rates, doubling times, week over week changes or per capita rankings of cases or deaths."),
                     dbc.PopoverBody("The 'Per Capita' switch can be used to more accurately compare states of different populations."),
                     dbc.PopoverBody("The 'Totals' switch can be used to show either the total amount of cases/deaths up to the chosen date."),
                 ],
@@ -300,235 +313,214 @@ app.layout = \
     )
 
 
-# Update US map based off chosen variables & modifiers
+app.layout = serve_layout
+
+
+# Swap the dashboard for another scope's when one is picked
 @app.callback(
-    [Output(component_id='usmap', component_property='figure'),
-     Output(component_id='date_slider', component_property='included')],
+    [Output(component_id='page', component_property='children'),
+     Output(component_id='navbar', component_property='brand')],
+    [Input(component_id='scope_picker', component_property='value')],
+    prevent_initial_call=True
+)
+@instrument.callback
+def switch_scope(scope):
+    data = current(scope=scope)
+    if data is None:
+        raise PreventUpdate
+    return dashboard(data), data.Scope.name + ' vs COVID-19'
+
+
+# Whether a component's property is one of the inputs that triggered the current callback
+def triggered_by(component_id):
+    if not flask.has_request_context():
+        return False
+    return any(t['prop_id'].split('.')[0] == component_id for t in dash.callback_context.triggered)
+
+
+# A payload for the browser -- with the dates & locations added if the page was loaded with another version of the data
+# (e.g. before a refresh), since its own copy won't match
+def with_axes(payload, data, axes):
+    if axes is not None and axes.get('version') == data.version:
+        return payload
+    return dict(payload, axes=data_axes(data))
+
+
+# Pass the slider's date on to the county map -- runs in the browser, sending nothing for the state map (which already
+# has every date) and, while a county map request is in flight, holding back all but the latest date
+app.clientside_callback(
+    ClientsideFunction(namespace='covid', function_name='map_date'),
+    [Output(component_id='map_date', component_property='data'),
+     Output(component_id='map_date_timer', component_property='disabled')],
     [Input(component_id='date_slider', component_property='value'),
-     Input(component_id='variable-picker', component_property='value'),
-     Input(component_id='modifiers', component_property='value')]
+     Input(component_id='modifiers', component_property='value'),
+     Input(component_id='map_date_timer', component_property='n_intervals')]
 )
-def update_map(date, radio_selection, modifiers):
-    # Change slider number to the date
-    date = DateList[date]
 
-    # Summarize data at state level
-    MapCases = CtyCases.groupby(level='State').sum().transpose()
-    MapDeaths = CtyDeaths.groupby(level='State').sum().transpose()
 
-    # Determine variable to be color-coded
-    if radio_selection == 'Cases':
-        MapData = MapCases
-    else:
-        MapData = MapDeaths
+# Send the browser the map values for every date of the chosen variable & modifiers
+# Moving the date slider or playing the animation then redraws the map clientside, with no further server work -- except
+# for the county map, which has too many counties to send every date at once, so it's sent a date at a time
+# Identical requests arriving together (e.g. many users playing the animation) share one build
+@app.callback(
+    [Output(component_id='map_frames', component_property='data'),
+     Output(component_id='date_slider', component_property='included')],
+    [Input(component_id='variable-picker', component_property='value'),
+     Input(component_id='modifiers', component_property='value'),
+     Input(component_id='map_date', component_property='data')],
+    [State(component_id='axes', component_property='data'),
+     State(component_id='scope', component_property='data')]
+)
+@instrument.callback
+def update_map(radio_selection, modifiers, date, axes, scope):
+    timer = instrument.Stopwatch('update_map')
+
+    # The state map already has every date
+    county = 'county' in modifiers
+    if not county and triggered_by('map_date'):
+        raise PreventUpdate
+
+    # Read everything from one version of the page's scope's data
+    data = current(scope=scope)
+    if data is None:
+        raise PreventUpdate
+
+    # Serve repeat views straight from the cache
+    cache_key = ('map', data.version, radio_selection, modifier_key(modifiers))
+    day = None
+    if county:
+        # The slider may still be showing dates from an older version of the data
+        day = data.slider_day(min(int(date), data.num_dates - 1))
+        cache_key += (day,)
+
+    timer.lap('lookup')
+
+    # Pull the precomputed state level data for the chosen variable & modifiers
+    frames = figure_cache.get_or_build(cache_key, timer.build(lambda: map_view(data, radio_selection, modifiers, day)))
+    timer.cached()
+    frames = with_axes(frames, data, axes)
+    timer.lap('axes')
+    return frames, 'totals' in modifiers
+
+
+# Draw the map for the chosen date in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='covid', function_name='render_map'),
+    Output(component_id='usmap', component_property='figure'),
+    [Input(component_id='map_frames', component_property='data'),
+     Input(component_id='date_slider', component_property='value')],
+    [State(component_id='map_base', component_property='data'),
+     State(component_id='axes', component_property='data')]
+)
 
-    # Determine if map should show New Daily data or Total data
-    if 'totals' in modifiers:
-        title_prefix = 'Total '
-        title_suffix = ' by ' + str(date)
-        included = True
-    else:
-        title_prefix = 'New '
-        title_suffix = ' on ' + str(date)
-        included = False
-        # Transform data from totals to new
-        MapData = MapData.diff()
-
-    # Determine if map is showing data per capita or not
-    if 'percap' in modifiers:
-        title_suffix = ' per 100,000 Capita' + title_suffix
-        MapData = MapData.div(StPops.loc['Population']).mul(100000)
-
-    # Add qualifiers to map title
-    map_title = title_prefix + radio_selection + title_suffix
-
-    # Update map with new data variable
-    usmap.update_traces(
-        locations=list(map(lambda x: us_state_abbrev[x], list(MapData.columns.values))),
-        locationmode='USA-states',  # set of locations match entries in `locations`
-        z=MapData.loc[date],
-        zmin=0,
-        zmax=max(MapData.loc[date]),
-        colorscale=[[0, 'white'], [1, 'red']],
-        colorbar=dict(
-            thickness=15,
-            len=1.5,
-            xanchor='left',
-            x=-0.1,
-            ticks='inside'),
-        selector=dict(type='choropleth')
-    )
-    usmap.update_layout(
-        title={
-            'text': map_title,
-            'y': 0.9,
-            'x': 0.5,
-            'xanchor': 'center',
-            'yanchor': 'top',
-        }
-    )
 
-    return usmap, included
+# Keep track of the dates the line graph is zoomed to -- runs in the browser, passing on only changes to the x axis
+app.clientside_callback(
+    ClientsideFunction(namespace='covid', function_name='graph_window'),
+    Output(component_id='graph_window', component_property='data'),
+    [Input(component_id='line_graph', component_property='relayoutData')]
+)
 
 
-# Update scatter plot based off of chosen region & moving average period
+# Update scatter plot based off of chosen region, moving average period & variable -- or compare the regions picked in
+# the comparison drop-down, all gathered in one go
+# Only the values are sent -- the browser draws them onto the graph template & shared date axis. The dates zoomed to
+# are sent a point a day where that fits, & the rest of the history a point a month
 @app.callback(
-    Output(component_id='line_graph', component_property='figure'),
+    Output(component_id='graph_data', component_property='data'),
     [
         Input(component_id='state_dd', component_property='value'),
         Input(component_id='county_dd', component_property='value'),
-        Input(component_id='moving_avg', component_property='value')
+        Input(component_id='moving_avg', component_property='value'),
+        Input(component_id='graph_metric', component_property='value'),
+        Input(component_id='compare_dd', component_property='value'),
+        Input(component_id='compare_variable', component_property='value'),
+        Input(component_id='graph_window', component_property='data')
     ],
-    # State(component_id='line_graph', component_property='layout')
+    [State(component_id='axes', component_property='data'),
+     State(component_id='scope', component_property='data')]
 )
-def update_scatter_plot(state, county, mavgpd):
-    # Aggregate data at the correct level
-    if state == 'unused':
-        # Set title
-        graph_title = 'United States'
-        # Set region (for filtering later)
-        region = 'US'
-        # Generate time series of cases & deaths for the United States of America
-        TotalCases = CtyCases.groupby(level='Country').sum()
-        TotalDeaths = CtyDeaths.groupby(level='Country').sum()
-    elif county == 'unused':
-        # Set title
-        graph_title = state
-        # Set region (for filtering later)
-        region = state
-        # Generate time series of cases & deaths for the selected state
-        TotalCases = CtyCases.groupby(level='State').sum().sort_values(str(list(CtyCases.columns.values)[-1]), ascending=False)
-        TotalDeaths = CtyDeaths.groupby(level='State').sum().sort_values(str(list(CtyCases.columns.values)[-1]), ascending=False)
+@instrument.callback
+def update_scatter_plot(state, county, mavgpd, metric, compare, compare_variable, visible, axes, scope):
+    timer = instrument.Stopwatch('update_scatter_plot')
+
+    # Read everything from one version of the page's scope's data
+    data = current(scope=scope)
+    if data is None:
+        raise PreventUpdate
+
+    # Serve repeat views straight from the cache
+    # (the moving average period doesn't change a derived metric's graph, & zooms within the same months share points)
+    metric = metric or 'new'
+    period = 0
+    if metric == 'new':
+        # The box only offers the precomputed periods, but anything can be typed (or posted) into it
+        try:
+            period = int(mavgpd)
+        except (TypeError, ValueError):
+            raise PreventUpdate
+        if period not in AVERAGE_PERIODS:
+            raise PreventUpdate
+    window = graph_window(data, visible)
+    if compare:
+        regions = tuple(region_key(value) for value in compare[:MaxRegions])
+        variable = 'Deaths' if compare_variable == 'Deaths' else 'Cases'
+        cache_key = ('compare', data.version, regions, variable, period, metric, window)
+        build = lambda: compare_view(data, list(regions), variable, period, metric, window)
     else:
-        # Set title
-        graph_title = county + ' County, ' + state
-        # Set region (for filtering later)
-        region = county
-        # Generate time series of cases & deaths for the selected state and county
-        TotalCases = CtyCases.xs(state, level='State').groupby(level='County').sum().sort_values(str(list(CtyCases.columns.values)[-1]), ascending=False)
-        TotalDeaths = CtyDeaths.xs(state, level='State').groupby(level='County').sum().sort_values(str(list(CtyCases.columns.values)[-1]), ascending=False)
-
-    # Turn total data into daily new data
-    NewCases = TotalCases.transpose().diff()
-    NewDeaths = TotalDeaths.transpose().diff()
-
-    # Graph configuration
-    cases_color = 'yellow'
-    deaths_color = 'red'
-
-    # Set up figure
-    scatter = go.Figure()
-    scatter.layout.template = 'plotly_dark'
-    scatter.update_layout(
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list([
-                    dict(count=14,
-                         label="14 Days",
-                         step="day",
-                         stepmode="backward"),
-                    dict(count=1,
-                         label="1 Month",
-                         step="month",
-                         stepmode="backward"),
-                    dict(label="All",
-                         step="all")
-                ]),
-                x=0.5,
-                xanchor='center',
-                bgcolor='#121212',  # Background when not clicked - dark black
-                activecolor='#272623',  # Background when clicked - gray
-                bordercolor='#ffffff',  # Border color - white
-                font=dict(color='#ffffff')  # Font color - white
-            ),
-            rangeslider=dict(
-                visible=True
-            ),
-            type='date'
-        ),
-        title={
-            'text': graph_title,
-            'x': 0.5,
-            'xanchor': 'center'
-        },
-        legend=dict(
-            orientation='h',
-            x=0.5,
-            xanchor='center',
-            y=-0.6,
-            yanchor='top')
-    )
-
-    # Add newly confirmed cases to graph
-    scatter.add_trace(
-        go.Scatter(
-            x=[datetime.datetime.strptime(x, '%m/%d/%y') for x in CtyCases.columns.values],
-            y=NewCases[region],
-            name='Newly Confirmed Cases',
-            line=dict(color=cases_color)
-        )
-    )
-
-    # Add moving average of newly confirmed cases to graph
-    scatter.add_trace(
-        go.Scatter(
-            x=[datetime.datetime.strptime(x, '%m/%d/%y') for x in CtyCases.columns.values],
-            y=NewCases[region].rolling(int(mavgpd)).mean(),
-            name='Moving Avg of Confirmed Cases',
-            line=dict(color=cases_color, dash='dash')
-        )
-    )
-
-    # Add deaths to graph
-    scatter.add_trace(
-        go.Scatter(
-            x=[datetime.datetime.strptime(x, '%m/%d/%y') for x in CtyDeaths.columns.values],
-            y=NewDeaths[region],
-            name='Deaths',
-            line=dict(color=deaths_color)
-        )
-    )
+        # Pull the precomputed new time series of cases & deaths for the region, with their moving averages (or the
+        # precomputed metric)
+        cache_key = ('scatter', data.version, state, county, period, metric, window)
+        build = lambda: graph_view(data, state, county, period, metric, window)
+
+    timer.lap('lookup')
+
+    try:
+        scatter = figure_cache.get_or_build(cache_key, timer.build(build))
+    except KeyError:
+        # Picked from a page showing an older version of the data, with regions this one doesn't have
+        raise PreventUpdate
+    timer.cached()
+    scatter = with_axes(scatter, data, axes)
+    timer.lap('axes')
+    return scatter
 
-    # Add moving average of deaths to graph
-    scatter.add_trace(
-        go.Scatter(
-            x=[datetime.datetime.strptime(x, '%m/%d/%y') for x in CtyDeaths.columns.values],
-            y=NewDeaths[region].rolling(int(mavgpd)).mean(),
-            name='Moving Avg of Deaths',
-            line=dict(color=deaths_color, dash='dash')
-        )
-    )
 
-    return scatter
+# Draw the line graph in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='covid', function_name='render_graph'),
+    Output(component_id='line_graph', component_property='figure'),
+    [Input(component_id='graph_data', component_property='data')],
+    [State(component_id='graph_base', component_property='data'),
+     State(component_id='axes', component_property='data')]
+)
 
 
 # Chained Callback for Animated Date Slider (1 of 2)
-# When  the 'play' button is clicked, enable the interval
-@app.callback(
+# When  the 'play' button is clicked, enable the interval -- runs in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='covid', function_name='play_button'),
     [Output(component_id='interval', component_property='n_intervals'),
      Output(component_id='interval', component_property='max_intervals')],
-    [Input(component_id='play_button', component_property='n_clicks')]
+    [Input(component_id='play_button', component_property='n_clicks')],
+    [State(component_id='date_slider', component_property='max'),
+     State(component_id='date_slider', component_property='marks'),
+     State(component_id='date_slider', component_property='step')]
 )
-def play_button(play_clicks):
-    if play_clicks:                         # Ensure nothing happens when page loads (when play_clicks==0)
-        # if play_clicks % 2 == 1:            # Use mod 2 to toggle between play/stop
-        return 0, num_dates-1           # Set max_ints to allow interval to run
-    return 0, 0                         # Don't do anything when this callback fires on page load (when play_clicks==0)
 
 
 # Chained Callback for Animated Date Slider (2 of 2)
-# Once the interval has been enabled, use the interval to adjust the date slider
-@app.callback(
+# Once the interval has been enabled, use the interval to adjust the date slider -- runs in the browser, and so does
+# the map redraw it triggers, so playback never touches the server
+app.clientside_callback(
+    ClientsideFunction(namespace='covid', function_name='animate_map'),
     [Output(component_id='date_slider', component_property='value'),
      Output(component_id='play_button', component_property='children')],
-    [Input(component_id='interval', component_property='n_intervals')])
-def animate_map(n_intervals):
-    if n_intervals == 0:             # Interval has not started
-        return num_dates-1, 'Play'
-    elif n_intervals == num_dates-1:    # Interval has ended
-        return num_dates-1, 'Play'
-    else:                               # Interval is running
-        return (n_intervals % (num_dates-1)) + 1, 'Stop'
+    [Input(component_id='interval', component_property='n_intervals')],
+    [State(component_id='date_slider', component_property='max'),
+     State(component_id='date_slider', component_property='marks'),
+     State(component_id='date_slider', component_property='step')]
+)
 
 
 # Chained Callback for Interactive Region Inputs (1 of 2)
@@ -539,43 +531,35 @@ def animate_map(n_intervals):
      Output(component_id='country_toggle', component_property='disabled'),
      Output(component_id='state_dd', component_property='options'),
      Output(component_id='county_dd', component_property='options'),
-     Output(component_id='county_dd', component_property='value')],
+     Output(component_id='county_dd', component_property='value'),
+     Output(component_id='graph_metric', component_property='options'),
+     Output(component_id='graph_metric', component_property='value')],
     [Input(component_id='state_dd', component_property='value'),
-     Input(component_id='dd-sort', component_property='value')]
+     Input(component_id='dd-sort', component_property='value')],
+    [State(component_id='graph_metric', component_property='value'),
+     State(component_id='scope', component_property='data')]
 )
-def interactive_inputs(st, sort):
-    # Populate the state drop down menu
-    if sort == 'cases':
-        # Pull lists of states by decreasing amount of total COVID cases
-        StateList = list(CtyCases.groupby(level='State').sum().sort_values(
-            str(list(CtyCases.columns.values)[-1]), ascending=False).index.values)
-    else:
-        # Pull lists of states by decreasing amount of total COVID cases
-        StateList = list(CtyCases.groupby(level='State').sum().index.values)
+@instrument.callback
+def interactive_inputs(st, sort, metric, scope):
+    # Read everything from one version of the page's scope's data
+    data = current(scope=scope)
+    if data is None:
+        raise PreventUpdate
 
-    # Build state drop down menu
-    state_dd_list = [{'label': 'Select a state', 'value': 'unused'}]
-    for state_name in StateList:
-        state_dd_list.append({'label': state_name, 'value': state_name})
+    # Drop-down options are built once per version of the data
+    sort = 'cases' if sort == 'cases' else 'abc'
+    state_dd_list = data.StateOptions[sort]
 
     # If the user has picked a state, enable the country button & fill in the county selection options
-    if st in list(us_state_abbrev.keys()):
-        cty_dd_list = [{'label': 'Select a county', 'value': 'unused'}]
-        if sort == 'cases':
-            # Add counties by decreasing amount of total COVID cases
-            for cty in list(CtyCases.xs(st, level='State').groupby(level='County').sum().sort_values(
-                    str(list(CtyCases.columns.values)[-1]), ascending=False).index.values):
-                cty_dd_list.append({'label': cty, 'value': cty})
-        else:
-            # Add counties alphabetically
-            for cty in list(CtyCases.xs(st, level='State').groupby(level='County').sum().index.values):
-                cty_dd_list.append({'label': cty, 'value': cty})
-        return 'Show United States of America', True, False, state_dd_list, cty_dd_list, 'unused'
-
-    # If the state was reset to unused, the graph is showing the United States of America
+    if st in data.CountyOptions[sort]:
+        return 'Show ' + data.Scope.long_name, True, False, state_dd_list, data.CountyOptions[sort][st], 'unused', \
+            graph_options(), dash.no_update
+
+    # If the state was reset to unused, the graph is showing the whole country (or world), which has no rank
     else:
-        return 'Showing United States of America', False, True, state_dd_list, [
-            {'label': 'Select a county', 'value': 'unused'}], 'unused'
+        return 'Showing ' + data.Scope.long_name, False, True, state_dd_list, [
+            {'label': 'Select a ' + data.Scope.subregions, 'value': 'unused'}], 'unused', \
+            graph_options(country=True), 'new' if metric == 'rank' else dash.no_update
 
 
 # Chained Callback for Interactive Region Inputs (2 of 2)
@@ -584,6 +568,7 @@ def interactive_inputs(st, sort):
     Output(component_id='state_dd', component_property='value'),
     [Input(component_id='country_toggle', component_property='n_clicks')]
 )
+@instrument.callback
 def reset_state(st):
     return 'unused'
 
@@ -598,6 +583,7 @@ def reset_state(st):
     [Input(component_id='show_tutorial', component_property='n_clicks')],
     [State(component_id='region_sel_popover', component_property='is_open')]
 )
+@instrument.callback
 def toggle_popover(n, is_open):
     if n:
         return [not is_open] * 4
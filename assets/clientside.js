@@ -0,0 +1,190 @@
+// Clientside callbacks -- map & graph drawing and date playback run in the browser without a server round trip
+(function() {
+    // Unpack a base64 float32 array from the server (see covid_figures.pack_values) -- NaN becomes null (a gap)
+    function unpack(packed) {
+        var binary = atob(packed);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        var floats = new Float32Array(bytes.buffer);
+        var values = new Array(floats.length);
+        for (var j = 0; j < floats.length; j++) {
+            values[j] = isNaN(floats[j]) ? null : floats[j];
+        }
+        return values;
+    }
+
+    // Unpacking the map's values once per payload keeps playback cheap -- remember the last one
+    var lastMap = {packed: null, values: null};
+    function mapValues(frames) {
+        if (lastMap.packed !== frames.z) {
+            lastMap = {packed: frames.z, values: unpack(frames.z)};
+        }
+        return lastMap.values;
+    }
+
+    // Index of the first of days (ascending) on or after day -- the last one if there isn't one
+    function position(days, day) {
+        for (var i = 0; i < days.length; i++) {
+            if (days[i] >= day) {
+                return i;
+            }
+        }
+        return days.length - 1;
+    }
+
+    // Days the date slider stops at -- every day from 1 to last_date, or only its marks when it has no step (long
+    // histories are stepped through a week or a month at a time, see covid_store.slider_days)
+    function sliderDays(last_date, marks, step) {
+        var days = [];
+        if (step) {
+            for (var day = 1; day <= last_date; day++) {
+                days.push(day);
+            }
+            return days;
+        }
+        return Object.keys(marks || {}).map(Number).sort(function(a, b) { return a - b; });
+    }
+
+    // County map dates asked of the server -- at most one request is in flight, and positions the slider passes while
+    // it is are skipped, so the server only ever works on the latest date
+    var mapDate = {sent: null, modifiers: null, sentAt: 0, inFlight: false};
+    // Milliseconds after which a request that never came back stops holding the next one up
+    var StaleMs = 5000;
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        covid: {
+            // Pass the slider's date on to the county map (see COVID_Website.py) -- returns the date to ask for &
+            // whether to stop the timer that checks back while a request is in flight
+            map_date: function(date, modifiers, n_intervals) {
+                var no_update = window.dash_clientside.no_update;
+                var key = JSON.stringify(modifiers || []);
+                var switched = key !== mapDate.modifiers;
+                mapDate.modifiers = key;
+                // The state map has every date already
+                if ((modifiers || []).indexOf('county') === -1 || date === mapDate.sent) {
+                    return [no_update, true];
+                }
+                // Wait for the request in flight (unless the map has just been switched, which asks right away)
+                if (mapDate.inFlight && !switched && Date.now() - mapDate.sentAt < StaleMs) {
+                    return [no_update, false];
+                }
+                mapDate = {sent: date, modifiers: key, sentAt: Date.now(), inFlight: true};
+                return [date, false];
+            },
+
+            // Draw the map for one date from the per-date values sent by the server (see covid_figures.map_frames)
+            render_map: function(frames, date, base, axes) {
+                if (!frames || !base) {
+                    return window.dash_clientside.no_update;
+                }
+                axes = frames.axes || axes;
+                var county = frames.level === 'County';
+                if (county && frames.day === mapDate.sent) {
+                    mapDate.inFlight = false;
+                }
+                var days = frames.shape[0], regions = frames.shape[1];
+                // The county map is sent one date at a time -- draw the date it was sent for. The state map has a frame
+                // for every day, or for each day the slider stops at
+                var i = county ? 0 : frames.days ? position(frames.days, date) : Math.max(0, Math.min(date, days - 1));
+                var z = mapValues(frames).slice(i * regions, (i + 1) * regions);
+                var zmin = null, zmax = null;
+                for (var j = 0; j < z.length; j++) {
+                    if (z[j] !== null && (zmax === null || z[j] > zmax)) {
+                        zmax = z[j];
+                    }
+                    if (z[j] !== null && (zmin === null || z[j] < zmin)) {
+                        zmin = z[j];
+                    }
+                }
+                var trace = Object.assign({}, county ? base.county_trace : base.trace, {
+                    locations: county ? axes.county_locations : axes.locations,
+                    z: z,
+                    zmax: zmax
+                });
+                // Metrics that go negative are coloured from their lowest value, & ranks are coloured the other way
+                if (frames.signed) {
+                    trace.zmin = zmin;
+                }
+                if (frames.reversed) {
+                    trace.reversescale = true;
+                }
+                var day = county ? frames.day : frames.days ? frames.days[i] : i;
+                var title = Object.assign({}, base.title, {text: frames.title + axes.dates[day]});
+                return {data: [trace], layout: Object.assign({}, base.layout, {title: title})};
+            },
+
+            // Visible part of the line graph's x axis once the user zooms or pans it -- [first, last] ISO dates, or
+            // null for the whole history (see covid_figures.graph_window). Other relayouts leave it as it is
+            graph_window: function(relayout) {
+                var no_update = window.dash_clientside.no_update;
+                if (!relayout) {
+                    return no_update;
+                }
+                if (relayout['xaxis.autorange']) {
+                    return null;
+                }
+                var range = relayout['xaxis.range'] || [relayout['xaxis.range[0]'], relayout['xaxis.range[1]']];
+                if (range[0] === undefined || range[1] === undefined) {
+                    return no_update;
+                }
+                return [String(range[0]).slice(0, 10), String(range[1]).slice(0, 10)];
+            },
+
+            // Draw the line graph from one region's values (see covid_figures.graph_frames) on the shared date axis
+            // -- or, when the server only sent some days (a point a week or a month, or downsampled), on those days
+            render_graph: function(values, base, axes) {
+                if (!values || !base) {
+                    return window.dash_clientside.no_update;
+                }
+                axes = values.axes || axes;
+                var days = values.shape[1];
+                var y = unpack(values.y);
+                var title = Object.assign({}, base.layout.title, {text: values.title});
+                // Dates of the points -- shared by every trace, or a row per region when comparing
+                var x = axes.days, kept = null;
+                if (values.x) {
+                    kept = unpack(values.x).map(function(day) { return axes.days[day]; });
+                    x = kept.length === days ? kept : x;
+                }
+                // Comparing regions -- one trace each, on the days the server kept for it when it downsampled
+                if (values.regions) {
+                    var compared = values.regions.map(function(name, i) {
+                        var points = kept && kept.length > days ? kept.slice(i * days, (i + 1) * days) : x;
+                        return {type: 'scatter', name: name, x: points, y: y.slice(i * days, (i + 1) * days)};
+                    });
+                    return {data: compared, layout: Object.assign({}, base.layout, {title: title})};
+                }
+                // Derived metrics are drawn with their own traces, named by the server
+                var traces = values.names ? base.metric_traces : base.traces;
+                var data = traces.map(function(trace, i) {
+                    var drawn = Object.assign({}, trace, {x: x, y: y.slice(i * days, (i + 1) * days)});
+                    if (values.names) {
+                        drawn.name = values.names[i];
+                    }
+                    return drawn;
+                });
+                return {data: data, layout: Object.assign({}, base.layout, {title: title})};
+            },
+
+            // When the 'play' button is clicked, enable the interval (slider max is the last date) -- one tick for
+            // each day the slider stops at
+            play_button: function(play_clicks, last_date, marks, step) {
+                if (play_clicks) {                  // Ensure nothing happens when page loads (when play_clicks==0)
+                    return [0, sliderDays(last_date, marks, step).length];   // Set max_ints to allow interval to run
+                }
+                return [0, 0];
+            },
+
+            // Once the interval has been enabled, use the interval to adjust the date slider
+            animate_map: function(n_intervals, last_date, marks, step) {
+                var days = sliderDays(last_date, marks, step);
+                if (!n_intervals || n_intervals >= days.length) {    // Interval has not started or has ended
+                    return [last_date, 'Play'];
+                }
+                return [days[n_intervals], 'Stop'];                  // Interval is running
+            }
+        }
+    });
+})();
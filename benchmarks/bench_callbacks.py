@@ -0,0 +1,243 @@
+# Benchmark the dashboard's startup & callbacks against synthetic JHU-format data
+# Generates the data (see synthetic.py), loads it through the app's real loading path, then reports latency
+# percentiles, throughput & peak memory per callback. Results are written to benchmarks/results/<commit>.json so runs
+# from different commits can be compared with --compare
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ResultsDir = os.path.join(Root, 'benchmarks', 'results')
+sys.path.insert(0, Root)
+
+# Child process timing `import COVID_Website` -- prints seconds & peak RSS (KiB) as JSON
+StartupScript = '''
+import json, resource, sys, time
+sys.path.insert(0, %r)
+start = time.perf_counter()
+import COVID_Website
+print(json.dumps({'seconds': time.perf_counter() - start,
+                  'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+
+# Commit being benchmarked (with a marker when the tree has uncommitted changes)
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=Root, text=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD', '--', '*.py'], cwd=Root)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + ('-dirty' if dirty else '')
+
+
+# Environment pointing the app at the synthetic data of a scope, with its own snapshot folder & no background refresh
+def app_environment(data_dir, snapshot_dir, scope='us'):
+    env = dict(os.environ)
+    env.update({
+        'COVID_DATA_URL': data_dir,
+        'COVID_SNAPSHOT_DIR': snapshot_dir,
+        'COVID_REFRESH_SECONDS': '0',
+        'COVID_SCOPES': scope,
+    })
+    env.pop('COVID_FIGURE_CACHE_DIR', None)
+    return env
+
+
+# Time `import COVID_Website` in fresh processes -- the first run parses the CSVs, later runs load the snapshot
+def bench_startup(data_dir, snapshot_dir, runs, scope='us'):
+    env = app_environment(data_dir, snapshot_dir, scope)
+    results = {}
+    for label, count in [('cold', 1), ('warm', runs)]:
+        samples = []
+        for _ in range(count):
+            output = subprocess.check_output([sys.executable, '-c', StartupScript % Root], env=env, text=True)
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+        results[label] = summarise([s['seconds'] for s in samples])
+        results[label]['peak_rss_kib'] = max(s['peak_rss_kib'] for s in samples)
+    return results
+
+
+# Latency percentiles (milliseconds) & throughput for a list of durations in seconds
+def summarise(seconds):
+    ms = np.array(seconds) * 1000
+    return {
+        'calls': len(ms),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p90_ms': float(np.percentile(ms, 90)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'max_ms': float(ms.max()),
+        'throughput_per_s': float(len(ms) / (ms.sum() / 1000)) if ms.sum() else float('inf'),
+    }
+
+
+# Argument lists for each callback, covering the inputs users actually send -- names after a colon mark a variant
+def callback_inputs(app, rng):
+    from covid_metrics import METRICS
+
+    data = app.current()
+    scope = data.scope
+    states = data.series.states
+    # The browser's copy of the dates & locations, as sent with a page loaded from the current data
+    axes = {'version': data.version}
+    inputs = {
+        'update_map': [(variable, modifiers, data.num_dates - 1, axes, scope) for variable in ['Cases', 'Deaths']
+                       for modifiers in [['', ''], ['percap'], ['totals'], ['percap', 'totals']]],
+        'update_map:metric': [(variable + ':' + metric, ['', ''], data.num_dates - 1, axes, scope)
+                              for variable in ['Cases', 'Deaths'] for metric in METRICS],
+        # The county map is fetched a date at a time
+        'update_map:county': [(rng.choice(['Cases', 'Deaths']), ['county'] + rng.choice([[], ['percap'], ['totals']]),
+                               rng.randrange(data.num_dates), axes, scope) for _ in range(50)],
+        'interactive_inputs': [(state, sort, 'new', scope) for state in ['unused'] + states
+                               for sort in ['abc', 'cases']],
+        'update_scatter_plot': [],
+        # Comparisons of 10-50 states & counties
+        'update_scatter_plot:compare': [
+            (states[0], 'unused', str(rng.randint(2, 14)), rng.choice(['new'] + list(METRICS)),
+             [option['value'] for option in rng.sample(data.RegionOptions, rng.randint(10, 50))],
+             rng.choice(['Cases', 'Deaths']), None, axes, scope) for _ in range(50)],
+        # The line graph zoomed in to a few weeks or months
+        'update_scatter_plot:zoom': [],
+    }
+    # Scopes without a county map (the world) have no county map to fetch
+    if not data.Scope.subregion_map:
+        del inputs['update_map:county']
+    for _ in range(100):
+        state = rng.choice(['unused'] + states)
+        county = 'unused'
+        if state != 'unused' and rng.random() < 0.5:
+            county = rng.choice([c for c in data.series.counties[data.series.state_rows(state)] if c] or ['unused'])
+        metric = rng.choice(['new'] * len(METRICS) + list(METRICS))
+        inputs['update_scatter_plot'].append((state, county, str(rng.randint(2, 14)), metric, [], 'Cases', None, axes,
+                                              scope))
+        first = rng.randrange(data.num_dates)
+        visible = [data.DateAxis[first], data.DateAxis[min(first + rng.choice([14, 30, 90]), data.num_dates - 1)]]
+        inputs['update_scatter_plot:zoom'].append((state, county, '7', metric, [], 'Cases', visible, axes, scope))
+    return inputs
+
+
+# Time each callback, serialising its output the way Dash does -- the figure cache is cleared before every call
+# unless cached is set, so uncached numbers measure the real work
+def bench_callbacks(app, repeat, cached, seed):
+    import dash
+    import plotly.utils
+
+    rng = random.Random(seed)
+    results = {}
+    for name, argument_lists in callback_inputs(app, rng).items():
+        callback = getattr(app, name.split(':')[0])
+        callback = getattr(callback, '__wrapped__', callback)
+        version = app.current().version
+
+        def run(arguments):
+            if not cached:
+                app.figure_cache.invalidate(version)
+            output = callback(*arguments)
+            # Dash leaves outputs that aren't updated out of the response
+            if isinstance(output, (list, tuple)):
+                output = [part for part in output if part is not dash.no_update]
+            return len(json.dumps(output, cls=plotly.utils.PlotlyJSONEncoder))
+
+        # Latency & throughput
+        samples = []
+        response_bytes = []
+        for _ in range(repeat):
+            for arguments in argument_lists:
+                start = time.perf_counter()
+                response_bytes.append(run(arguments))
+                samples.append(time.perf_counter() - start)
+        results[name] = summarise(samples)
+        results[name]['mean_response_bytes'] = float(np.mean(response_bytes))
+
+        # Peak Python memory allocated during one pass over the inputs
+        tracemalloc.start()
+        for arguments in argument_lists:
+            run(arguments)
+        results[name]['peak_alloc_kib'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return results
+
+
+# Print the ratio of each latency figure in this run to the same figure in an earlier results file
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print('\nCompared with %s (%s):' % (baseline_path, baseline.get('commit')))
+    for section in ['startup', 'callbacks']:
+        for name, stats in results[section].items():
+            before = baseline.get(section, {}).get(name)
+            if not before:
+                continue
+            ratios = ['%s x%.2f' % (key, stats[key] / before[key]) for key in ['p50_ms', 'p90_ms', 'p99_ms']
+                      if before.get(key)]
+            print('  %-40s %s' % (name, '  '.join(ratios)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark COVID_Website startup & callbacks on synthetic data')
+    parser.add_argument('--scope', choices=['us', 'global'], default='us')
+    parser.add_argument('--counties', type=int, default=3300,
+                        help='counties, or with --scope global provinces (on top of a row per country)')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=5, help='passes over each callback\'s inputs')
+    parser.add_argument('--startup-runs', type=int, default=3)
+    parser.add_argument('--cached', action='store_true', help='leave the figure cache on between calls')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default benchmarks/results/<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='covid-bench-') as scratch:
+        data_dir = os.path.join(scratch, 'data')
+        snapshot_dir = os.path.join(scratch, 'snapshots')
+        # The app's modules read their settings on import, so point them at the synthetic data first
+        os.environ.update(app_environment(data_dir, snapshot_dir, args.scope))
+        from benchmarks.synthetic import write_synthetic, write_global
+        write = write_global if args.scope == 'global' else write_synthetic
+        write(data_dir, args.counties, args.days, args.seed)
+
+        startup = bench_startup(data_dir, snapshot_dir, args.startup_runs, args.scope)
+
+        # Import the app in this process too, through the same loading path
+        import COVID_Website as app
+        callbacks = bench_callbacks(app, args.repeat, args.cached, args.seed)
+
+    results = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'params': vars(args),
+        'startup': startup,
+        'callbacks': callbacks,
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+    print('%-40s %8s %8s %8s %10s %12s' % ('', 'p50 ms', 'p90 ms', 'p99 ms', 'calls/s', 'peak KiB'))
+    for section in ['startup', 'callbacks']:
+        for name, stats in results[section].items():
+            memory = stats.get('peak_alloc_kib', stats.get('peak_rss_kib', 0))
+            print('%-40s %8.2f %8.2f %8.2f %10.1f %12.0f' % (
+                section + ':' + name, stats['p50_ms'], stats['p90_ms'], stats['p99_ms'], stats['throughput_per_s'],
+                memory))
+
+    output = args.output or os.path.join(ResultsDir, results['commit'] + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('\nResults written to ' + output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
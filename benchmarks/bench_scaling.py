@@ -0,0 +1,81 @@
+# Benchmark how callback latency grows with the number of regions
+# Runs bench_callbacks.py in a fresh process for each scope, at a base number of regions & at --factor times as many,
+# then prints each callback's latency & response size at both sizes side by side. Callbacks reading precomputed
+# country/state aggregates should stay flat -- the county map & county drop-downs send every county, so they grow with
+# them. Results are written to benchmarks/results/scaling-<commit>.json
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, Root)
+from benchmarks.bench_callbacks import ResultsDir, git_commit
+from benchmarks.synthetic import OtherCountries, global_countries
+from covid_scopes import us_state_abbrev
+
+# Regions (rows of the time series) each scope is benchmarked with before scaling up -- about the real files' sizes
+BaseRegions = {'us': 3356, 'global': 300}
+
+
+# Rows the synthetic data of a scope has on top of the counties/provinces asked for -- the US's 'Unassigned' row in
+# every state, the world's own row for every country
+def extra_rows(scope):
+    if scope == 'global':
+        return len(global_countries()[0]) + len(OtherCountries)
+    return len(us_state_abbrev)
+
+
+# Run bench_callbacks.py for a scope with the given number of regions -- returns its results
+def run_bench(scope, regions, days, repeat, seed):
+    with tempfile.TemporaryDirectory(prefix='covid-scaling-') as scratch:
+        output = os.path.join(scratch, 'results.json')
+        subprocess.check_call([sys.executable, os.path.join(Root, 'benchmarks', 'bench_callbacks.py'),
+                               '--scope', scope, '--counties', str(regions - extra_rows(scope)), '--days', str(days),
+                               '--repeat', str(repeat), '--startup-runs', '1', '--seed', str(seed),
+                               '--output', output], stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark callback latency as the number of regions grows')
+    parser.add_argument('--scopes', nargs='+', choices=list(BaseRegions), default=list(BaseRegions))
+    parser.add_argument('--factor', type=int, default=10, help='how many times the base number of regions to try')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=3, help='passes over each callback\'s inputs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default benchmarks/results/scaling-<commit>.json)')
+    args = parser.parse_args()
+
+    results = {'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'params': vars(args), 'scopes': {}}
+    for scope in args.scopes:
+        sizes = [BaseRegions[scope], BaseRegions[scope] * args.factor]
+        runs = [run_bench(scope, regions, args.days, args.repeat, args.seed) for regions in sizes]
+        results['scopes'][scope] = {str(regions): run for regions, run in zip(sizes, runs)}
+
+        print('\n%s: %d -> %d regions' % (scope, sizes[0], sizes[1]))
+        print('%-36s %9s %9s %7s %11s %11s %7s' % ('', 'p50 ms', 'p50 ms', 'ratio', 'bytes', 'bytes', 'ratio'))
+        for name, before in runs[0]['callbacks'].items():
+            after = runs[1]['callbacks'][name]
+            print('%-36s %9.2f %9.2f %7.2f %11.0f %11.0f %7.2f' % (
+                name, before['p50_ms'], after['p50_ms'], after['p50_ms'] / before['p50_ms'],
+                before['mean_response_bytes'], after['mean_response_bytes'],
+                after['mean_response_bytes'] / before['mean_response_bytes']))
+        for label in ['cold', 'warm']:
+            before, after = runs[0]['startup'][label], runs[1]['startup'][label]
+            print('%-36s %9.0f %9.0f %7.2f' % ('startup:' + label, before['p50_ms'], after['p50_ms'],
+                                               after['p50_ms'] / before['p50_ms']))
+
+    output = args.output or os.path.join(ResultsDir, 'scaling-' + results['commit'] + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('\nResults written to ' + output)
+
+
+if __name__ == '__main__':
+    main()
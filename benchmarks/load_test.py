@@ -0,0 +1,376 @@
+# Load test the dashboard the way browsers use it
+# Starts the app on synthetic JHU-format data (see synthetic.py) behind a pre-forking server with a fixed number of
+# worker processes & threads each, then has simulated users drive the real /_dash-update-component endpoint: loading
+# the page, playing the date animation (one update_map call per 500ms tick on the county map), dragging the date
+# slider, changing the map variable and picking regions (interactive_inputs then update_scatter_plot). Reports
+# throughput, latency percentiles & error rate for every combination of server processes, server threads & concurrent
+# users, e.g.
+#   python benchmarks/load_test.py --processes 1 2 4 --threads 1 4 --users 1 8 32 --duration 20
+import argparse
+import collections
+import concurrent.futures
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, Root)
+from benchmarks.bench_callbacks import ResultsDir, app_environment, git_commit, summarise
+
+# Seconds between Play animation ticks (the page's dcc.Interval) & between slider events while dragging
+PlayInterval = 0.5
+DragInterval = 0.05
+# Behaviours users pick between, with their default weights
+DefaultMix = {'visit': 1, 'play': 1, 'slider': 2, 'variable': 1, 'dropdown': 3}
+# Seconds the server gets to load the data & start answering
+StartTimeout = 300
+
+
+# Worker process loop of the pre-forking server -- a pool of threads answers the connections each process accepts
+def _serve_worker(app, listener, threads):
+    from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    class PooledServer(ThreadedWSGIServer):
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+    server = PooledServer('127.0.0.1', 0, app, QuietHandler, fd=listener.fileno())
+    server.pool = concurrent.futures.ThreadPoolExecutor(threads)
+    server.serve_forever()
+
+
+# Load the app once, then fork processes worker processes sharing one listening socket (like gunicorn's workers)
+def serve(port, processes, threads):
+    import COVID_Website
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', port))
+    listener.listen(1024)
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            _serve_worker(COVID_Website.app.server, listener, threads)
+            os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for child in children:
+            os.kill(child, signal.SIGTERM)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in children:
+        os.wait()
+
+
+# A free local port
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# One HTTP request -- returns (status, body)
+def request(port, method, path, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        headers = {'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'} if body is not None else {}
+        connection.request(method, path, body=None if body is None else json.dumps(body), headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+# Start the server in its own process & wait until it has the data -- returns the process
+def start_server(port, processes, threads, env):
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port),
+                               '--processes', str(processes), '--threads', str(threads)], env=env)
+    deadline = time.time() + StartTimeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('The server exited with %d' % server.returncode)
+        try:
+            if request(port, 'GET', '/ready')[0] == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('The server didn\'t start within %ds' % StartTimeout)
+
+
+# Output ids of a dependency, as Dash's renderer sends them -- multi-output callbacks are written ..a.b...c.d..
+def _outputs(output):
+    if not output.startswith('..'):
+        component, prop = output.rsplit('.', 1)
+        return {'id': component, 'property': prop}
+    return [dict(zip(['id', 'property'], part.rsplit('.', 1))) for part in output[2:-2].split('...')]
+
+
+# Everything users need to know about the running app -- its server-side callbacks (from /_dash-dependencies, keyed
+# by the component of their first output) & the regions, dates & data version to pick from
+def app_description(port):
+    dependencies = json.loads(request(port, 'GET', '/_dash-dependencies')[1])
+    callbacks = {}
+    for dependency in dependencies:
+        if dependency.get('clientside_function') is None:
+            outputs = _outputs(dependency['output'])
+            callbacks[(outputs[0] if isinstance(outputs, list) else outputs)['id']] = dependency
+    ready = json.loads(request(port, 'GET', '/ready')[1])
+    regions = json.loads(request(port, 'GET', '/api/map?level=county&format=json')[1])
+    return {
+        'callbacks': callbacks,
+        # The scope pages open on
+        'scope': ready['scope'],
+        'version': ready['version'],
+        'dates': ready['dates'],
+        'counties': [(state, county) for state, county in zip(regions['state'], regions['county']) if county],
+        'states': sorted(set(regions['state'])),
+    }
+
+
+# A simulated browser -- keeps the page's component values & sends the callbacks changing them would trigger
+class User:
+    def __init__(self, port, app, rng, pace, think, samples):
+        self.port = port
+        self.app = app
+        self.rng = rng
+        self.pace = pace
+        self.think = think
+        self.samples = samples
+        self.values = {
+            'variable-picker.value': 'Cases', 'modifiers.value': ['', ''], 'date_slider.value': app['dates'] - 1,
+            'map_date.data': app['dates'] - 1,
+            'state_dd.value': 'unused', 'county_dd.value': 'unused', 'moving_avg.value': '7',
+            'graph_metric.value': 'new', 'compare_dd.value': [], 'compare_variable.value': 'Cases',
+            'graph_window.data': None, 'scope.data': app['scope'],
+            'dd-sort.value': 'abc', 'axes.data': {'version': app['version']}, 'country_toggle.n_clicks': None,
+            'show_tutorial.n_clicks': None, 'region_sel_popover.is_open': False,
+        }
+
+    # Fire the callback updating output (a component id) after changed (an input, 'id.property') changed, recording
+    # its latency under output
+    def fire(self, output, changed=None):
+        dependency = self.app['callbacks'][output]
+        value = lambda ref: dict(ref, value=self.values.get('%s.%s' % (ref['id'], ref['property'])))
+        first = dependency['inputs'][0]
+        body = {
+            'output': dependency['output'],
+            'outputs': _outputs(dependency['output']),
+            'inputs': [value(ref) for ref in dependency['inputs']],
+            'state': [value(ref) for ref in dependency['state']],
+            'changedPropIds': [changed or '%s.%s' % (first['id'], first['property'])],
+        }
+        start = time.perf_counter()
+        try:
+            status = request(self.port, 'POST', '/_dash-update-component', body)[0]
+        except OSError:
+            status = None
+        # PreventUpdate comes back as a 204
+        self.samples.append((output, time.perf_counter() - start, status in (200, 204)))
+
+    def wait(self, seconds):
+        if seconds * self.pace > 0:
+            time.sleep(seconds * self.pace)
+
+    # Load the page -- the layout, then every callback fires once (except those the browser only fires on a change, such
+    # as picking another scope)
+    def visit(self):
+        for path in ['/', '/_dash-layout', '/_dash-dependencies']:
+            start = time.perf_counter()
+            try:
+                status = request(self.port, 'GET', path)[0]
+            except OSError:
+                status = None
+            self.samples.append((path, time.perf_counter() - start, status == 200))
+        for output, dependency in self.app['callbacks'].items():
+            if not dependency.get('prevent_initial_call'):
+                self.fire(output)
+
+    # Move the date slider -- the state map is drawn in the browser, so only the county map asks the server, one
+    # date at a time (a user here waits for each answer, as the page does before asking for the next date)
+    def move_slider(self, day):
+        self.values['date_slider.value'] = day
+        if 'county' in self.values['modifiers.value']:
+            self.values['map_date.data'] = day
+            self.fire('map_frames', 'map_date.data')
+
+    # Play the date animation from the start
+    def play(self, frames=20):
+        self.values['modifiers.value'] = self.rng.choice([['', ''], ['county'], ['county', 'percap']])
+        for day in range(1, min(frames, self.app['dates'])):
+            self.move_slider(day)
+            self.wait(PlayInterval)
+
+    # Drag the date slider across a few weeks
+    def slider(self, events=10):
+        start = self.rng.randrange(self.app['dates'])
+        for step in range(events):
+            self.move_slider(min(start + step, self.app['dates'] - 1))
+            self.wait(DragInterval)
+
+    # Pick another map variable or modifier
+    def variable(self):
+        self.values['variable-picker.value'] = self.rng.choice(['Cases', 'Deaths', 'Cases:growth', 'Deaths:wow'])
+        self.values['modifiers.value'] = self.rng.choice([['', ''], ['percap'], ['totals'], ['county']])
+        self.fire('map_frames', 'variable-picker.value')
+
+    # Pick a state -- interactive_inputs fills in the county drop-down (resetting its value), which chains into
+    # update_scatter_plot -- then maybe one of its counties
+    def dropdown(self):
+        state = self.rng.choice(self.app['states'])
+        self.values['state_dd.value'] = state
+        self.fire('country_toggle', 'state_dd.value')
+        self.values['county_dd.value'] = 'unused'
+        self.fire('graph_data', 'county_dd.value')
+        counties = [county for s, county in self.app['counties'] if s == state]
+        if counties and self.rng.random() < 0.5:
+            self.wait(self.think)
+            self.values['county_dd.value'] = self.rng.choice(counties)
+            self.fire('graph_data', 'county_dd.value')
+
+
+# Run users simulated users for duration seconds -- returns (action, seconds, ok) for every request they made
+def run_users(port, app, users, duration, mix, pace, think, seed):
+    samples = []
+    deadline = time.time() + duration
+
+    def run(number):
+        rng = random.Random(seed * 1000 + number)
+        user = User(port, app, rng, pace, think, samples)
+        behaviours = list(mix)
+        weights = [mix[name] for name in behaviours]
+        while time.time() < deadline:
+            getattr(user, rng.choices(behaviours, weights)[0])()
+            user.wait(think)
+
+    with concurrent.futures.ThreadPoolExecutor(users) as pool:
+        list(pool.map(run, range(users)))
+    return samples
+
+
+# Run one load level, spreading the users over client processes so the load generator isn't the bottleneck
+def run_load(port, app, users, duration, mix, pace, think, seed, client_processes):
+    client_processes = max(1, min(client_processes, users))
+    shares = [users // client_processes + (i < users % client_processes) for i in range(client_processes)]
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(client_processes) as pool:
+        futures = [pool.submit(run_users, port, app, share, duration, mix, pace, think, seed + i)
+                   for i, share in enumerate(shares)]
+        samples = [sample for future in futures for sample in future.result()]
+    return samples, time.perf_counter() - start
+
+
+# Throughput, latency percentiles & error rate of one load level, overall & per callback
+def report(samples, elapsed):
+    def stats(group):
+        result = summarise([seconds for _, seconds, _ in group]) if group else {'calls': 0}
+        result['throughput_per_s'] = len(group) / elapsed
+        result['error_rate'] = sum(not ok for _, _, ok in group) / len(group) if group else 0.0
+        return result
+
+    by_action = collections.defaultdict(list)
+    for sample in samples:
+        by_action[sample[0]].append(sample)
+    return {'all': stats(samples), 'actions': {name: stats(group) for name, group in sorted(by_action.items())}}
+
+
+# Parse --mix visit=1,play=2,... into weights
+def parse_mix(text):
+    mix = dict(DefaultMix)
+    if text:
+        mix = {}
+        for part in text.split(','):
+            name, _, weight = part.partition('=')
+            if name not in DefaultMix:
+                raise argparse.ArgumentTypeError('Unknown behaviour %r (choose from %s)' % (name, ', '.join(DefaultMix)))
+            mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test COVID_Website through /_dash-update-component')
+    parser.add_argument('--counties', type=int, default=3300)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1], help='server worker processes to try')
+    parser.add_argument('--threads', type=int, nargs='+', default=[4], help='threads per server process to try')
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 4, 16], help='concurrent users to try')
+    parser.add_argument('--duration', type=float, default=15, help='seconds of load per combination')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of unrecorded load before each server is '
+                                                                'measured')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DefaultMix),
+                        help='behaviour weights, e.g. visit=1,play=1,slider=2,variable=1,dropdown=3')
+    parser.add_argument('--pace', type=float, default=1,
+                        help='multiplier on the animation & slider timing (0 sends as fast as possible)')
+    parser.add_argument('--think', type=float, default=1, help='seconds users wait between actions')
+    parser.add_argument('--client-processes', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default benchmarks/results/load-<commit>.json)')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.processes[0], args.threads[0])
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='covid-load-') as scratch:
+        data_dir = os.path.join(scratch, 'data')
+        env = app_environment(data_dir, os.path.join(scratch, 'snapshots'))
+        from benchmarks.synthetic import write_synthetic
+        write_synthetic(data_dir, args.counties, args.days, args.seed)
+
+        print('%-10s %-8s %-6s %10s %8s %8s %8s %8s' % ('processes', 'threads', 'users', 'req/s', 'p50 ms', 'p90 ms',
+                                                        'p99 ms', 'errors'))
+        for processes in args.processes:
+            for threads in args.threads:
+                port = free_port()
+                server = start_server(port, processes, threads, env)
+                try:
+                    app = app_description(port)
+                    if args.warmup > 0:
+                        run_load(port, app, max(args.users), args.warmup, args.mix, args.pace, args.think, args.seed,
+                                 args.client_processes)
+                    for users in args.users:
+                        samples, elapsed = run_load(port, app, users, args.duration, args.mix, args.pace, args.think,
+                                                    args.seed, args.client_processes)
+                        cell = {'processes': processes, 'threads': threads, 'users': users}
+                        cell.update(report(samples, elapsed))
+                        results.append(cell)
+                        overall = cell['all']
+                        print('%-10d %-8d %-6d %10.1f %8.1f %8.1f %8.1f %7.2f%%' % (
+                            processes, threads, users, overall['throughput_per_s'], overall.get('p50_ms', 0),
+                            overall.get('p90_ms', 0), overall.get('p99_ms', 0), overall['error_rate'] * 100))
+                finally:
+                    server.terminate()
+                    server.wait()
+
+    output = args.output or os.path.join(ResultsDir, 'load-%s.json' % git_commit())
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': git_commit(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'params': {key: value for key, value in vars(args).items() if key != 'serve'},
+            'results': results,
+        }, f, indent=2)
+    print('\nResults written to ' + output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# Synthetic JHU-format time series for benchmarking
+# Writes time_series_covid19_confirmed_US.csv & time_series_covid19_deaths_US.csv with the same columns as the real
+# files, for any number of counties & days, so the app can be pointed at them with COVID_DATA_URL. With --scope global
+# writes the global files & lookup table instead, for any number of provinces spread over real countries
+import argparse
+import datetime
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from covid_data import CasesFile, DeathsFile, LookupFile
+from covid_figures import county_geometry_ids
+from covid_scopes import SCOPES, us_state_abbrev
+
+# First date in the JHU files
+FirstDate = datetime.date(2020, 1, 22)
+# Rows that aren't states/territories, which the loader has to filter out
+OtherRegions = ['Diamond Princess', 'Grand Princess']
+# Rows of the global files that aren't in the lookup table, so have no population or map code
+OtherCountries = ['MS Zaandam', 'Summer Olympics 2020']
+
+
+# JHU's date label for a date, e.g. '3/1/20'
+def date_label(date):
+    return '%d/%d/%s' % (date.month, date.day, date.strftime('%y'))
+
+
+# Date labels & cumulative cases & deaths of rows with the given populations -- daily increments grow with population
+# and never go negative
+def _counts(rng, population, days):
+    rows = len(population)
+    dates = [date_label(FirstDate + datetime.timedelta(days=d)) for d in range(days)]
+    rate = population[:, np.newaxis] / 2e6
+    cases = np.cumsum(rng.poisson(rate * 50, (rows, days)), axis=1, dtype=np.int64)
+    deaths = np.cumsum(rng.binomial(np.minimum(rng.poisson(rate * 50, (rows, days)), 100), 0.02), axis=1, dtype=np.int64)
+    return dates, cases, deaths
+
+
+# Write both files for counties x days into folder -- returns the two file paths
+def write_synthetic(folder, counties=3300, days=365, seed=0):
+    rng = np.random.default_rng(seed)
+    states = list(us_state_abbrev.keys())
+
+    # Spread the counties over the states, then add each state's 'Unassigned' row & a few non-state rows
+    state_of_row = [states[i % len(states)] for i in range(counties)] + states + OtherRegions
+    county_of_row = ['County %d' % i for i in range(counties)] + ['Unassigned'] * len(states) + [np.nan] * len(OtherRegions)
+    rows = len(state_of_row)
+    population = rng.integers(1000, 2000000, rows)
+    population[counties:] = 0
+
+    dates, cases, deaths = _counts(rng, population, days)
+
+    # Real FIPS codes for the counties (so they all appear on the county map), JHU's 900xx codes for 'Unassigned'
+    codes = sorted(county_geometry_ids())
+    fips = np.full(rows, np.nan)
+    fips[:counties] = [int(codes[i % len(codes)]) for i in range(counties)]
+    fips[counties:counties + len(states)] = 90000 + np.arange(len(states))
+
+    keys = pd.DataFrame({
+        'UID': 84000000 + np.arange(rows),
+        'iso2': 'US',
+        'iso3': 'USA',
+        'code3': 840,
+        'FIPS': fips,
+        'Admin2': county_of_row,
+        'Province_State': state_of_row,
+        'Country_Region': 'US',
+        'Lat': rng.uniform(25, 49, rows).round(6),
+        'Long_': rng.uniform(-124, -67, rows).round(6),
+    })
+    keys['Combined_Key'] = keys['Admin2'].fillna('') + ', ' + keys['Province_State'] + ', US'
+
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for file_name, values, extra in [(CasesFile, cases, {}), (DeathsFile, deaths, {'Population': population})]:
+        frame = pd.concat([keys.assign(**extra), pd.DataFrame(values, columns=dates)], axis=1)
+        path = os.path.join(folder, file_name)
+        frame.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+# Countries the global files are written with, as (names, ISO-3 codes) -- plotly's gapminder sample, for real codes
+def global_countries():
+    import plotly.data
+
+    countries = plotly.data.gapminder()[['country', 'iso_alpha']].drop_duplicates('country')
+    return countries['country'].tolist(), countries['iso_alpha'].tolist()
+
+
+# Write the global files & lookup table for provinces x days into folder -- every country gets a row of its own, then
+# the provinces are spread over them
+# Returns the three file paths
+def write_global(folder, provinces=150, days=365, seed=0):
+    rng = np.random.default_rng(seed)
+    names, codes = global_countries()
+
+    country_of_row = names + [names[i % len(names)] for i in range(provinces)] + OtherCountries
+    province_of_row = [np.nan] * len(names) + ['Province %d' % i for i in range(provinces)] + \
+        [np.nan] * len(OtherCountries)
+    rows = len(country_of_row)
+    population = rng.integers(1000, 20000000, rows)
+    dates, cases, deaths = _counts(rng, population, days)
+
+    keys = pd.DataFrame({
+        'Province/State': province_of_row,
+        'Country/Region': country_of_row,
+        'Lat': rng.uniform(-60, 70, rows).round(6),
+        'Long': rng.uniform(-180, 180, rows).round(6),
+    })
+    known = rows - len(OtherCountries)
+    code_of = dict(zip(names, codes))
+    # The lookup table also lists US counties, which the loader skips
+    lookup = pd.DataFrame({
+        'UID': np.arange(known + 2),
+        'iso2': '',
+        'iso3': [code_of[country] for country in country_of_row[:known]] + ['USA', 'USA'],
+        'code3': 0,
+        'FIPS': [np.nan] * known + [1001, 1003],
+        'Admin2': [np.nan] * known + ['Autauga', 'Baldwin'],
+        'Province_State': province_of_row[:known] + ['Alabama', 'Alabama'],
+        'Country_Region': country_of_row[:known] + ['US', 'US'],
+        'Lat': 0.0,
+        'Long_': 0.0,
+        'Combined_Key': '',
+        'Population': np.concatenate([population[:known], [55869, 223234]]),
+    })
+
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for file_name, values in zip(SCOPES['global'].files, [cases, deaths]):
+        path = os.path.join(folder, file_name)
+        pd.concat([keys, pd.DataFrame(values, columns=dates)], axis=1).to_csv(path, index=False)
+        paths.append(path)
+    path = os.path.join(folder, LookupFile)
+    lookup.to_csv(path, index=False)
+    return paths + [path]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic JHU-format COVID time series')
+    parser.add_argument('folder')
+    parser.add_argument('--counties', type=int, default=3300)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scope', choices=list(SCOPES), default='us',
+                        help='us writes --counties counties, global --counties provinces (plus a row per country)')
+    args = parser.parse_args()
+    write = write_global if args.scope == 'global' else write_synthetic
+    for path in write(args.folder, args.counties, args.days, args.seed):
+        print(path)
@@ -0,0 +1,256 @@
+# Read-only data API for the dashboard
+# Serves the precomputed aggregates as JSON or CSV from the Flask server, e.g.
+#   /api/series?state=Texas&county=Dallas&from=2020-06-01&to=2020-06-30&percap=1
+#   /api/map?date=2020-06-01&var=Cases&totals=1&level=county&format=csv
+# Any request can add scope=global (or another served scope, see covid_scopes) -- states & counties are then that
+# scope's regions & subregions, e.g. countries & provinces
+# Every response carries a strong ETag tied to the data version & the normalised query, and a Cache-Control max-age,
+# so repeat requests are answered with a 304 (or by a reverse proxy) from what's kept rather than sending the body
+# again. Bodies are gzipped once and kept, compressed & uncompressed, until the data changes
+import csv
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+
+import flask
+import numpy as np
+
+from covid_cache import FigureCache
+from covid_metrics import METRICS, split_variable
+from covid_refresh import current, current_versions, on_publish
+from covid_scopes import Scopes, DefaultScope
+from covid_store import VARIABLES
+
+# Seconds browsers & proxies may reuse a response without checking back -- new data arrives at most hourly
+ApiMaxAge = int(os.environ.get('COVID_API_MAX_AGE', 300))
+# Number of responses kept ready to send
+ApiCacheSize = int(os.environ.get('COVID_API_CACHE_SIZE', 512))
+# Bodies smaller than this aren't worth compressing
+MinGzipBytes = 500
+
+
+# A request the API can't answer -- becomes a JSON error response with the given status
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# Index of an ISO date (e.g. '2020-06-01') within the data's dates -- default when the parameter is missing
+def _day(data, value, default):
+    if not value:
+        return default
+    try:
+        date = np.datetime64(value, 'D')
+    except ValueError:
+        raise ApiError('Dates must be given as YYYY-MM-DD, not %r' % value)
+    day = int(np.searchsorted(data.series.dates, date))
+    if day >= data.num_dates or data.series.dates[day] != date:
+        raise ApiError('No data for %s' % value, 404)
+    return day
+
+
+# Whether a flag parameter (percap=1, totals=true...) is on
+def _flag(args, name):
+    return args.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+# Plain numbers for JSON & CSV -- counts as integers, everything else to 6 decimal places, NaN (missing) as None
+def _numbers(values):
+    return [None if math.isnan(x) else int(x) if x.is_integer() else round(x, 6)
+            for x in np.asarray(values, dtype=np.float64).tolist()]
+
+
+# Body as CSV -- missing values become empty fields
+def _csv(header, rows):
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(header)
+    writer.writerows(rows)
+    return text.getvalue()
+
+
+# Daily values of one region between two dates -- returns (JSON-able dict, CSV text)
+def series_body(data, args):
+    state = args.get('state') or 'unused'
+    county = args.get('county') or 'unused'
+    if state != 'unused' and state not in data.CountyOptions['abc']:
+        raise ApiError('Unknown state %r' % state, 404)
+    if county != 'unused' and state == 'unused':
+        raise ApiError('A county needs its state')
+    first = _day(data, args.get('from'), 0)
+    last = _day(data, args.get('to'), data.num_dates - 1)
+    if first > last:
+        raise ApiError("'from' is after 'to'")
+    percap = _flag(args, 'percap')
+
+    columns = {}
+    try:
+        for variable in VARIABLES:
+            name = variable.lower()
+            columns[name] = data.Agg.region_series(variable, state, county, totals=True, percap=percap)[first:last + 1]
+            columns['new_' + name] = data.Agg.region_series(variable, state, county, percap=percap)[first:last + 1]
+    except KeyError:
+        raise ApiError('Unknown county %r in %s' % (county, state), 404)
+
+    dates = data.DateAxis[first:last + 1]
+    body = {
+        'version': data.version,
+        'state': None if state == 'unused' else state,
+        'county': None if county == 'unused' else county,
+        'per_capita': percap,
+        'dates': dates,
+    }
+    body.update({name: _numbers(values) for name, values in columns.items()})
+    return body, _csv(['date'] + list(columns), zip(dates, *[body[name] for name in columns]))
+
+
+# Every state's (or county's) value on one date -- returns (JSON-able dict, CSV text)
+# var is a variable picker value, so derived metrics ('Cases:growth') work too
+def map_body(data, args):
+    value = args.get('var') or 'Cases'
+    variable, metric = split_variable(value)
+    if variable not in VARIABLES:
+        raise ApiError('var must be one of %s, optionally followed by :metric' % ', '.join(VARIABLES))
+    if metric is None and ':' in value:
+        raise ApiError('Unknown metric %r, try one of %s' % (value.partition(':')[2], ', '.join(METRICS)))
+    day = _day(data, args.get('date'), data.num_dates - 1)
+    totals = _flag(args, 'totals')
+    percap = _flag(args, 'percap')
+    level = (args.get('level') or 'state').lower()
+
+    if level == 'state':
+        if metric is not None:
+            values = data.Agg.metric('State', variable, metric)[:, day]
+        else:
+            values = data.Agg.matrix('State', variable, totals, percap)[:, day]
+        names = data.Agg.regions['State']
+        regions = {'state': names, 'code': data.series.codes}
+    elif level == 'county':
+        if metric is not None:
+            values = data.Agg.county_metric(variable, metric, day)
+        else:
+            values = data.Agg.county_day(variable, day, totals, percap)
+        keys = data.series.keys()
+        regions = {'state': [state for state, _ in keys], 'county': [county for _, county in keys],
+                   'fips': ['%05d' % code if code else '' for code in data.series.fips.tolist()]}
+    else:
+        raise ApiError("level must be 'state' or 'county'")
+
+    body = {
+        'version': data.version,
+        'date': data.DateAxis[day],
+        'var': variable if metric is None else variable + ':' + metric,
+        'totals': totals,
+        'per_capita': percap,
+        'level': level,
+    }
+    body.update(regions)
+    body['value'] = _numbers(values)
+    return body, _csv(list(regions) + ['value'], zip(*regions.values(), body['value']))
+
+
+# Endpoint -> function building its body
+Endpoints = {'series': series_body, 'map': map_body}
+
+
+# Parameters each endpoint reads
+Parameters = {'series': ['state', 'county', 'from', 'to', 'percap'],
+              'map': ['date', 'var', 'totals', 'percap', 'level']}
+
+
+# Normalised query -- parameter order & parameters the endpoint doesn't read don't change the response
+def _query(endpoint, args):
+    return tuple((name, args.get(name, '')) for name in Parameters[endpoint]) + (('format', _format(args)),)
+
+
+# Strong ETag of a request's response -- the same query of the same data always gives the same bytes, so the tag is
+# known before anything is built
+def _etag(data, endpoint, args):
+    return hashlib.sha1(repr((data.version, endpoint, _query(endpoint, args))).encode('utf-8')).hexdigest()[:20]
+
+
+# 'csv' or 'json' -- from the format parameter, or the Accept header when there isn't one
+def _format(args):
+    requested = args.get('format', '').lower()
+    if not requested:
+        best = flask.request.accept_mimetypes.best_match(['application/json', 'text/csv'])
+        requested = 'csv' if best == 'text/csv' else 'json'
+    return 'csv' if requested == 'csv' else 'json'
+
+
+# Build (or look up) the parts of the response to one request -- (ETag, body, gzipped body or None, mimetype)
+def build(cache, data, endpoint, args):
+    key = ('api', data.version, endpoint, _query(endpoint, args))
+    parts = cache.get(key)
+    if parts is not None:
+        return parts
+
+    body, text = Endpoints[endpoint](data, args)
+    if _format(args) == 'csv':
+        raw, mimetype = text.encode('utf-8'), 'text/csv'
+    else:
+        raw, mimetype = json.dumps(body, separators=(',', ':')).encode('utf-8'), 'application/json'
+    packed = gzip.compress(raw, 6, mtime=0) if len(raw) >= MinGzipBytes else None
+    return cache.put(key, (_etag(data, endpoint, args), raw, packed, mimetype))
+
+
+# Whether a response's body goes out gzipped -- only when the client takes gzip & the body was big enough to compress
+def _gzipped(packed):
+    return packed is not None and 'gzip' in flask.request.accept_encodings
+
+
+# The tag in the client's If-None-Match naming the copy of this response it would be sent now (gzipped & plain bodies
+# are different representations, so they get different tags), or None
+def _cached_tag(etag, packed):
+    tag = etag + ('-gz' if _gzipped(packed) else '')
+    return tag if tag in flask.request.if_none_match else None
+
+
+# Add the /api endpoints to the Flask server
+def install(server):
+    # Finished responses -- dropped whenever new data is swapped in
+    cache = FigureCache(ApiCacheSize, directory=None, export_dir=None)
+    on_publish(lambda data: cache.invalidate(*current_versions()))
+
+    @server.route('/api/<endpoint>')
+    def api(endpoint):
+        if endpoint not in Endpoints:
+            return flask.jsonify(error='Unknown endpoint, try ' + ' or '.join('/api/' + e for e in Endpoints)), 404
+        scope = flask.request.args.get('scope') or DefaultScope
+        if scope not in Scopes:
+            return flask.jsonify(error='Unknown scope, try ' + ' or '.join(Scopes)), 404
+        data = current(scope=scope)
+        if data is None:
+            response = flask.jsonify(error='The data is still loading')
+            response.headers['Retry-After'] = '30'
+            return response, 503
+
+        args = flask.request.args
+        try:
+            etag, raw, packed, mimetype = build(cache, data, endpoint, args)
+        except ApiError as e:
+            return flask.jsonify(error=str(e)), e.status
+
+        # Repeat requests are answered from the kept parts without sending the body again
+        tag = _cached_tag(etag, packed)
+        if tag is not None:
+            return _headers(flask.Response(status=304), tag)
+        gzipped = _gzipped(packed)
+        response = flask.Response(packed if gzipped else raw, mimetype=mimetype)
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+        return _headers(response, etag + ('-gz' if gzipped else ''))
+
+    return api
+
+
+# Caching headers for a response with the given tag
+def _headers(response, etag):
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=%d' % ApiMaxAge
+    return response
@@ -0,0 +1,180 @@
+# Figure cache for the dashboard
+# The callbacks' input space is small and popular views repeat constantly, so finished figures are kept in a bounded
+# LRU keyed on the normalised callback inputs plus the data version. Optionally figures are also written as JSON to a
+# local directory shared by every worker process, so a view built by one worker is served by all of them. Views
+# pre-rendered by covid_export.py are read from the export directory before anything is built. Concurrent requests
+# for a figure that's still being built wait for that build rather than starting their own (single-flight)
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import urllib.parse
+
+import plotly.utils
+
+# Number of figures each process keeps in memory
+FigureCacheSize = int(os.environ.get('COVID_FIGURE_CACHE_SIZE', 256))
+# Directory shared between worker processes -- unset to keep the cache in-process only
+FigureCacheDir = os.environ.get('COVID_FIGURE_CACHE_DIR') or None
+# Directory of views exported by covid_export.py -- unset when there isn't one
+ExportDir = os.environ.get('COVID_EXPORT_DIR') or None
+
+
+class FigureCache:
+    def __init__(self, maxsize=FigureCacheSize, directory=FigureCacheDir, export_dir=ExportDir):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.export_dir = export_dir
+        self.hits = 0
+        self.misses = 0
+        # Requests answered by waiting for another request's build
+        self.coalesced = 0
+        self._entries = collections.OrderedDict()
+        # Key -> Flight of every figure being built right now
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    # Location of a figure in the shared directory -- one folder per data version so old versions are easy to drop
+    def _path(self, key):
+        version = key[1]
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, str(version), digest + '.json')
+
+    # Cached figure for key, or None
+    # Keys are tuples of (callback name, data version, normalised inputs...)
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        figure = None
+        paths = []
+        if self.directory is not None:
+            paths.append(self._path(key))
+        if self.export_dir is not None and view_path(key) is not None:
+            paths.append(os.path.join(self.export_dir, str(key[1]), view_path(key)))
+        for path in paths:
+            try:
+                with open(path) as f:
+                    figure = json.load(f)
+                break
+            except (OSError, ValueError):
+                figure = None
+
+        with self._lock:
+            if figure is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, figure)
+        return figure
+
+    # Store a figure -- figures must not be modified once they are cached
+    def put(self, key, figure):
+        with self._lock:
+            self._remember(key, figure)
+
+        if self.directory is not None:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so other workers never read half a figure
+            with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(path), suffix='.tmp', delete=False) as f:
+                json.dump(figure, f, cls=plotly.utils.PlotlyJSONEncoder)
+            os.replace(f.name, path)
+        return figure
+
+    # Cached figure for key, or the result of build() -- stored for next time. If another thread is already building
+    # the same figure, waits for it & shares its result (or its exception) instead of building it again
+    def get_or_build(self, key, build):
+        figure = self.get(key)
+        if figure is not None:
+            return figure
+
+        with self._lock:
+            # Finished while this thread was looking?
+            if key in self._entries:
+                return self._entries[key]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return flight.result()
+        try:
+            flight.figure = self.put(key, build())
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.figure
+
+    def _remember(self, key, figure):
+        self._entries[key] = figure
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    # Drop everything not built from one of the given data versions (the current version of each scope)
+    def invalidate(self, *versions):
+        keep = set(versions)
+        with self._lock:
+            for key in [key for key in self._entries if key[1] not in keep]:
+                del self._entries[key]
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name not in {str(version) for version in keep}:
+                    shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+
+# A figure being built -- other requests for it wait on done, then share figure (or error)
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.figure = None
+        self.error = None
+
+    def result(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.figure
+
+
+# Normalise the map's modifiers checklist (which starts out as ['', '']) into a hashable key part
+def modifier_key(modifiers):
+    return tuple(sorted(m for m in (modifiers or []) if m))
+
+
+# Readable location of a view within an export, e.g. map/Cases/percap-totals.json, map/Cases-growth/new.json,
+# graph/Texas/Dallas/7.json or graph/Texas/Dallas/growth.json
+# None for views that are never exported (county maps, which are keyed by date, region comparisons & line graphs zoomed
+# in to part of the history)
+def view_path(key):
+    name, _, *inputs = key
+    if name == 'map':
+        variable, modifiers, *day = inputs
+        if day:
+            return None
+        # Derived metrics ignore the modifiers, so every choice of them is the one exported view
+        if ':' in variable:
+            modifiers = ()
+        return '/'.join(['map', variable.replace(':', '-'), '-'.join(modifiers or ['new'])]) + '.json'
+    if name != 'scatter':
+        # Not a view that's exported
+        return None
+    state, county, period, metric, window = inputs
+    if window is not None:
+        return None
+    return '/'.join(['graph', urllib.parse.quote(state, safe=''), urllib.parse.quote(county, safe=''),
+                     ('%d.json' % period) if metric == 'new' else metric + '.json'])
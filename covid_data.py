@@ -0,0 +1,369 @@
+# Data loading for the dashboard
+# Downloads the JHU time series of a scope (US counties, or the world's countries & provinces), trims them down to
+# what the dashboard uses, and keeps a local snapshot of the resulting TimeSeries in NumPy's binary format so workers
+# can boot from disk in milliseconds (and at all when offline)
+import datetime
+import functools
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import urllib.parse
+
+import numpy as np
+
+from covid_fetch import fetch_all
+
+from covid_scopes import SCOPES, DefaultScope
+from covid_series import TimeSeries
+from covid_store import Aggregates
+
+# Location of the JHU time series -- override COVID_DATA_URL with another URL or a local directory to use a mirror
+DataURL = os.environ.get(
+    'COVID_DATA_URL',
+    'https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/')
+CasesFile, DeathsFile = SCOPES['us'].files
+# JHU's table of every region's ISO codes & population -- one folder up from the time series in the JHU repository, and
+# alongside them in a local directory
+LookupFile = 'UID_ISO_FIPS_LookUp_Table.csv'
+
+# Range of dates to load, as JHU writes them -- the files start on 1/22/20 but the dashboard starts at the end of
+# February 2020. An empty COVID_LAST_DATE keeps every date up to the latest
+FirstDate = os.environ.get('COVID_FIRST_DATE', '2/29/20')
+LastDate = os.environ.get('COVID_LAST_DATE', '')
+# Rows parsed at a time, so only one chunk of the raw CSV is ever held as a frame
+ChunkRows = 2000
+
+# Where snapshots of the trimmed data are kept
+SnapshotDir = os.environ.get('COVID_SNAPSHOT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+# File inside SnapshotDir naming the most recently written snapshot (used when the source can't be reached)
+LatestFile = 'LATEST'
+# File inside SnapshotDir naming the snapshot the loader process has published, aggregates & all, for web workers
+SharedFile = 'SHARED'
+# Added to a scope's SHARED pointer to name the snapshot it pointed at before -- web workers may still be mapping its
+# aggregates until they attach to the new one
+PreviousSuffix = '.previous'
+# Older snapshots kept besides the ones a pointer names -- the rest are deleted whenever a new snapshot is written
+OldSnapshots = 2
+# Names of snapshot folders (snapshot keys)
+SnapshotName = re.compile(r'[0-9a-f]{16}')
+# Layout of the files in a snapshot -- part of the snapshot key, so snapshots in an older layout are never read
+SnapshotFormat = 6
+
+
+# Join the source location and a file name, whether the source is a URL or a local directory
+def source_path(source, file_name):
+    if source.startswith(('http://', 'https://')):
+        return source.rstrip('/') + '/' + file_name
+    return os.path.join(source, file_name)
+
+
+# Where the lookup table is for a source
+def lookup_path(source):
+    if source.startswith(('http://', 'https://')):
+        return urllib.parse.urljoin(source.rstrip('/') + '/', '../' + LookupFile)
+    return os.path.join(source, LookupFile)
+
+
+# A scope's pointer file, e.g. LATEST or SHARED-global
+def pointer_file(pointer, scope=DefaultScope):
+    return pointer if scope == 'us' else pointer + '-' + scope
+
+
+# Turn a JHU date label (e.g. '3/1/20') into a date -- None for columns that aren't dates
+# Cached, as pandas asks about every column again for each chunk
+@functools.lru_cache(maxsize=None)
+def parse_date(label):
+    try:
+        return datetime.datetime.strptime(label, '%m/%d/%y').date()
+    except ValueError:
+        return None
+
+
+# Whether a date label falls within FirstDate..LastDate
+def in_date_range(label, first=FirstDate, last=LastDate):
+    date = parse_date(label)
+    return date is not None and parse_date(first) <= date and (not last or date <= parse_date(last))
+
+
+# Stream one JHU file of a scope, keeping only the rows of its known regions and the date columns keep_date accepts
+# Only the needed columns are parsed and rows are filtered a chunk at a time, so memory stays close to the size of the
+# returned int32 array. Returns states, counties, FIPS codes, date labels, the rows x dates array & populations (if asked
+# for) -- the scope's regions & subregions are the states & counties (FIPS codes are 0 in files without them)
+def read_series_file(file_name, keep_date, population=False, scope=DefaultScope):
+    # pandas is only needed to parse CSVs, so workers booting from a snapshot never pay to import it
+    import pandas as pd
+
+    region, subregion = SCOPES[scope].columns
+    codes = SCOPES[scope].codes
+    names = {region, subregion, 'FIPS'} | ({'Population'} if population else set())
+    reader = pd.read_csv(file_name, usecols=lambda c: c in names or keep_date(c), chunksize=ChunkRows,
+                         dtype={region: str, subregion: str})
+    states, counties, fips, values, pops = [], [], [], [], []
+    date_labels = None
+    for chunk in reader:
+        # Remove anything that isn't one of the scope's regions (e.g. cruise ships, prisons, etc)
+        if codes is not None:
+            chunk = chunk[chunk[region].isin(codes.keys())]
+        if date_labels is None:
+            date_labels = [c for c in chunk.columns if c not in names]
+        states.extend(chunk[region])
+        counties.extend(chunk[subregion].fillna(''))
+        if 'FIPS' in chunk.columns:
+            fips.append(chunk['FIPS'].fillna(0).to_numpy(dtype=np.int64))
+        else:
+            fips.append(np.zeros(len(chunk), dtype=np.int64))
+        values.append(chunk[date_labels].fillna(0).to_numpy(dtype=np.int32))
+        if population:
+            pops.append(chunk['Population'].fillna(0).to_numpy(dtype=np.int64))
+
+    values = np.concatenate(values) if values else np.zeros((0, len(date_labels or [])), dtype=np.int32)
+    fips = np.concatenate(fips) if fips else np.zeros(0, dtype=np.int64)
+    pops = np.concatenate(pops) if pops else np.zeros(len(states), dtype=np.int64)
+    return states, counties, fips, date_labels or [], values, pops
+
+
+# Populations & map codes from the lookup table -- returns {(region, subregion): population} & {region: ISO-3 code}
+# Only the rows for whole countries & their provinces are read (not the US counties it also lists)
+def read_lookup(file_name):
+    import pandas as pd
+
+    table = pd.read_csv(file_name, usecols=['Country_Region', 'Province_State', 'Admin2', 'iso3', 'Population'],
+                        dtype={'Country_Region': str, 'Province_State': str, 'Admin2': str, 'iso3': str})
+    table = table[table['Admin2'].isna()].fillna({'Province_State': '', 'iso3': '', 'Population': 0})
+    population = dict(zip(zip(table['Country_Region'], table['Province_State']),
+                          table['Population'].to_numpy(dtype=np.int64).tolist()))
+    countries = table[table['Province_State'] == '']
+    return population, dict(zip(countries['Country_Region'], countries['iso3']))
+
+
+# Parse & trim a scope's raw JHU files into a TimeSeries of the dates between FirstDate & LastDate
+# Populations come from the deaths file, or the lookup table for scopes that have one
+def parse_sources(cases_file, deaths_file, lookup_file=None, scope=DefaultScope):
+    states, counties, fips, date_labels, cases, _ = read_series_file(cases_file, in_date_range, scope=scope)
+    lookup = SCOPES[scope].lookup
+    death_states, death_counties, _, death_labels, deaths, population = read_series_file(
+        deaths_file, in_date_range, population=not lookup, scope=scope)
+    if death_labels != date_labels:
+        raise ValueError('Cases & deaths files have different dates')
+
+    # Both JHU files list the same rows in the same order, so only realign when they don't
+    if death_states != states or death_counties != counties:
+        row_of = {key: row for row, key in enumerate(zip(death_states, death_counties))}
+        order = [row_of[key] for key in zip(states, counties)]
+        deaths, population = deaths[order], population[order]
+
+    codes = SCOPES[scope].codes
+    if lookup:
+        populations, codes = read_lookup(lookup_file)
+        # Rows the table doesn't list (e.g. cruise ships) have no population
+        population = np.array([populations.get(key, 0) for key in zip(states, counties)], dtype=np.int64)
+    return TimeSeries.from_rows(states, counties, date_labels, cases, deaths, population, fips,
+                                country=SCOPES[scope].name, codes=codes)
+
+
+# Version of a local source file -- its size & modification time
+def file_version(path):
+    stat = os.stat(path)
+    return '%d-%d' % (stat.st_size, stat.st_mtime_ns)
+
+
+# Snapshot key for a scope's source files at the given versions, & the configured date range
+def snapshot_key(files, versions):
+    parts = [str(SnapshotFormat)] + list(files) + [FirstDate, LastDate] + list(versions)
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+# Make a scope's source files (cases, deaths & the lookup table if it uses one) available locally -- returns their
+# local paths & the snapshot key for their current versions
+# URLs are downloaded (all at once, & only if they've changed) into download_dir (sources_dir() by default), local
+# directories are read in place
+# Raises OSError if the source can't be reached
+def fetch_sources(source=DataURL, download_dir=None, scope=DefaultScope):
+    if download_dir is None:
+        download_dir = sources_dir()
+    files = [source_path(source, file_name) for file_name in SCOPES[scope].files]
+    if SCOPES[scope].lookup:
+        files.append(lookup_path(source))
+    if source.startswith(('http://', 'https://')):
+        fetched = fetch_all(files, download_dir)
+        paths = [f.path for f in fetched]
+        versions = [f.version for f in fetched]
+    else:
+        paths = files
+        versions = [file_version(file_name) for file_name in files]
+    return paths, snapshot_key(files, versions)
+
+
+# Write a TimeSeries to snapshot_dir/key -- written to a temporary folder first so readers never see half a snapshot
+def save_snapshot(key, series, snapshot_dir=SnapshotDir, scope=DefaultScope):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    target = os.path.join(snapshot_dir, key)
+    staging = tempfile.mkdtemp(prefix='.' + key + '-', dir=snapshot_dir)
+    series.save(staging)
+    try:
+        os.replace(staging, target)
+    except OSError:
+        # Another process (e.g. a worker starting at the same time) saved the same snapshot first
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+
+    # Point the scope's LATEST at this snapshot
+    _point(snapshot_dir, pointer_file(LatestFile, scope), key)
+    prune_snapshots(snapshot_dir)
+
+
+# Keys of the snapshots named by any pointer file starting with one of prefixes (every scope's LATEST & SHARED by
+# default)
+def _pointed(snapshot_dir, prefixes=(LatestFile, SharedFile)):
+    keys = set()
+    for name in os.listdir(snapshot_dir):
+        if name.startswith(prefixes):
+            try:
+                with open(os.path.join(snapshot_dir, name)) as f:
+                    keys.add(f.read().strip())
+            except OSError:
+                pass
+    return keys
+
+
+# Modification time of a path, or 0 if it has just been deleted
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0
+
+
+# Delete every snapshot but the ones a pointer names & the keep most recent others, so disk use stays bounded however
+# many versions of the source come along (only LATEST is needed to start up offline)
+def prune_snapshots(snapshot_dir=SnapshotDir, keep=OldSnapshots):
+    pointed = _pointed(snapshot_dir)
+    others = [os.path.join(snapshot_dir, name) for name in os.listdir(snapshot_dir)
+              if SnapshotName.fullmatch(name) and name not in pointed]
+    others.sort(key=_mtime, reverse=True)
+    for folder in others[keep:]:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# Replace a pointer file (LATEST or SHARED) in one step, so it always names a whole snapshot
+def _point(snapshot_dir, pointer, key):
+    with tempfile.NamedTemporaryFile('w', dir=snapshot_dir, delete=False) as f:
+        f.write(key)
+    os.replace(f.name, os.path.join(snapshot_dir, pointer))
+
+
+# Read a snapshot back into a TimeSeries
+def load_snapshot(key, snapshot_dir=SnapshotDir):
+    return TimeSeries.load(os.path.join(snapshot_dir, key))
+
+
+# Add a snapshot's aggregates alongside it & point SHARED at it, so web workers can map the whole Dataset
+# The snapshot itself must already have been saved
+def save_shared(key, Agg, snapshot_dir=SnapshotDir, scope=DefaultScope):
+    target = os.path.join(snapshot_dir, key, 'aggregates')
+    if not os.path.isdir(target):
+        staging = tempfile.mkdtemp(prefix='.aggregates-', dir=os.path.join(snapshot_dir, key))
+        Agg.save(staging)
+        try:
+            os.replace(staging, target)
+        except OSError:
+            # Another loader shared the same snapshot first
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(target):
+                raise
+
+    pointer = pointer_file(SharedFile, scope)
+    previous = latest_snapshot(snapshot_dir, pointer)
+    if previous is not None and previous != key:
+        _point(snapshot_dir, pointer + PreviousSuffix, previous)
+    _point(snapshot_dir, pointer, key)
+    prune_shared(snapshot_dir)
+
+
+# Delete the aggregates of every snapshot no SHARED pointer (current or previous) names -- web workers attach to a
+# new publish within WatchSeconds, so by the next one nothing maps the older aggregates any more
+def prune_shared(snapshot_dir=SnapshotDir):
+    shared = _pointed(snapshot_dir, SharedFile)
+    for name in os.listdir(snapshot_dir):
+        if SnapshotName.fullmatch(name) and name not in shared:
+            shutil.rmtree(os.path.join(snapshot_dir, name, 'aggregates'), ignore_errors=True)
+
+
+# Map a shared snapshot read-only -- returns the TimeSeries & Aggregates, whose arrays live in the page cache and so
+# are shared by every process mapping them
+def load_shared(key, snapshot_dir=SnapshotDir):
+    folder = os.path.join(snapshot_dir, key)
+    series = TimeSeries.load(folder, mmap_mode='r')
+    return series, Aggregates.load(series, os.path.join(folder, 'aggregates'), mmap_mode='r')
+
+
+# Key of the snapshot a pointer file (LATEST by default) names, or None if there isn't one
+def latest_snapshot(snapshot_dir=SnapshotDir, pointer=LatestFile):
+    try:
+        with open(os.path.join(snapshot_dir, pointer)) as f:
+            key = f.read().strip()
+    except OSError:
+        return None
+    if key and os.path.isdir(os.path.join(snapshot_dir, key)):
+        return key
+    return None
+
+
+# Where downloaded copies of the source files are kept for a snapshot folder (so unchanged files aren't downloaded
+# again) -- COVID_DOWNLOAD_DIR if it's set, otherwise the folder's sources subfolder
+def sources_dir(snapshot_dir=SnapshotDir):
+    return os.environ.get('COVID_DOWNLOAD_DIR', os.path.join(snapshot_dir, 'sources'))
+
+
+# Load a scope's TimeSeries & the snapshot key it came from
+# Uses the snapshot matching the source's current version when there is one, otherwise parses the source & snapshots it
+# If the source can't be reached, falls back to the scope's latest snapshot on disk. Sources are downloaded to
+# download_dir (sources_dir(snapshot_dir) by default)
+def load_data(source=DataURL, snapshot_dir=SnapshotDir, download_dir=None, scope=DefaultScope):
+    if download_dir is None:
+        download_dir = sources_dir(snapshot_dir)
+    try:
+        files, key = fetch_sources(source, download_dir, scope)
+    except OSError:
+        # Source is unreachable -- serve the last data we saw
+        fallback = latest_snapshot(snapshot_dir, pointer_file(LatestFile, scope))
+        if fallback is None:
+            raise
+        return load_snapshot(fallback, snapshot_dir), fallback
+
+    if os.path.isdir(os.path.join(snapshot_dir, key)):
+        return load_snapshot(key, snapshot_dir), key
+
+    series = parse_sources(*files, scope=scope)
+    save_snapshot(key, series, snapshot_dir=snapshot_dir, scope=scope)
+    return series, key
+
+
+# Parse only the date columns that come after the TimeSeries' last date
+# Returns new cases & deaths (rows x new days, in the TimeSeries' row order) and the new date labels, or None if there
+# are no new dates. Raises ValueError if the files no longer line up with the loaded data (e.g. JHU added counties),
+# in which case a full reload is needed
+def parse_new_dates(cases_file, deaths_file, series, scope=DefaultScope):
+    last = parse_date(series.date_labels[-1])
+    row_of = {key: row for row, key in enumerate(series.keys())}
+    arrays = []
+    for file_name in [cases_file, deaths_file]:
+        states, counties, _, new_dates, values, _ = read_series_file(
+            file_name, lambda c: in_date_range(c) and parse_date(c) > last, scope=scope)
+        if not new_dates:
+            return None
+        keys = list(zip(states, counties))
+        if len(keys) != len(row_of) or set(keys) != row_of.keys():
+            raise ValueError('Regions in ' + file_name + ' no longer match the loaded data')
+        # Put the rows in the TimeSeries' order
+        order = np.empty(len(keys), dtype=np.int64)
+        order[[row_of[key] for key in keys]] = np.arange(len(keys))
+        arrays.append((new_dates, values[order]))
+
+    # Both files must have gained the same dates
+    if arrays[0][0] != arrays[1][0]:
+        raise ValueError('Cases & deaths files have different dates')
+    return arrays[0][1], arrays[1][1], arrays[0][0]
@@ -0,0 +1,130 @@
+# Static export of the dashboard's views
+# The set of views is finite -- every variable & modifier combination of the map and every region & moving average
+# period (or derived metric) of the line graph -- so they can all be rendered ahead of time for the current data, by a
+# pool of worker processes, into a directory tree that a static host or CDN can serve:
+#   <output>/<version>/map/Cases/percap-totals.json
+#   <output>/<version>/graph/Texas/Dallas/7.json
+# Point the app at the same directory with COVID_EXPORT_DIR and the callbacks serve exported views from it (and at
+# /views/...), only building the ones that are missing
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from covid_data import DataURL, SnapshotDir
+from covid_cache import ExportDir, view_path
+from covid_figures import map_view, graph_view
+from covid_refresh import current, load
+from covid_metrics import METRICS, level_metrics
+from covid_store import AVERAGE_PERIODS, VARIABLES
+
+# Views rendered per task handed to a worker
+ChunkSize = 250
+# File inside the output directory naming the most recent export
+LatestFile = 'LATEST'
+
+
+# Cache keys (see covid_cache) of every view to export -- counties limits the line graphs to the counties with the
+# most cases (None for all of them) & periods to the given moving average periods
+def export_keys(data, counties=None, periods=AVERAGE_PERIODS):
+    keys = [('map', data.version, variable, modifiers) for variable in VARIABLES
+            for modifiers in [(), ('percap',), ('totals',), ('percap', 'totals')]]
+    # Derived metrics ignore the modifiers
+    keys += [('map', data.version, variable + ':' + metric, ()) for variable in VARIABLES for metric in METRICS]
+
+    regions = [('unused', 'unused')] + [(state, 'unused') for state in data.Agg.regions['State']]
+    rows = data.series.keys()
+    county_rows = [row for row, (state, county) in enumerate(rows) if county]
+    if counties is not None:
+        latest = data.series.values('Cases')[:, -1]
+        county_rows = sorted(county_rows, key=lambda row: -latest[row])[:counties]
+    regions += [rows[row] for row in county_rows]
+
+    keys += [('scatter', data.version, state, county, period, 'new', None) for state, county in regions
+             for period in periods]
+    keys += [('scatter', data.version, state, county, 0, metric, None) for state, county in regions
+             for metric in level_metrics('Country' if state == 'unused' else 'State')]
+    return keys
+
+
+# Worker process start up -- loads the data, which the parent process has just snapshotted
+def _start_worker(source, snapshot_dir):
+    load(source, snapshot_dir)
+
+
+# Render a batch of views into folder -- returns the number of bytes written
+def render(keys, folder):
+    data = current()
+    written = 0
+    for key in keys:
+        if key[1] != data.version:
+            raise RuntimeError('The data changed during the export')
+        if key[0] == 'map':
+            payload = map_view(data, key[2], key[3])
+        else:
+            payload = graph_view(data, key[2], key[3], key[4], key[5], key[6])
+        path = os.path.join(folder, view_path(key))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(payload, f, separators=(',', ':'))
+            written += f.tell()
+    return written
+
+
+# Export every view of the current data into output/<version> using a pool of worker processes
+# Returns the folder the views were written to
+def export(output, workers=None, counties=None, periods=AVERAGE_PERIODS, source=DataURL, snapshot_dir=SnapshotDir,
+           prune=False):
+    start = time.perf_counter()
+    data = load(source, snapshot_dir)
+    keys = export_keys(data, counties, periods)
+
+    # Render into a staging folder & move it into place once complete, so nothing ever serves half an export
+    os.makedirs(output, exist_ok=True)
+    target = os.path.join(output, data.version)
+    staging = tempfile.mkdtemp(prefix='.' + data.version + '-', dir=output)
+    chunks = [keys[i:i + ChunkSize] for i in range(0, len(keys), ChunkSize)]
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_start_worker,
+                                                initargs=(source, snapshot_dir)) as pool:
+        written = sum(pool.map(render, chunks, [staging] * len(chunks)))
+
+    with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+        json.dump({'version': data.version, 'latest_date': data.DateList[-1], 'views': len(keys), 'bytes': written,
+                   'created': time.strftime('%Y-%m-%dT%H:%M:%S')}, f)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.replace(staging, target)
+
+    # Point LATEST at this export
+    with tempfile.NamedTemporaryFile('w', dir=output, delete=False) as f:
+        f.write(data.version)
+    os.replace(f.name, os.path.join(output, LatestFile))
+
+    if prune:
+        for name in os.listdir(output):
+            if name not in (data.version, LatestFile) and not name.startswith('.'):
+                shutil.rmtree(os.path.join(output, name), ignore_errors=True)
+
+    print('Exported %d views (%.1f MB) to %s in %.1fs' % (len(keys), written / 1e6, target,
+                                                         time.perf_counter() - start))
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render every map & line graph view of the current COVID data')
+    parser.add_argument('--output', default=ExportDir, required=ExportDir is None,
+                        help='directory to export into (default COVID_EXPORT_DIR)')
+    parser.add_argument('--workers', type=int, help='worker processes (default one per CPU)')
+    parser.add_argument('--counties', type=int, help='only export line graphs for this many counties, most cases first')
+    parser.add_argument('--periods', type=int, nargs='+', default=list(AVERAGE_PERIODS),
+                        help='moving average periods to export (default 2-14)')
+    parser.add_argument('--prune', action='store_true', help='remove exports of other versions')
+    args = parser.parse_args()
+    export(args.output, args.workers, args.counties, args.periods, prune=args.prune)
+
+
+if __name__ == '__main__':
+    main()
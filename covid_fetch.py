@@ -0,0 +1,108 @@
+# Downloads of the JHU source files
+# Both files are fetched at once, each streamed into a local download folder alongside the ETag / Last-Modified headers
+# it came with. Later fetches send those back (a conditional GET), so unchanged files cost a 304 rather than a download.
+# Failed requests are retried with exponential backoff
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+# Seconds to wait on the server before a request counts as failed
+Timeout = 10
+# Attempts per file before giving up, & seconds to wait before the first retry (doubling after each one)
+Attempts = 4
+Backoff = 1
+# Bytes read from the response at a time
+BlockSize = 1 << 20
+
+# Result of one fetch -- path of the local copy, the file's version & whether it was downloaded this time
+Fetched = collections.namedtuple('Fetched', ['path', 'version', 'changed'])
+
+
+# Whether a failed request is worth trying again -- connection problems, timeouts & server side errors
+def _retryable(error):
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code >= 500 or error.code == 429
+    return isinstance(error, (urllib.error.URLError, socket.timeout, ConnectionError))
+
+
+# Headers saved with a download
+def _read_meta(path):
+    try:
+        with open(path + '.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# One request for url, conditional on the copy at path if there is one
+def _request(url, path, timeout):
+    meta = _read_meta(path) if os.path.exists(path) else {}
+    request = urllib.request.Request(url)
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and meta:
+            return Fetched(path, meta['version'], False)
+        raise
+
+    # Stream the body to a temporary file next to the copy, hashing it as it goes (the hash is the version when the
+    # server sends neither header)
+    digest = hashlib.sha1()
+    with response, tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path), suffix='.part', delete=False) as f:
+        try:
+            while True:
+                block = response.read(BlockSize)
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    meta = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+    meta['version'] = meta['etag'] or meta['last_modified'] or 'sha1:' + digest.hexdigest()
+
+    # Drop the old headers before replacing the copy, so they can never be sent for the new one
+    if os.path.exists(path + '.json'):
+        os.remove(path + '.json')
+    os.replace(f.name, path)
+    with open(path + '.json', 'w') as f:
+        json.dump(meta, f)
+    return Fetched(path, meta['version'], True)
+
+
+# Fetch url into folder (as its file name), retrying failures with exponential backoff
+def fetch(url, folder, timeout=Timeout, attempts=Attempts, backoff=Backoff):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, url.rstrip('/').rsplit('/', 1)[-1])
+    for attempt in range(attempts):
+        try:
+            return _request(url, path, timeout)
+        except (OSError, socket.timeout) as e:
+            if attempt == attempts - 1 or not _retryable(e):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+# Fetch several URLs into folder at once -- returns a Fetched for each, in the same order
+def fetch_all(urls, folder, timeout=Timeout, attempts=Attempts, backoff=Backoff):
+    with concurrent.futures.ThreadPoolExecutor(len(urls)) as pool:
+        futures = [pool.submit(fetch, url, folder, timeout, attempts, backoff) for url in urls]
+        return [future.result() for future in futures]
@@ -0,0 +1,449 @@
+# Figure construction for the dashboard
+# Figures are plain dicts built on top of base templates that are made once and never modified, so concurrent requests
+# on a multi-threaded server can't hand one user's selection to another. Both the map & the line graph are drawn in the
+# browser (assets/clientside.js): everything static (templates, layouts, dates, map locations) is sent once with the
+# page, and callbacks only send the values, packed as base64 float32 arrays. Long histories are sent a point a week or
+# a month (see covid_store's tiers), so payloads stay the same size as the data grows
+import base64
+import functools
+import os
+import re
+
+import numpy as np
+import plotly.graph_objs as go
+import plotly.io as pio
+
+from covid_metrics import METRICS, SIGNED, REVERSED, split_variable, level_metrics
+from covid_scopes import SCOPES, DefaultScope
+
+
+# Plotly's dark theme as a dict -- loading it is slow enough to matter at startup, so it's done once & shared by both
+# figures (setting it on each go.Figure would validate & copy the whole theme again)
+@functools.lru_cache(maxsize=None)
+def dark_template():
+    return pio.templates['plotly_dark'].to_plotly_json()
+
+
+# Map frame of a scope (the US, or the world) -- built on first use and converted to a dict once, after which it's only
+# ever read
+@functools.lru_cache(maxsize=None)
+def map_template(scope=DefaultScope):
+    usmap = go.Figure()
+    usmap.add_trace(go.Choropleth())
+    usmap.update_layout(
+        geo=dict(
+            SCOPES[scope].geo,
+            showlakes=False
+        )
+    )
+    usmap = usmap.to_dict()
+    usmap['layout']['template'] = dark_template()
+    return usmap
+
+
+# Simplified county outlines keyed by FIPS code (built by tools/build_county_geometry.py) -- the browser fetches them
+# once from assets/ & caches them, so callbacks never send geometry
+CountyGeometryFile = os.path.join('assets', 'us_counties.json')
+
+
+# FIPS codes that have an outline -- read once per process, picking the ids straight out of the text as parsing the
+# whole file would take several times longer
+@functools.lru_cache(maxsize=None)
+def county_geometry_ids():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), CountyGeometryFile)) as f:
+        return frozenset(re.findall(r'"id":"(\d{5})"', f.read()))
+
+
+# Rows of a TimeSeries the county map can draw & their FIPS codes as the outlines are keyed ('01001')
+@functools.lru_cache(maxsize=4)
+def county_locations(series):
+    codes = ['%05d' % code for code in series.fips.tolist()]
+    ids = county_geometry_ids()
+    rows = [row for row, code in enumerate(codes) if code in ids]
+    return np.array(rows, dtype=np.int64), [codes[row] for row in rows]
+
+
+# Trace settings shared by every map -- the world map locates its countries by ISO-3 code instead
+MapTrace = dict(
+    type='choropleth',
+    locationmode='USA-states',  # set of locations match entries in `locations`
+    zmin=0,
+    colorscale=[[0, 'white'], [1, 'red']],
+    colorbar=dict(
+        thickness=15,
+        len=1.5,
+        xanchor='left',
+        x=-0.1,
+        ticks='inside')
+)
+
+
+# Placement of the map title
+MapTitle = {
+    'y': 0.9,
+    'x': 0.5,
+    'xanchor': 'center',
+    'yanchor': 'top',
+}
+
+
+# County map trace settings -- geometry is the URL the outlines are served from
+def county_trace(geometry):
+    trace = dict(MapTrace, geojson=geometry, featureidkey='id', marker=dict(line=dict(width=0)))
+    del trace['locationmode']
+    return trace
+
+
+# Everything static about a scope's map, sent to the browser once with the page
+def map_base(county_geometry, scope=DefaultScope):
+    return {'trace': dict(MapTrace, locationmode=SCOPES[scope].location_mode),
+            'county_trace': county_trace(county_geometry), 'layout': map_template(scope)['layout'], 'title': MapTitle}
+
+
+# Pack an array of values as base64 float32 (NaN marks missing values) -- a quarter of the size of the JSON numbers
+# and far quicker to serialise. The browser unpacks it into a Float32Array
+def pack_values(values):
+    return base64.b64encode(np.ascontiguousarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+# Everything about the dates & regions of a Dataset, sent to the browser once with the page
+# Payloads carry their own copy instead when the page was loaded with a different version
+def data_axes(data):
+    return {
+        'version': data.version,
+        'locations': data.series.codes,
+        'county_locations': county_locations(data.series)[1],
+        'dates': list(data.DateList),
+        'days': list(data.DateAxis),
+    }
+
+
+# Map values for every date at once, so the browser can draw any date (and play them all back) without asking the
+# server again -- values are states x days, title is completed with the date. When the date slider only stops at some
+# days, values has a column for each of them & days lists them
+def map_frames(version, values, title, days=None):
+    frames = {
+        'version': version,
+        'title': title,
+        'shape': [values.shape[1], values.shape[0]],
+        'z': pack_values(values.transpose()),
+    }
+    if days is not None:
+        frames['days'] = days
+    return frames
+
+
+# County map values for a single date -- there are too many counties to send every date at once
+def county_frames(version, values, title, day):
+    return {
+        'version': version,
+        'title': title,
+        'level': 'County',
+        'day': day,
+        'shape': [1, len(values)],
+        'z': pack_values(values),
+    }
+
+
+# How a variable is named in front of a metric, e.g. 'Case Growth Rate (% per day)'
+MetricNames = {'Cases': 'Case', 'Deaths': 'Death'}
+
+
+# Variable picker options -- the counts, then every derived metric of each
+def variable_options():
+    return [{'label': variable, 'value': variable} for variable in MetricNames] + \
+        [{'label': MetricNames[variable] + ' ' + METRICS[metric].split(' (')[0], 'value': variable + ':' + metric}
+         for variable in MetricNames for metric in METRICS]
+
+
+# Days the state map has a frame for, when the date slider doesn't stop at every day
+def slider_frames(data):
+    return None if data.SliderTier == 'day' else data.SliderDays
+
+
+# Map payload for a derived metric -- the totals & per capita modifiers don't apply
+def metric_view(data, variable, metric, county, day):
+    title = MetricNames[variable] + ' ' + METRICS[metric] + ' on '
+    if county:
+        rows = county_locations(data.series)[0]
+        payload = county_frames(data.version, data.Agg.county_metric(variable, metric, day)[rows], title, day)
+    else:
+        days = slider_frames(data)
+        values = data.Agg.metric('State', variable, metric)
+        payload = map_frames(data.version, values if days is None else values[:, days], title, days)
+    # Let the browser know how to colour it
+    if metric in SIGNED:
+        payload['signed'] = True
+    if metric in REVERSED:
+        payload['reversed'] = True
+    return payload
+
+
+# How the map title leads into the date of new values at each tier -- a week or month's are averages per day
+TierDates = {'day': ' on ', 'week': ' per Day in the Week to ', 'month': ' per Day in the Month to '}
+
+
+# Map payload for one variable (a variable picker value) & set of modifiers (the map's checklist) of a Dataset -- the
+# county map also needs the date (one of the Dataset's SliderDays)
+def map_view(data, variable, modifiers, day=None):
+    variable, metric = split_variable(variable)
+    if metric is not None:
+        return metric_view(data, variable, metric, 'county' in modifiers, day)
+
+    # Determine if map should show New Daily data or Total data
+    if 'totals' in modifiers:
+        title_prefix = 'Total '
+        title_suffix = ' by '
+    else:
+        title_prefix = 'New '
+        title_suffix = TierDates[data.SliderTier]
+
+    # Determine if map is showing data per capita or not
+    if 'percap' in modifiers:
+        title_suffix = ' per 100,000 Capita' + title_suffix
+
+    # Add qualifiers to map title (the browser adds the date)
+    title = title_prefix + variable + title_suffix
+
+    if 'county' in modifiers:
+        # Every county with an outline on the chosen date
+        rows = county_locations(data.series)[0]
+        values = data.Agg.county_day(variable, day, totals='totals' in modifiers, percap='percap' in modifiers,
+                                     tier=data.SliderTier)
+        return county_frames(data.version, values[rows], title, day)
+
+    # Pull the precomputed state level data for the chosen variable & modifiers, a frame per stop of the date slider
+    MapData = data.Agg.tier_matrix(data.SliderTier, 'State', variable, totals='totals' in modifiers,
+                                   percap='percap' in modifiers)
+    return map_frames(data.version, MapData, title, slider_frames(data))
+
+
+# Line graph frame -- built on first use & converted to a dict once, like the map's
+@functools.lru_cache(maxsize=None)
+def graph_template():
+    scatter = go.Figure()
+    scatter.update_layout(
+        xaxis=dict(
+            rangeselector=dict(
+                buttons=list([
+                    dict(count=14,
+                         label="14 Days",
+                         step="day",
+                         stepmode="backward"),
+                    dict(count=1,
+                         label="1 Month",
+                         step="month",
+                         stepmode="backward"),
+                    dict(label="All",
+                         step="all")
+                ]),
+                x=0.5,
+                xanchor='center',
+                bgcolor='#121212',  # Background when not clicked - dark black
+                activecolor='#272623',  # Background when clicked - gray
+                bordercolor='#ffffff',  # Border color - white
+                font=dict(color='#ffffff')  # Font color - white
+            ),
+            rangeslider=dict(
+                visible=True
+            ),
+            type='date'
+        ),
+        title={
+            'x': 0.5,
+            'xanchor': 'center'
+        },
+        # Keep the user's zoom when new values arrive for it
+        uirevision='line_graph',
+        legend=dict(
+            orientation='h',
+            x=0.5,
+            xanchor='center',
+            y=-0.6,
+            yanchor='top')
+    )
+    scatter = scatter.to_dict()
+    scatter['layout']['template'] = dark_template()
+    return scatter
+
+
+# Graph configuration
+cases_color = 'yellow'
+deaths_color = 'red'
+
+# Line graph traces, in the order graph_frames packs their values
+GraphTraces = [
+    # Newly confirmed cases
+    dict(type='scatter', name='Newly Confirmed Cases', line=dict(color=cases_color)),
+    # Moving average of newly confirmed cases
+    dict(type='scatter', name='Moving Avg of Confirmed Cases', line=dict(color=cases_color, dash='dash')),
+    # Deaths
+    dict(type='scatter', name='Deaths', line=dict(color=deaths_color)),
+    # Moving average of deaths
+    dict(type='scatter', name='Moving Avg of Deaths', line=dict(color=deaths_color, dash='dash')),
+]
+
+
+# Line graph traces for a derived metric -- named by the browser from the payload
+MetricTraces = [
+    dict(type='scatter', line=dict(color=cases_color)),
+    dict(type='scatter', line=dict(color=deaths_color)),
+]
+
+
+# Line graph options -- the daily new values, then every derived metric the graph's level offers (the country, or a
+# state or county)
+def graph_options(country=False):
+    return [{'label': 'New Cases & Deaths', 'value': 'new'}] + \
+        [{'label': METRICS[metric], 'value': metric} for metric in level_metrics('Country' if country else 'State')]
+
+
+# Everything static about the line graph, sent to the browser once with the page
+def graph_base():
+    return {'traces': GraphTraces, 'metric_traces': MetricTraces, 'layout': graph_template()['layout']}
+
+
+# Most points sent per line -- the line graph draws the range showing at the finest tier (days, weeks or months) that
+# fits into this many points
+MaxPoints = 400
+# Most regions the line graph compares at once
+MaxRegions = 50
+
+
+# Part of the line graph's x axis showing (ISO dates from the browser, see clientside.js) as the days to draw in detail
+# -- (first day, last day) widened to whole months, or None for the whole history
+def graph_window(data, visible):
+    try:
+        first, last = [np.datetime64(date[:10], 'D') for date in visible]
+    except (TypeError, ValueError):
+        return None
+    days = np.searchsorted(data.series.dates, [first, last], 'right') - 1
+    window = data.Agg.month_range(int(days[0]), int(days[1]))
+    return None if window == (0, data.num_dates - 1) else window
+
+
+# Days (indices into the dates) of a line's points, to send along with it -- None when there's a point every day
+def _point_days(days, num_dates):
+    if len(days) == num_dates and (num_dates == 0 or days[-1] == num_dates - 1):
+        return None
+    return pack_values(days)
+
+
+# Line graph values for one region -- one series per entry of GraphTraces (or MetricTraces, named by names), with a
+# point on each of days
+def graph_frames(version, title, series, names=None, days=None):
+    frames = {
+        'version': version,
+        'title': title,
+        'shape': [len(series), len(series[0])],
+        'y': pack_values(np.vstack(series)),
+    }
+    if names is not None:
+        frames['names'] = names
+    if days is not None:
+        frames['x'] = days
+    return frames
+
+
+# Downsample every row of regions x days to points points with Largest-Triangle-Three-Buckets, which keeps the peaks &
+# troughs that make a line look the way it does. Each bucket is worked out for all rows at once
+# Returns regions x points indices of the days kept (None when nothing needed dropping) & their values
+def lttb(values, points=MaxPoints):
+    regions, days = values.shape
+    if days <= points or points < 3:
+        return None, values
+    # Gaps count as 0 when choosing points (they're still sent as gaps)
+    filled = np.nan_to_num(values)
+    rows = np.arange(regions)
+    # The first & last days are always kept, the days between are split into points - 2 buckets of one point each
+    edges = np.linspace(1, days - 1, points - 1).astype(np.int64)
+    kept = np.empty((regions, points), dtype=np.int64)
+    kept[:, 0] = 0
+    kept[:, -1] = days - 1
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # The point kept is the one making the largest triangle with the previous point kept & the next bucket's average
+        following = slice(end, edges[bucket + 2]) if bucket < points - 3 else slice(days - 1, days)
+        next_x = (following.start + following.stop - 1) / 2
+        next_y = filled[:, following].mean(axis=1)[:, np.newaxis]
+        previous_x = kept[:, bucket][:, np.newaxis]
+        previous_y = filled[rows, kept[:, bucket]][:, np.newaxis]
+        area = np.abs((previous_x - next_x) * (filled[:, start:end] - previous_y) -
+                      (previous_x - np.arange(start, end)) * (next_y - previous_y))
+        kept[:, bucket + 1] = start + area.argmax(axis=1)
+    return kept, np.take_along_axis(values, kept, axis=1)
+
+
+# Line graph values comparing many regions -- names label each row of values, the browser picks the trace colours
+# Rows have a point on each of days (indices into the dates), trimmed to MaxPoints points with lttb
+def compare_frames(version, title, names, days, values, num_dates):
+    kept, values = lttb(values)
+    frames = {
+        'version': version,
+        'title': title,
+        'regions': names,
+        'shape': list(values.shape),
+        'y': pack_values(values),
+    }
+    if kept is not None:
+        # Each region keeps different points -- sent as indices into the date axis
+        frames['x'] = pack_values(days[kept])
+    elif _point_days(days, num_dates) is not None:
+        frames['x'] = _point_days(days, num_dates)
+    return frames
+
+
+# How the line graph's title describes the points of each tier -- a week or month's new values are averages per day
+TierTitles = {'day': '', 'week': ' (Weekly Averages)', 'month': ' (Monthly Averages)'}
+
+
+# Line graph payload comparing one variable of many regions ((state, county) pairs) -- a derived metric when metric is
+# one of METRICS, otherwise the moving average of the daily new values per capita. window is the days to draw in
+# detail (see graph_window), None for the whole history
+def compare_view(data, regions, variable, period, metric='new', window=None):
+    regions = regions[:MaxRegions]
+    if metric in METRICS:
+        title = MetricNames[variable] + ' ' + METRICS[metric]
+    else:
+        title = '%d-Day Moving Avg of New %s per 100,000 Capita' % (period, variable)
+    names = [(data.Scope.name if state == 'unused' else state) if county == 'unused' else county + ', ' + state
+             for state, county in regions]
+    start, stop = window or (0, data.num_dates - 1)
+    segments = data.Agg.graph_segments(start, stop, MaxPoints)[1]
+    if metric in METRICS:
+        days, values = data.Agg.regions_points(regions, variable, segments, metric)
+    else:
+        days, values = data.Agg.regions_points(regions, variable, segments, 'average', period, percap=True)
+    return compare_frames(data.version, title, names, days, values, data.num_dates)
+
+
+# Line graph payload for one region & moving average period of a Dataset -- or, when metric is one of METRICS, that
+# metric of the region's cases & deaths. window is the days to draw in detail (see graph_window), None for the whole
+# history, which is drawn a point a week or a month once it's too long to draw a point a day
+def graph_view(data, state, county, period, metric='new', window=None):
+    # Set title based on the chosen region
+    if state == 'unused':
+        graph_title = data.Scope.name
+    elif county == 'unused':
+        graph_title = state
+    else:
+        graph_title = data.Scope.subregion_title % (county, state)
+
+    start, stop = window or (0, data.num_dates - 1)
+    tier, segments = data.Agg.graph_segments(start, stop, MaxPoints)
+    region = [(state, county)]
+    if metric in METRICS:
+        series = [data.Agg.regions_points(region, variable, segments, metric) for variable in MetricNames]
+        return graph_frames(data.version, graph_title + ' ' + METRICS[metric], [values[0] for _, values in series],
+                            [MetricNames[variable] + ' ' + METRICS[metric] for variable in MetricNames],
+                            _point_days(series[0][0], data.num_dates))
+
+    # Pull the precomputed new values of cases & deaths for the region (daily, or averages per day over each week or
+    # month), with the moving averages on each point's day
+    series = []
+    for variable in ['Cases', 'Deaths']:
+        for kind in ['new', 'average']:
+            days, values = data.Agg.regions_points(region, variable, segments, kind, period)
+            series.append(values[0])
+    return graph_frames(data.version, graph_title + TierTitles[tier], series,
+                        days=_point_days(days, data.num_dates))
@@ -0,0 +1,224 @@
+# Opt-in timing & profiling for the dashboard
+# Set COVID_METRICS=1 to record per-callback, per-stage timing histograms & call/error counters, served in Prometheus
+# text format at /metrics on the Flask server. Set COVID_PROFILE_INTERVAL_MS as well to run a sampling profiler,
+# whose collapsed stacks (flamegraph.pl / speedscope input) are served at /metrics/profile
+import collections
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+
+import flask
+
+# Whether anything is recorded at all -- when off, every hook below is a no-op
+Enabled = os.environ.get('COVID_METRICS', '') not in ('', '0')
+# Milliseconds between profiler samples -- 0 (the default) leaves the profiler off
+ProfileIntervalMs = float(os.environ.get('COVID_PROFILE_INTERVAL_MS', 0))
+# Upper bounds (seconds) of the histogram buckets
+Buckets = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+_lock = threading.Lock()
+# (callback, stage) -> [bucket counts..., +Inf count], sum of seconds
+_histograms = {}
+_sums = collections.defaultdict(float)
+# (counter name, callback) -> count
+_counters = collections.defaultdict(int)
+# Functions returning extra (metric name, help, type, {labels: value}) tuples, e.g. cache hit counts
+_collectors = []
+# Collapsed stack -> samples
+_profile = collections.Counter()
+_null = contextlib.nullcontext()
+
+
+# Record one duration
+def observe(callback, stage_name, seconds):
+    key = (callback, stage_name)
+    with _lock:
+        counts = _histograms.setdefault(key, [0] * (len(Buckets) + 1))
+        for i, bound in enumerate(Buckets):
+            if seconds <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        _sums[key] += seconds
+
+
+# Add to a counter
+def count(name, callback, amount=1):
+    if Enabled:
+        with _lock:
+            _counters[(name, callback)] += amount
+
+
+@contextlib.contextmanager
+def _timer(callback, stage_name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(callback, stage_name, time.perf_counter() - start)
+
+
+# Time a block of code as one stage of a callback (or of the data load)
+def stage(callback, stage_name):
+    if not Enabled:
+        return _null
+    return _timer(callback, stage_name)
+
+
+# Times consecutive stages of a callback without wrapping each one in a with block -- lap(stage) records the time
+# since the previous lap (or since the Stopwatch was made) under that stage
+class Stopwatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.last = time.perf_counter() if Enabled else None
+
+        # Whether the figure was built this time (see build)
+        self.built = False
+
+    def lap(self, stage_name):
+        if self.last is not None:
+            now = time.perf_counter()
+            observe(self.callback, stage_name, now - self.last)
+            self.last = now
+
+    # Wrap a figure build for FigureCache.get_or_build -- the time up to it is the 'cache' check and the build is its
+    # own 'build' stage (it only runs on a miss)
+    def build(self, build):
+        def timed():
+            self.lap('cache')
+            figure = build()
+            self.lap('build')
+            self.built = True
+            return figure
+        return timed
+
+    # Lap once get_or_build returns -- storing the figure after a build, otherwise the whole cache check (a hit, or
+    # waiting on another request's build)
+    def cached(self):
+        self.lap('store' if self.built else 'cache')
+
+
+# Decorator for Dash callbacks -- counts calls & errors, times the whole callback, and marks when it finished so the
+# time Dash then spends serialising the response can be recorded too
+def callback(func):
+    if not Enabled:
+        return func
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        count('calls', name)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            count('errors', name)
+            raise
+        finally:
+            finished = time.perf_counter()
+            observe(name, 'total', finished - start)
+            if flask.has_request_context():
+                flask.g.covid_callback = (name, finished)
+    return wrapper
+
+
+# Register a function returning extra metrics to include on /metrics
+def add_collector(collector):
+    _collectors.append(collector)
+    return collector
+
+
+def _labels(**labels):
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in labels.items()) + '}'
+
+
+# Everything recorded so far in Prometheus text format
+def prometheus_text():
+    with _lock:
+        histograms = {key: list(counts) for key, counts in _histograms.items()}
+        sums = dict(_sums)
+        counters = dict(_counters)
+
+    lines = ['# HELP covid_stage_seconds Time spent in each stage of each callback',
+             '# TYPE covid_stage_seconds histogram']
+    for (name, stage_name), counts in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket in zip(Buckets + ['+Inf'], counts):
+            cumulative += bucket
+            lines.append('covid_stage_seconds_bucket%s %d' % (_labels(callback=name, stage=stage_name, le=bound),
+                                                             cumulative))
+        lines.append('covid_stage_seconds_sum%s %.6f' % (_labels(callback=name, stage=stage_name),
+                                                         sums[(name, stage_name)]))
+        lines.append('covid_stage_seconds_count%s %d' % (_labels(callback=name, stage=stage_name), cumulative))
+
+    for counter in sorted({name for name, _ in counters}):
+        lines.append('# TYPE covid_callback_%s_total counter' % counter)
+        for (name, callback_name), value in sorted(counters.items()):
+            if name == counter:
+                lines.append('covid_callback_%s_total%s %d' % (counter, _labels(callback=callback_name), value))
+
+    for collector in _collectors:
+        for metric, help_text, metric_type, values in collector():
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s %s' % (metric, metric_type))
+            for labels, value in values.items():
+                lines.append('%s%s %s' % (metric, _labels(**dict(labels)) if labels else '', value))
+    return '\n'.join(lines) + '\n'
+
+
+# Background thread sampling every thread's stack -- cheap enough to leave on in production at ~10ms intervals
+class Profiler(threading.Thread):
+    def __init__(self, interval_ms):
+        super().__init__(name='covid-profiler', daemon=True)
+        self.interval = interval_ms / 1000
+
+    def run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                with _lock:
+                    _profile[';'.join(reversed(stack))] += 1
+
+
+# Collapsed stacks & sample counts, most sampled first
+def profile_text():
+    with _lock:
+        samples = _profile.most_common()
+    return ''.join('%s %d\n' % (stack, n) for stack, n in samples)
+
+
+# Add the /metrics endpoints & serialisation timing to the Flask server (if instrumentation is on)
+def install(server):
+    if not Enabled:
+        return
+
+    # Dash serialises a callback's output after the callback returns -- time from then until the response is ready
+    @server.after_request
+    def record_serialisation(response):
+        finished = flask.g.pop('covid_callback', None)
+        if finished is not None:
+            observe(finished[0], 'serialize', time.perf_counter() - finished[1])
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+    @server.route('/metrics/profile')
+    def profile():
+        return flask.Response(profile_text(), mimetype='text/plain')
+
+    if ProfileIntervalMs > 0:
+        Profiler(ProfileIntervalMs).start()
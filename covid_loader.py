@@ -0,0 +1,15 @@
+# Loader process for serving the dashboard from several worker processes
+# Loads every scope's data, keeps it current & publishes every version (time series & aggregates) into the snapshot
+# folder. Web workers started with COVID_SHARED_DATA=1 map those arrays read-only, so the operating system holds one
+# copy of the data however many workers there are, e.g.
+#   python covid_loader.py &
+#   COVID_SHARED_DATA=1 gunicorn --workers 4 rcdodds_pythonanywhere_com_wsgi:application
+from covid_refresh import load_scopes, on_publish, share, start_refresher
+
+if __name__ == '__main__':
+    on_publish(share)
+    load_scopes()
+    # Keep refreshing until stopped (or exit straight away if COVID_REFRESH_SECONDS is 0)
+    refresher = start_refresher()
+    if refresher is not None:
+        refresher.join()
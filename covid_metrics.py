@@ -0,0 +1,119 @@
+# Derived metrics for the dashboard
+# Growth rate, doubling time, week over week change & per capita rank of every region on every date, worked out from
+# cumulative totals (regions x days) with whole-array NumPy operations rather than region by region. A date's metrics
+# only look back two weeks, so after a refresh just the new dates (plus that look back) are worked out. Levels with too
+# many regions to keep every metric of (counties) have them worked out for just the rows & days asked for instead
+import numpy as np
+
+# Metric -> how it's described in titles & legends, in the order they're offered
+METRICS = {
+    'growth': 'Growth Rate (% per day)',
+    'doubling': 'Doubling Time (days)',
+    'wow': 'Change Week over Week (%)',
+    'rank': 'Rank per 100,000 Capita',
+}
+# Metrics that can go negative (the map's colour scale then starts at the lowest value rather than 0)
+SIGNED = {'wow'}
+# Metrics where lower is worse (rank 1 has the most per capita)
+REVERSED = {'rank'}
+# Days compared by growth, doubling time & week over week change
+WINDOW = 7
+# Days before a date its metrics depend on
+LOOKBACK = 2 * WINDOW
+# Rows worked on at a time, which keeps the temporary arrays small at county level
+BlockRows = 512
+# Most rows ranked by counting the regions above them -- more than this sorts each day once instead
+CountRows = 8
+
+
+# Variable picker value -> (variable, metric) -- metric is None for the plain counts
+# Metric values are written as variable:metric, e.g. 'Cases:growth'
+def split_variable(value):
+    variable, _, metric = value.partition(':')
+    return variable, metric if metric in METRICS else None
+
+
+# Metrics offered at a level (see covid_store.LEVELS) -- a scope's whole is the only region at its level, so it's
+# always ranked 1st and has no rank
+def level_metrics(level):
+    return [metric for metric in METRICS if not (level == 'Country' and metric == 'rank')]
+
+
+# Totals days earlier (NaN before the data starts)
+def _shift(totals, days):
+    shifted = np.full(totals.shape, np.nan)
+    shifted[:, days:] = totals[:, :-days]
+    return shifted
+
+
+# Totals of rows on days back days earlier, as rows x days (NaN before the data starts)
+def _back(totals, rows, days, back):
+    values = totals[rows, np.maximum(days - back, 0)].astype(np.float64)
+    values[:, days < back] = np.nan
+    return values
+
+
+# Growth rate, doubling time & week over week change for a block of rows
+def _rates(totals):
+    return _rates_of(totals, _shift(totals, WINDOW), _shift(totals, 2 * WINDOW))
+
+
+# Growth rate, doubling time & week over week change from totals & the totals a week and two weeks before them
+def _rates_of(totals, week_ago, two_weeks_ago):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Growth of the cumulative total over the last week, as a daily rate
+        ratio = totals / week_ago
+        growth = (ratio ** (1 / WINDOW) - 1) * 100
+        doubling = WINDOW * np.log(2) / np.log(ratio)
+        # New values in the last week against the week before
+        wow = ((totals - week_ago) / (week_ago - two_weeks_ago) - 1) * 100
+    # Nothing a week ago gives an infinite ratio, and a total that didn't grow never doubles
+    doubling[~(ratio > 1)] = np.nan
+    for values in (growth, doubling, wow):
+        values[~np.isfinite(values)] = np.nan
+    return growth, doubling, wow
+
+
+# Ranks (1 is the highest) of some rows (an index column or a slice) of regions x days of per capita values among
+# every region on each day -- NaN for regions without a population. Tied regions share the best rank
+def ranks_of(percap, rows):
+    # An index column gathers rows x 1 x days
+    targets = percap[rows].reshape(-1, percap.shape[1])
+    if targets.shape[0] <= CountRows:
+        # A few rows -- count the regions above each (NaN is never above anything)
+        with np.errstate(invalid='ignore'):
+            above = np.array([(percap > target).sum(axis=0) for target in targets])
+    else:
+        # Sort each day once as a contiguous row, then look up every row in it
+        ordered = np.sort(np.where(np.isnan(percap), -np.inf, percap).transpose(), axis=1)
+        above = np.array([ordered.shape[1] - np.searchsorted(ordered[day], targets[:, day], 'right')
+                          for day in range(ordered.shape[0])]).transpose()
+    ranks = (above + 1).astype(np.float64)
+    ranks[np.isnan(targets)] = np.nan
+    return ranks
+
+
+# One metric of some rows (an index column or a slice) on some days (an index array) of regions x days of cumulative
+# totals, worked out from just the days it needs -- scale is each region's per capita multiplier
+# Returns rows x days
+def metric_at(totals, scale, rows, days, metric):
+    if metric == 'rank':
+        return ranks_of(totals[:, days] * scale[:, np.newaxis], rows)
+    growth, doubling, wow = _rates_of(*[_back(totals, rows, days, back) for back in (0, WINDOW, 2 * WINDOW)])
+    return {'growth': growth, 'doubling': doubling, 'wow': wow}[metric]
+
+
+# Metrics of regions x days of cumulative totals (every one by default) -- scale is each region's per capita multiplier
+# Returns {metric: regions x days float32 array}
+def compute(totals, scale, metrics=METRICS):
+    ranked = 'rank' in metrics
+    metrics = {metric: np.empty(totals.shape, dtype=np.float32) for metric in metrics if metric != 'rank'}
+    for start in range(0, totals.shape[0], BlockRows):
+        rows = slice(start, start + BlockRows)
+        for metric, values in zip(['growth', 'doubling', 'wow'], _rates(totals[rows].astype(np.float64))):
+            if metric in metrics:
+                metrics[metric][rows] = values
+    # Ranks compare every region, so they're done in one go
+    if ranked:
+        metrics['rank'] = ranks_of(totals * scale[:, np.newaxis], slice(None)).astype(np.float32)
+    return metrics
@@ -0,0 +1,220 @@
+# Keeps the dashboard's data current without restarting the app
+# A background thread checks the source on a schedule, parses only the newly appended date columns, extends the
+# aggregates for just those dates, then swaps the new Dataset in with a single assignment. Each scope (see covid_scopes)
+# has its own current Dataset, loaded & refreshed the same way
+import logging
+import os
+import threading
+import time
+
+from covid_data import DataURL, SnapshotDir, SharedFile, fetch_sources, save_snapshot, save_shared, load_shared, \
+    latest_snapshot, load_data, parse_new_dates, pointer_file, sources_dir
+from covid_scopes import Scopes, DefaultScope
+from covid_store import Dataset
+import covid_instrument as instrument
+
+# Seconds between checks for new data -- set COVID_REFRESH_SECONDS to 0 to turn the background refresh off
+RefreshSeconds = float(os.environ.get('COVID_REFRESH_SECONDS', 3600))
+# Set COVID_BACKGROUND_LOAD=1 to load the data in a background thread, so the server can answer before it's ready
+BackgroundLoad = os.environ.get('COVID_BACKGROUND_LOAD', '') not in ('', '0')
+# Set COVID_SHARED_DATA=1 in the web workers when a separate loader process (covid_loader.py) keeps the data current
+# Workers then map the Datasets it publishes read-only, rather than each loading & aggregating their own copy
+SharedData = os.environ.get('COVID_SHARED_DATA', '') not in ('', '0')
+# Seconds between a worker's checks for a newly published Dataset in shared data mode
+WatchSeconds = float(os.environ.get('COVID_WATCH_SECONDS', 5))
+# Seconds a request will wait for the first Dataset before giving up
+ReadyTimeout = 30
+# Seconds between attempts when a background load fails
+RetrySeconds = 30
+# Load & refresh failures are logged here, with their tracebacks
+logger = logging.getLogger(__name__)
+
+# The Dataset callbacks should read from, for each scope
+_current = {}
+# Set once each scope's first Dataset has been published
+_ready = {scope: threading.Event() for scope in Scopes}
+# Serialises refreshes so two never build on the same Dataset at once
+_refresh_lock = threading.Lock()
+# Functions called with the new Dataset every time one is swapped in (e.g. to drop caches built on the old one)
+_listeners = []
+
+
+# A scope's current Dataset -- callbacks should call this once per request and only read from what it returns
+# Waits up to timeout seconds for the first load to finish, returning None if it still hasn't (or the scope isn't
+# served)
+def current(timeout=ReadyTimeout, scope=DefaultScope):
+    ready = _ready.get(scope)
+    if ready is None:
+        return None
+    if not ready.is_set():
+        ready.wait(timeout)
+    return _current.get(scope)
+
+
+# Whether the first Dataset of every scope has been published
+def ready():
+    return all(event.is_set() for event in _ready.values())
+
+
+# Versions of every scope's current Dataset
+def current_versions():
+    return [dataset.version for dataset in list(_current.values())]
+
+
+# Swap in a new Dataset for its scope & let listeners know
+def publish(dataset):
+    _current[dataset.scope] = dataset
+    for listener in list(_listeners):
+        listener(dataset)
+    _ready.setdefault(dataset.scope, threading.Event()).set()
+
+
+# Register a function to be called with each newly published Dataset
+def on_publish(listener):
+    _listeners.append(listener)
+    return listener
+
+
+# Load a scope's data from scratch (snapshot or source) and publish it
+def load(source=DataURL, snapshot_dir=SnapshotDir, scope=DefaultScope):
+    with instrument.stage('data', 'load'):
+        series, key = load_data(source, snapshot_dir, scope=scope)
+    with instrument.stage('data', 'aggregate'):
+        dataset = Dataset(series, key, scope=scope)
+    publish(dataset)
+    return dataset
+
+
+# Load every scope served -- returns their Datasets
+def load_scopes(source=DataURL, snapshot_dir=SnapshotDir):
+    return [load(source, snapshot_dir, scope) for scope in Scopes]
+
+
+# Check the source for new data of a scope & publish it -- returns True if a new Dataset was published
+# Sources are downloaded to the same folder load_data uses for snapshot_dir
+def refresh(source=DataURL, snapshot_dir=SnapshotDir, scope=DefaultScope):
+    with _refresh_lock:
+        dataset = current(scope=scope)
+        if dataset is None:
+            # The first load hasn't finished yet, so there's nothing to extend
+            return False
+
+        # Nothing to do if the source is unreachable or hasn't changed
+        with instrument.stage('refresh', 'check'):
+            try:
+                files, key = fetch_sources(source, sources_dir(snapshot_dir), scope)
+            except OSError:
+                return False
+        if key == dataset.version:
+            return False
+
+        # Only parse the dates we don't have yet -- anything else (new counties, revised layout) needs a full reload
+        try:
+            with instrument.stage('refresh', 'parse'):
+                added = parse_new_dates(files[0], files[1], dataset.series, scope)
+        except ValueError:
+            load(source, snapshot_dir, scope)
+            return True
+        if added is None:
+            # Files changed without adding dates (e.g. JHU revised old numbers, or the lookup table's populations) --
+            # reload them in full
+            load(source, snapshot_dir, scope)
+            return True
+
+        with instrument.stage('refresh', 'aggregate'):
+            new_dataset = dataset.extend(added[0], added[1], added[2], key)
+        with instrument.stage('refresh', 'snapshot'):
+            save_snapshot(key, new_dataset.series, snapshot_dir=snapshot_dir, scope=scope)
+        publish(new_dataset)
+        return True
+
+
+# Publish a Dataset for web workers in shared data mode -- the loader process registers this with on_publish
+def share(dataset, snapshot_dir=SnapshotDir):
+    with instrument.stage('data', 'share'):
+        save_shared(dataset.version, dataset.Agg, snapshot_dir, dataset.scope)
+
+
+# Map the Dataset of a scope the loader process most recently published, if it's not the one already current
+# Returns True if a new Dataset was published
+def attach(snapshot_dir=SnapshotDir, scope=DefaultScope):
+    key = latest_snapshot(snapshot_dir, pointer_file(SharedFile, scope))
+    if key is None or (scope in _current and key == _current[scope].version):
+        return False
+    with instrument.stage('data', 'attach'):
+        series, Agg = load_shared(key, snapshot_dir)
+        dataset = Dataset(series, key, Agg, scope)
+    publish(dataset)
+    return True
+
+
+# Load every scope's data in a background thread, retrying until it succeeds -- then is called afterwards (e.g. to warm
+# caches)
+def load_in_background(source=DataURL, snapshot_dir=SnapshotDir, then=None):
+    def run():
+        while True:
+            try:
+                load_scopes(source, snapshot_dir)
+                break
+            except Exception:
+                logger.exception('COVID data load failed, retrying in %ds', RetrySeconds)
+                time.sleep(RetrySeconds)
+        if then is not None:
+            then()
+
+    loader = threading.Thread(target=run, name='covid-loader', daemon=True)
+    loader.start()
+    return loader
+
+
+# Background thread calling refresh for every scope every RefreshSeconds
+class Refresher(threading.Thread):
+    def __init__(self, interval=RefreshSeconds, source=DataURL, snapshot_dir=SnapshotDir):
+        super().__init__(name='covid-refresher', daemon=True)
+        self.interval = interval
+        self.source = source
+        self.snapshot_dir = snapshot_dir
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # Keep serving the current data & try again next time
+                logger.exception('COVID data refresh failed')
+
+    def check(self):
+        for scope in Scopes:
+            refresh(self.source, self.snapshot_dir, scope)
+
+    def stop(self):
+        self.stopped.set()
+
+
+# Background thread attaching to each Dataset the loader process publishes, for web workers in shared data mode
+class Watcher(Refresher):
+    def __init__(self, interval=WatchSeconds, snapshot_dir=SnapshotDir):
+        super().__init__(interval, None, snapshot_dir)
+        self.name = 'covid-watcher'
+
+    def check(self):
+        for scope in Scopes:
+            attach(self.snapshot_dir, scope)
+
+
+# Start the background refresh (unless it's turned off) -- returns the thread, or None
+def start_refresher(interval=RefreshSeconds, source=DataURL, snapshot_dir=SnapshotDir):
+    if interval <= 0:
+        return None
+    refresher = Refresher(interval, source, snapshot_dir)
+    refresher.start()
+    return refresher
+
+
+# Attach to the loader process' data now if it has published any, then watch for new versions -- returns the thread
+def start_watcher(interval=WatchSeconds, snapshot_dir=SnapshotDir):
+    watcher = Watcher(interval, snapshot_dir)
+    watcher.check()
+    watcher.start()
+    return watcher
@@ -0,0 +1,109 @@
+# Region hierarchies the dashboard can show
+# Each scope is one pair of JHU time series & the three levels of regions in them -- the whole scope (a country, or the
+# world), its regions (states, or countries) & the rows of the files (counties, or provinces). Everything downstream
+# stores & aggregates the two lower levels the same way, so a scope only describes where its files are, which columns
+# name its regions and how they're labelled & mapped
+import collections
+import os
+
+# State abbreviations
+us_state_abbrev = {
+    'Alabama': 'AL',
+    'Alaska': 'AK',
+    'American Samoa': 'AS',
+    'Arizona': 'AZ',
+    'Arkansas': 'AR',
+    'California': 'CA',
+    'Colorado': 'CO',
+    'Connecticut': 'CT',
+    'Delaware': 'DE',
+    'District of Columbia': 'DC',
+    'Florida': 'FL',
+    'Georgia': 'GA',
+    'Guam': 'GU',
+    'Hawaii': 'HI',
+    'Idaho': 'ID',
+    'Illinois': 'IL',
+    'Indiana': 'IN',
+    'Iowa': 'IA',
+    'Kansas': 'KS',
+    'Kentucky': 'KY',
+    'Louisiana': 'LA',
+    'Maine': 'ME',
+    'Maryland': 'MD',
+    'Massachusetts': 'MA',
+    'Michigan': 'MI',
+    'Minnesota': 'MN',
+    'Mississippi': 'MS',
+    'Missouri': 'MO',
+    'Montana': 'MT',
+    'Nebraska': 'NE',
+    'Nevada': 'NV',
+    'New Hampshire': 'NH',
+    'New Jersey': 'NJ',
+    'New Mexico': 'NM',
+    'New York': 'NY',
+    'North Carolina': 'NC',
+    'North Dakota': 'ND',
+    'Northern Mariana Islands': 'MP',
+    'Ohio': 'OH',
+    'Oklahoma': 'OK',
+    'Oregon': 'OR',
+    'Pennsylvania': 'PA',
+    'Puerto Rico': 'PR',
+    'Rhode Island': 'RI',
+    'South Carolina': 'SC',
+    'South Dakota': 'SD',
+    'Tennessee': 'TN',
+    'Texas': 'TX',
+    'Utah': 'UT',
+    'Vermont': 'VT',
+    'Virgin Islands': 'VI',
+    'Virginia': 'VA',
+    'Washington': 'WA',
+    'West Virginia': 'WV',
+    'Wisconsin': 'WI',
+    'Wyoming': 'WY'
+}
+
+
+# Everything the dashboard needs to know about one scope
+#   name -- the whole scope, as shown in titles (its top level region, e.g. 'United States')
+#   long_name -- as shown in 'Show ...' buttons
+#   regions, subregions -- what its regions & the files' rows are called (e.g. 'state' & 'county'), & plurals -- both
+#     of them in the plural
+#   files -- JHU cases & deaths file names
+#   columns -- names of the files' region & subregion columns
+#   codes -- region name -> the map's location code, or None when the JHU lookup table gives them (rows of regions
+#     missing from codes are dropped)
+#   lookup -- whether populations & codes come from the JHU lookup table rather than the deaths file
+#   location_mode, geo -- how the map locates its regions & the map's projection settings
+#   subregion_map -- whether subregions can be mapped (by FIPS code)
+#   subregion_title -- title of a subregion's graph, from (subregion, region)
+Scope = collections.namedtuple('Scope', ['name', 'long_name', 'regions', 'subregions', 'plurals', 'files', 'columns',
+                                         'codes', 'lookup', 'location_mode', 'geo', 'subregion_map', 'subregion_title'])
+
+SCOPES = {
+    'us': Scope(
+        name='United States', long_name='United States of America', regions='state', subregions='county',
+        plurals=('states', 'counties'),
+        files=('time_series_covid19_confirmed_US.csv', 'time_series_covid19_deaths_US.csv'),
+        columns=('Province_State', 'Admin2'), codes=us_state_abbrev, lookup=False, location_mode='USA-states',
+        geo={'scope': 'usa', 'projection': {'type': 'albers usa'}}, subregion_map=True,
+        subregion_title='%s County, %s'),
+    'global': Scope(
+        name='World', long_name='the World', regions='country', subregions='province',
+        plurals=('countries', 'provinces'),
+        files=('time_series_covid19_confirmed_global.csv', 'time_series_covid19_deaths_global.csv'),
+        columns=('Country/Region', 'Province/State'), codes=None, lookup=True, location_mode='ISO-3',
+        geo={'scope': 'world', 'projection': {'type': 'natural earth'}, 'showcountries': True,
+             'countrycolor': '#bbbbbb'},
+        subregion_map=False, subregion_title='%s, %s'),
+}
+
+# Scopes to serve, as a comma separated list of SCOPES keys -- the first is the one pages open on
+Scopes = [scope.strip() for scope in os.environ.get('COVID_SCOPES', 'us').split(',') if scope.strip()]
+for _scope in Scopes:
+    if _scope not in SCOPES:
+        raise ValueError('Unknown scope %r in COVID_SCOPES, expected some of %s' % (_scope, ', '.join(SCOPES)))
+DefaultScope = Scopes[0]
@@ -0,0 +1,130 @@
+# Compact time series store for the dashboard
+# Cases & deaths are held as contiguous int32 arrays of counties x days. Rows are sorted by state then county, so
+# every state is one contiguous block of rows and state/country sums are single NumPy reductions over views
+# The same store holds the world -- countries are its states, provinces its counties & 'World' its country
+import datetime
+import json
+import os
+
+import numpy as np
+
+
+class TimeSeries:
+    def __init__(self, states, state_ids, counties, date_labels, cases, deaths, population, country='US', fips=None,
+                 codes=None):
+        # Name of the country all rows belong to
+        self.country = country
+        # State names (sorted) & the state id of every row
+        self.states = list(states)
+        # Every state's location code on the map (e.g. 'TX', or 'FRA' for a country -- '' when it has none)
+        self.codes = list(codes) if codes is not None else [''] * len(self.states)
+        self.state_ids = np.ascontiguousarray(state_ids, dtype=np.int32)
+        # County name of every row ('' when JHU doesn't name one)
+        self.counties = list(counties)
+        # Dates as JHU writes them (e.g. '3/1/20') and as datetime64
+        self.date_labels = list(date_labels)
+        self.dates = parse_dates(self.date_labels)
+        # Counties x days
+        self.cases = np.ascontiguousarray(cases, dtype=np.int32)
+        self.deaths = np.ascontiguousarray(deaths, dtype=np.int32)
+        # People per county
+        self.population = np.ascontiguousarray(population, dtype=np.int64)
+        # County FIPS codes (0 when JHU doesn't give one)
+        self.fips = np.ascontiguousarray(fips if fips is not None else np.zeros(len(self.counties)), dtype=np.int64)
+
+        # First row of every state (plus one past the last row), so state s is rows state_offsets[s]:state_offsets[s+1]
+        self.state_offsets = np.searchsorted(self.state_ids, np.arange(len(self.states) + 1)).astype(np.int64)
+        # Row lookups
+        self._state_index = {state: i for i, state in enumerate(self.states)}
+        self._county_index = {(self.states[s], county): row
+                              for row, (s, county) in enumerate(zip(self.state_ids.tolist(), self.counties))}
+
+    # Build from unsorted rows (e.g. as read from the JHU files) -- rows are sorted by state then county here
+    # codes maps state names to their location codes
+    @classmethod
+    def from_rows(cls, states, counties, date_labels, cases, deaths, population, fips=None, country='US', codes=None):
+        states = np.asarray(states, dtype=str)
+        counties = np.asarray(counties, dtype=object)
+        # Sort rows by state then county so each state is a contiguous block
+        order = np.lexsort((counties.astype(str), states))
+        state_names, state_ids = np.unique(states[order], return_inverse=True)
+        return cls(
+            states=state_names.tolist(),
+            state_ids=state_ids,
+            counties=counties[order].tolist(),
+            date_labels=date_labels,
+            cases=cases[order],
+            deaths=deaths[order],
+            population=population[order],
+            country=country,
+            fips=None if fips is None else np.asarray(fips)[order],
+            codes=None if codes is None else [codes.get(state, '') for state in state_names.tolist()],
+        )
+
+    @property
+    def num_dates(self):
+        return len(self.date_labels)
+
+    # Counties x days array for 'Cases' or 'Deaths'
+    def values(self, variable):
+        return self.cases if variable == 'Cases' else self.deaths
+
+    # Rows belonging to a state, as a slice (so indexing with it gives a view)
+    def state_rows(self, state):
+        s = self._state_index[state]
+        return slice(int(self.state_offsets[s]), int(self.state_offsets[s + 1]))
+
+    # Row of a county
+    def county_row(self, state, county):
+        return self._county_index[(state, county)]
+
+    # (state, county) of every row, in row order
+    def keys(self):
+        return [(self.states[s], county) for s, county in zip(self.state_ids.tolist(), self.counties)]
+
+    # New TimeSeries with extra days appended -- cases & deaths are rows x new days in this store's row order
+    def extend(self, cases, deaths, date_labels):
+        return TimeSeries(self.states, self.state_ids, self.counties, self.date_labels + list(date_labels),
+                          np.concatenate([self.cases, cases], axis=1), np.concatenate([self.deaths, deaths], axis=1),
+                          self.population, self.country, self.fips, self.codes)
+
+    # Write to a folder as .npy arrays plus a small JSON index
+    def save(self, folder):
+        np.save(os.path.join(folder, 'cases.npy'), self.cases)
+        np.save(os.path.join(folder, 'deaths.npy'), self.deaths)
+        np.save(os.path.join(folder, 'population.npy'), self.population)
+        np.save(os.path.join(folder, 'state_ids.npy'), self.state_ids)
+        np.save(os.path.join(folder, 'fips.npy'), self.fips)
+        with open(os.path.join(folder, 'index.json'), 'w') as f:
+            json.dump({
+                'country': self.country,
+                'states': self.states,
+                'codes': self.codes,
+                'counties': self.counties,
+                'dates': self.date_labels,
+            }, f)
+
+    # Read back what save wrote -- mmap_mode='r' maps the arrays read-only instead of reading them into memory
+    @classmethod
+    def load(cls, folder, mmap_mode=None):
+        with open(os.path.join(folder, 'index.json')) as f:
+            index = json.load(f)
+        # Snapshots written before FIPS codes were kept don't have them
+        fips = os.path.join(folder, 'fips.npy')
+        return cls(
+            states=index['states'],
+            state_ids=np.load(os.path.join(folder, 'state_ids.npy'), mmap_mode=mmap_mode),
+            counties=index['counties'],
+            date_labels=index['dates'],
+            cases=np.load(os.path.join(folder, 'cases.npy'), mmap_mode=mmap_mode),
+            deaths=np.load(os.path.join(folder, 'deaths.npy'), mmap_mode=mmap_mode),
+            population=np.load(os.path.join(folder, 'population.npy'), mmap_mode=mmap_mode),
+            country=index['country'],
+            fips=np.load(fips, mmap_mode=mmap_mode) if os.path.exists(fips) else None,
+            codes=index.get('codes'),
+        )
+
+
+# Turn JHU date labels (e.g. '3/1/20') into a datetime64[D] array
+def parse_dates(date_labels):
+    return np.array([datetime.datetime.strptime(x, '%m/%d/%y') for x in date_labels], dtype='datetime64[D]')
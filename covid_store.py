@@ -0,0 +1,469 @@
+# Aggregate store for the dashboard
+# Every country & state roll-up the callbacks need (cumulative/new, raw/per capita) is built once per data load with
+# NumPy reductions over the contiguous state blocks of the TimeSeries, so callbacks only ever do lookups. County level
+# series are single rows of the TimeSeries, so they're sliced out on demand rather than duplicated. Derived metrics
+# (covid_metrics) of the country & states are worked out here too (counties' are worked out on demand from their
+# totals), as are weekly & monthly roll-ups of every level, so long histories can be drawn a point a week or a month
+# rather than a point a day
+import os
+
+import numpy as np
+
+from covid_metrics import METRICS, LOOKBACK, compute, level_metrics, metric_at
+from covid_scopes import SCOPES, DefaultScope
+
+# Aggregation levels, from coarsest to finest -- a scope's whole, its regions & its subregions (for the world: the
+# world, countries & provinces)
+LEVELS = ['Country', 'State', 'County']
+# Variables in the dataset
+VARIABLES = ['Cases', 'Deaths']
+# Per capita values are expressed per this many people
+PER_CAPITA = 100000
+# Moving average periods the line graph offers -- averages over these are precomputed for the country & every state
+AVERAGE_PERIODS = range(2, 15)
+# Resolutions the data can be drawn at, from finest to coarsest -- days, weeks (Monday to Sunday) & calendar months
+TIERS = ['day', 'week', 'month']
+
+
+# Daily new values from cumulative ones (regions x days) -- previous holds the days before total, if there are any
+def _daily_new(total, previous=None):
+    if previous is None or previous.shape[1] == 0:
+        first = np.full((total.shape[0], 1), np.nan)
+    else:
+        first = previous[:, -1:]
+    return np.diff(np.concatenate([first, total], axis=1).astype(np.float64), axis=1)
+
+
+# Bucket of every date at a tier -- buckets are fixed calendar periods, so appending days never moves the ones before
+def tier_buckets(dates, tier):
+    if tier == 'month':
+        return dates.astype('datetime64[M]').astype(np.int64)
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    # 1970-01-01 was a Thursday, so this starts weeks on Mondays
+    return (days + 3) // 7 if tier == 'week' else days
+
+
+# Last day (index into the dates) of every bucket at a tier -- the latest bucket ends on the latest date, so it may
+# only be part of a week or month
+def tier_ends(dates, tier):
+    buckets = tier_buckets(dates, tier)
+    return np.flatnonzero(np.append(buckets[1:] != buckets[:-1], True))
+
+
+# Multiplier turning raw values into values per PER_CAPITA people -- regions without a population become NaN
+def _per_capita_scale(population):
+    with np.errstate(divide='ignore'):
+        scale = PER_CAPITA / population.astype(np.float64)
+    scale[~np.isfinite(scale)] = np.nan
+    return scale
+
+
+class Aggregates:
+    def __init__(self, series, matrices=None):
+        self.series = series
+        # Region names at each rolled up level
+        self.regions = {'Country': [series.country], 'State': series.states}
+        self._region_index = {level: {name: i for i, name in enumerate(names)} for level, names in self.regions.items()}
+        # People per region at each level, as per capita multipliers
+        starts = series.state_offsets[:-1]
+        state_pops = np.add.reduceat(series.population, starts)
+        self._scale = {
+            'Country': _per_capita_scale(np.array([state_pops.sum()])),
+            'State': _per_capita_scale(state_pops),
+            'County': _per_capita_scale(series.population),
+        }
+        # Keys are (level, variable, kind, percap) where kind is 'total' or 'new' and percap is a bool
+        # Values are regions x days arrays, so a whole map is one column and a whole graph is one row
+        self._matrices = matrices if matrices is not None else self._roll_up(0)
+        # Keys are (level, variable, period) -- moving averages of the daily new values
+        self._averages = self._moving_averages()
+        # Keys are (level, variable, metric) -- derived metrics (see covid_metrics) of the country & states, for the
+        # metrics each level offers
+        self._metrics = self._derive(0) if matrices is None else {}
+        # Last day of every week & month
+        self.ends = {tier: tier_ends(series.dates, tier) for tier in TIERS}
+        # Keys are (tier, level, variable, kind) for the week & month tiers at every level, including counties --
+        # regions x buckets of the total at the end of each bucket ('total') & the average new values per day over it
+        # ('new')
+        self._tiers = self._roll_tiers() if matrices is None else {}
+
+    # Sum the TimeSeries' days from first onwards up to country & state level
+    def _roll_up(self, first, previous=None):
+        starts = self.series.state_offsets[:-1]
+        matrices = {}
+        for variable in VARIABLES:
+            values = self.series.values(variable)[:, first:]
+            state_total = np.add.reduceat(values, starts, axis=0, dtype=np.int64)
+            for level, total in [('State', state_total), ('Country', state_total.sum(axis=0, keepdims=True))]:
+                prior = None if previous is None else previous[(level, variable, 'total', False)]
+                new = _daily_new(total, prior)
+                scale = self._scale[level][:, np.newaxis]
+                matrices[(level, variable, 'total', False)] = total
+                matrices[(level, variable, 'new', False)] = new
+                matrices[(level, variable, 'total', True)] = total * scale
+                matrices[(level, variable, 'new', True)] = new * scale
+        return matrices
+
+    # New Aggregates for a TimeSeries that has had days appended to this one's -- only the new days are rolled up
+    # Returns a new object rather than modifying this one, so readers holding it are never disturbed
+    def extend(self, series):
+        first = self.series.num_dates
+        extended = Aggregates(series, {})
+        added = extended._roll_up(first, self._matrices)
+        extended._matrices = {key: np.concatenate([self._matrices[key], part], axis=1) for key, part in added.items()}
+        extended._averages = extended._moving_averages()
+        added = extended._derive(first)
+        extended._metrics = {key: np.concatenate([self._metrics[key], part], axis=1) for key, part in added.items()}
+        # The latest week & month may have been part way through, so they're rolled up again along with the new ones
+        kept = {tier: len(self.ends[tier]) - 1 for tier in TIERS}
+        added = extended._roll_tiers(kept)
+        extended._tiers = {key: np.concatenate([self._tiers[key][:, :kept[key[0]]], part], axis=1)
+                           for key, part in added.items()}
+        return extended
+
+    # Cumulative totals of every region at a level, regions x days
+    def _totals(self, level, variable):
+        if level == 'County':
+            return self.series.values(variable)
+        return self._matrices[(level, variable, 'total', False)]
+
+    # Weekly & monthly roll-ups of every region, from bucket first[tier] onwards (every bucket when first is None)
+    def _roll_tiers(self, first=None):
+        tiers = {}
+        for tier in TIERS[1:]:
+            ends = self.ends[tier]
+            start = 0 if first is None else first[tier]
+            # Each bucket's new values run from the day after the previous bucket's last day (the first date has none)
+            previous = np.concatenate([[0], ends[:-1]])[start:]
+            days = np.where(ends[start:] > previous, ends[start:] - previous, np.nan)
+            for level in LEVELS:
+                for variable in VARIABLES:
+                    totals = self._totals(level, variable)
+                    total = totals[:, ends[start:]]
+                    tiers[(tier, level, variable, 'total')] = total
+                    tiers[(tier, level, variable, 'new')] = (total - totals[:, previous].astype(np.float64)) / days
+        return tiers
+
+    # Derived metrics of the country & every state for the days from first onwards, looking back as far as they need to
+    def _derive(self, first):
+        start = max(0, first - LOOKBACK)
+        metrics = {}
+        for level in LEVELS[:2]:
+            for variable in VARIABLES:
+                totals = self._matrices[(level, variable, 'total', False)][:, start:]
+                for metric, values in compute(totals, self._scale[level], level_metrics(level)).items():
+                    metrics[(level, variable, metric)] = values[:, first - start:]
+        return metrics
+
+    # Moving averages of every region's daily new values, one pass over all regions per period
+    def _moving_averages(self):
+        return {(level, variable, period): rolling_mean(values, period)
+                for (level, variable, kind, percap), values in self._matrices.items() if kind == 'new' and not percap
+                for period in AVERAGE_PERIODS}
+
+    # Keys of every array built from the daily values, with the file each is saved to
+    @staticmethod
+    def _files():
+        files = {}
+        for level in LEVELS[:2]:
+            for variable in VARIABLES:
+                for kind in ['total', 'new']:
+                    files[(level, variable, kind, False)] = '%s-%s-%s.npy' % (level, variable, kind)
+                    files[(level, variable, kind, True)] = '%s-%s-%s-percap.npy' % (level, variable, kind)
+                for period in AVERAGE_PERIODS:
+                    files[(level, variable, period)] = '%s-%s-avg%d.npy' % (level, variable, period)
+                for metric in level_metrics(level):
+                    files[(level, variable, metric)] = '%s-%s-%s.npy' % (level, variable, metric)
+        for level in LEVELS:
+            for variable in VARIABLES:
+                for tier in TIERS[1:]:
+                    for kind in ['total', 'new']:
+                        files[(tier, level, variable, kind)] = '%s-%s-%s-%s.npy' % (level, variable, tier, kind)
+        return files
+
+    # Which of the dicts of arrays a key from _files belongs to
+    def _store(self, key):
+        if key[0] in TIERS:
+            return self._tiers
+        if len(key) == 4:
+            return self._matrices
+        return self._averages if isinstance(key[2], int) else self._metrics
+
+    # Write every roll-up to a folder as .npy arrays, so other processes can map them rather than rebuild them
+    def save(self, folder):
+        for key, file_name in self._files().items():
+            np.save(os.path.join(folder, file_name), self._store(key)[key])
+
+    # Read back what save wrote for a TimeSeries -- mmap_mode='r' maps the arrays read-only
+    @classmethod
+    def load(cls, series, folder, mmap_mode=None):
+        Agg = cls(series, {})
+        for key, file_name in cls._files().items():
+            Agg._store(key)[key] = np.load(os.path.join(folder, file_name), mmap_mode=mmap_mode)
+        return Agg
+
+    # Regions x days array for the Country or State level
+    def matrix(self, level, variable, totals=True, percap=False):
+        return self._matrices[(level, variable, 'total' if totals else 'new', bool(percap))]
+
+    # A single region's time series -- the country when state is 'unused', a state when county is 'unused'
+    def region_series(self, variable, state='unused', county='unused', totals=False, percap=False):
+        if state == 'unused':
+            return self.matrix('Country', variable, totals, percap)[0]
+        if county == 'unused':
+            return self.matrix('State', variable, totals, percap)[self._region_index['State'][state]]
+
+        # Counties come straight from their row of the TimeSeries
+        row = self.series.county_row(state, county)
+        values = self.series.values(variable)[row:row + 1]
+        if not totals:
+            values = _daily_new(values)
+        if percap:
+            values = values * self._scale['County'][row]
+        return values[0]
+
+    # Regions x days array of a derived metric for the Country or State level
+    def metric(self, level, variable, metric):
+        return self._metrics[(level, variable, metric)]
+
+    # Every county's value of a derived metric on one day (an index into the dates), in TimeSeries row order
+    def county_metric(self, variable, metric, day):
+        return self._metrics_at('County', variable, slice(None), np.array([day]), metric)[:, 0]
+
+    # Regions x buckets array for the Country or State level at a tier -- the daily matrix at the 'day' tier
+    def tier_matrix(self, tier, level, variable, totals=True, percap=False):
+        if tier == 'day':
+            return self.matrix(level, variable, totals, percap)
+        values = self._tiers[(tier, level, variable, 'total' if totals else 'new')]
+        return values * self._scale[level][:, np.newaxis] if percap else values
+
+    # Position & gather lists for regions ((state, county) pairs as region_series takes them) -- {level: (positions in
+    # regions, row indices at that level)}, so each level's regions can be gathered in one go
+    def _gather(self, regions):
+        gather = {level: ([], []) for level in LEVELS}
+        for position, (state, county) in enumerate(regions):
+            if state == 'unused':
+                level, index = 'Country', 0
+            elif county == 'unused':
+                level, index = 'State', self._region_index['State'][state]
+            else:
+                level, index = 'County', self.series.county_row(state, county)
+            gather[level][0].append(position)
+            gather[level][1].append(index)
+        return {level: lists for level, lists in gather.items() if lists[0]}
+
+    # Days start..stop widened to whole months & kept within the dates -- (first day, last day), so small pans of the
+    # line graph ask for the same points
+    def month_range(self, start, stop):
+        months = self.ends['month']
+        last_day = self.series.num_dates - 1
+        first, last = np.searchsorted(months, [min(max(start, 0), last_day), min(max(stop, start, 0), last_day)])
+        return (int(months[first - 1]) + 1 if first > 0 else 0), int(months[last])
+
+    # Points the line graph draws for the days start..stop -- the finest tier fitting them into points points, with a
+    # point a month either side so the whole history is still there to pan & zoom out to
+    # Returns that tier & [(tier, bucket indices)] in date order
+    def graph_segments(self, start, stop, points):
+        for tier in TIERS:
+            ends = self.ends[tier]
+            first, last = np.searchsorted(ends, [start, stop])
+            if last - first < points:
+                break
+        months = self.ends['month']
+        # Months ending before the first bucket, & after the last one
+        before = int(np.searchsorted(months, start))
+        after = int(np.searchsorted(months, ends[last], 'right'))
+        segments = [('month', np.arange(before)), (tier, np.arange(first, last + 1)),
+                    ('month', np.arange(after, len(months)))]
+        return tier, [(segment_tier, buckets) for segment_tier, buckets in segments if len(buckets)]
+
+    # Many regions' values at the line graph's points (see graph_segments), as the points' days & regions x points
+    # kind is 'new' (average new values per day over each point's bucket, so the daily new values at the day tier),
+    # 'average' (moving average of the daily new values over period days, on each point's day) or one of METRICS
+    # Each level's regions are gathered in one go & only the points' days are read, so the work doesn't grow with the
+    # length of the history
+    def regions_points(self, regions, variable, segments, kind='new', period=7, percap=False):
+        days = np.concatenate([self.ends[tier][buckets] for tier, buckets in segments])
+        values = np.empty((len(regions), len(days)))
+        for level, (positions, indices) in self._gather(regions).items():
+            rows = np.array(indices)[:, np.newaxis]
+            if kind in METRICS:
+                part = self._metrics_at(level, variable, rows, days, kind)
+            elif kind == 'average':
+                part = self._averages_at(level, variable, rows, days, period)
+            else:
+                part = np.concatenate([self._new_at(level, variable, rows, tier, buckets)
+                                       for tier, buckets in segments], axis=1)
+            if percap:
+                part = part * self._scale[level][rows]
+            values[positions] = part
+        return days, values
+
+    # Average new values per day over buckets of a tier, for rows x buckets
+    def _new_at(self, level, variable, rows, tier, buckets):
+        if tier != 'day':
+            return self._tiers[(tier, level, variable, 'new')][rows, buckets]
+        totals = self._totals(level, variable)
+        new = totals[rows, buckets] - totals[rows, np.maximum(buckets - 1, 0)].astype(np.float64)
+        # The first date has nothing before it
+        new[:, buckets == 0] = np.nan
+        return new
+
+    # Moving averages of the daily new values on days, for rows x days -- looked up for the country & states, and
+    # otherwise worked out from the totals (the average of the period days of new values up to a day is how much the
+    # total grew over them, divided by period)
+    def _averages_at(self, level, variable, rows, days, period):
+        if (level, variable, period) in self._averages:
+            return self._averages[(level, variable, period)][rows, days]
+        if period < 1:
+            # Not a moving average -- nothing to show, like rolling_mean
+            return np.full(np.broadcast(rows, days).shape, np.nan)
+        totals = self._totals(level, variable)
+        averages = (totals[rows, days] - totals[rows, np.maximum(days - period, 0)].astype(np.float64)) / period
+        # NaN until a full period is available, like rolling_mean
+        averages[:, days < period] = np.nan
+        return averages
+
+    # A derived metric for rows x days -- looked up for the country & states, and otherwise worked out from the totals
+    def _metrics_at(self, level, variable, rows, days, metric):
+        if (level, variable, metric) in self._metrics:
+            return self._metrics[(level, variable, metric)][rows, days]
+        return metric_at(self._totals(level, variable), self._scale[level], rows, days, metric)
+
+    # Every county's value on one day (an index into the dates), in TimeSeries row order -- at the week or month tier,
+    # the total at the end of the day's bucket or its average new values per day
+    def county_day(self, variable, day, totals=True, percap=False, tier='day'):
+        values = self.series.values(variable)
+        if tier != 'day':
+            bucket = int(np.searchsorted(self.ends[tier], day))
+            column = self._tiers[(tier, 'County', variable, 'total' if totals else 'new')][:, bucket]
+            column = column.astype(np.float64)
+        elif totals:
+            column = values[:, day].astype(np.float64)
+        elif day > 0:
+            column = values[:, day].astype(np.float64) - values[:, day - 1]
+        else:
+            column = np.full(values.shape[0], np.nan)
+        if percap:
+            column = column * self._scale['County']
+        return column
+
+    # Latest cumulative value of every state
+    def latest_states(self, variable):
+        return self.matrix('State', variable)[:, -1]
+
+    # Names & latest cumulative values of every county in a state
+    def latest_counties(self, variable, state):
+        rows = self.series.state_rows(state)
+        return self.series.counties[rows], self.series.values(variable)[rows, -1]
+
+
+# Trailing moving average along the last axis (so one series, or regions x days) -- NaN until a full period is
+# available, like pandas' rolling().mean()
+def rolling_mean(values, period):
+    averages = np.full(values.shape, np.nan)
+    if 0 < period <= values.shape[-1]:
+        averages[..., period - 1:] = np.lib.stride_tricks.sliding_window_view(values, period, axis=-1).mean(axis=-1)
+    return averages
+
+
+# Most positions the date slider steps through -- past this many days it steps through the weeks, then the months
+MaxSliderSteps = 400
+# Most dates labelled on the slider when it steps through weeks or months
+MaxSliderLabels = 40
+
+
+# Days the date slider stops at -- every day (but the first, which has no new values) while there aren't too many,
+# otherwise the last day of every week or month. Returns the tier & the days
+def slider_days(Agg, steps=MaxSliderSteps):
+    for tier in TIERS:
+        if len(Agg.ends[tier]) <= steps:
+            break
+    days = Agg.ends[tier].tolist()
+    return tier, days[1:] if tier == 'day' and len(days) > 1 else days
+
+
+# Dictionary of slider marks -- at the day tier only keep weekly marks (counting back from the latest date) without
+# the year. At the week & month tiers every stop is a mark (the slider can only stop at marks), & only some of them,
+# counting back from the latest, are labelled
+def date_marks(DateList, tier='day', days=None):
+    num_dates = len(DateList)
+    if tier == 'day':
+        return {i: DateList[i][:-3] for i in range(num_dates) if (num_dates - 1 - i) % 7 == 0}
+    every = -(-len(days) // MaxSliderLabels)
+    return {day: DateList[day] if (len(days) - 1 - i) % every == 0 else '' for i, day in enumerate(days)}
+
+
+# Ways the state & county drop-downs can be sorted
+SORTS = ['abc', 'cases']
+
+
+# Drop-down option lists for every state & county, in both sort orders -- they only change with the data, so they're
+# built once per Dataset and the callback hands back the same lists every time
+# Returns {sort: state options} and {sort: {state: county options}}, labelled with the scope's names for them
+def dropdown_options(Agg, scope=DefaultScope):
+    Scope = SCOPES[scope]
+    StateNames = Agg.regions['State']
+    by_cases = np.argsort(-Agg.latest_states('Cases'), kind='stable')
+    state_orders = {'abc': StateNames, 'cases': [StateNames[i] for i in by_cases]}
+    StateOptions = {sort: [{'label': 'Select a ' + Scope.regions, 'value': 'unused'}] +
+                          [{'label': state_name, 'value': state_name} for state_name in state_orders[sort]]
+                    for sort in SORTS}
+
+    CountyOptions = {sort: {} for sort in SORTS}
+    for state_name in StateNames:
+        CtyNames, CtyTotals = Agg.latest_counties('Cases', state_name)
+        cty_orders = {'abc': CtyNames, 'cases': [CtyNames[i] for i in np.argsort(-CtyTotals, kind='stable')]}
+        # Counties without a name can't be picked
+        for sort in SORTS:
+            CountyOptions[sort][state_name] = [{'label': 'Select a ' + Scope.subregions, 'value': 'unused'}] + \
+                [{'label': cty, 'value': cty} for cty in cty_orders[sort] if cty]
+    return StateOptions, CountyOptions
+
+
+# Options for the line graph's comparison drop-down -- every state, then every named county as 'state|county'
+def region_options(Agg):
+    return [{'label': state_name, 'value': state_name} for state_name in Agg.regions['State']] + \
+        [{'label': county + ', ' + state_name, 'value': state_name + '|' + county}
+         for state_name, county in Agg.series.keys() if county]
+
+
+# (state, county) for a comparison drop-down value (see region_options)
+def region_key(value):
+    state_name, _, county = value.partition('|')
+    return state_name, county or 'unused'
+
+
+# Everything the callbacks read for one version of the data
+# Callbacks grab the current Dataset once and read only from it, so a refresh swapping in a new one mid-request
+# can never hand them a mix of old and new data
+class Dataset:
+    def __init__(self, series, version, Agg=None, scope=DefaultScope):
+        self.series = series
+        self.version = version
+        # Which region hierarchy the data is (see covid_scopes)
+        self.scope = scope
+        self.Scope = SCOPES[scope]
+        # Build every country/state aggregate once, so callbacks only do lookups
+        self.Agg = Agg if Agg is not None else Aggregates(series)
+        # Dates in dataset for date slider, which steps through the days, weeks or months (SliderTier) -- the state map
+        # is sent a frame for each of the days it stops at (SliderDays)
+        self.DateList = series.date_labels
+        self.SliderTier, self.SliderDays = slider_days(self.Agg)
+        self.DateMarks = date_marks(self.DateList, self.SliderTier, self.SliderDays)
+        self.num_dates = len(self.DateList)
+        # ISO dates for the line graph's x axis, shared by every trace
+        self.DateAxis = np.datetime_as_string(series.dates, unit='D').tolist()
+        # State & county drop-down options
+        self.StateOptions, self.CountyOptions = dropdown_options(self.Agg, scope)
+        self.RegionOptions = region_options(self.Agg)
+
+    # The date slider's stop at or after a day -- the date the map is drawn for
+    def slider_day(self, day):
+        days = self.SliderDays
+        return days[min(int(np.searchsorted(days, day)), len(days) - 1)]
+
+    # New Dataset with extra days appended -- aggregates are only computed for the new days
+    def extend(self, cases, deaths, date_labels, version):
+        series = self.series.extend(cases, deaths, date_labels)
+        return Dataset(series, version, self.Agg.extend(series), self.scope)
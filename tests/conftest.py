@@ -0,0 +1,43 @@
+# Shared fixtures -- the tests import the app's modules from the repository root & write synthetic JHU files (see
+# benchmarks/synthetic.py) into pytest's temporary folders
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, Root)
+
+from benchmarks.synthetic import write_global, write_synthetic
+
+
+# Rewrite the source files without their last dropped date columns -- returns a function putting them back, so a
+# refresh sees the same history with dates appended
+def drop_dates(paths, dropped):
+    frames = [pd.read_csv(path) for path in paths]
+    for path, frame in zip(paths, frames):
+        frame.iloc[:, :-dropped].to_csv(path, index=False)
+
+    def restore():
+        for path, frame in zip(paths, frames):
+            frame.to_csv(path, index=False)
+    return restore
+
+
+# Folder of small synthetic US files -- 60 counties over 120 days (82 of them from FirstDate on)
+@pytest.fixture
+def source(tmp_path):
+    folder = str(tmp_path / 'source')
+    write_synthetic(folder, counties=60, days=120, seed=1)
+    return folder
+
+
+# Folder of small synthetic files for every scope -- the global files & lookup table put 12 provinces under the first
+# 12 countries, so every other country is a single row of its own, plus the same US files as source
+@pytest.fixture
+def all_scopes_source(tmp_path):
+    folder = str(tmp_path / 'source')
+    write_global(folder, provinces=12, days=120, seed=2)
+    write_synthetic(folder, counties=60, days=120, seed=1)
+    return folder
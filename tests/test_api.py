@@ -0,0 +1,108 @@
+# The /api endpoints' HTTP contract -- strong ETags (a '-gz' one for gzipped bodies), 304s for If-None-Match, gzip
+# only when the client takes it & the body is worth it, and JSON errors with 400/404/503 statuses
+import gzip
+import json
+
+import flask
+import pytest
+
+import covid_api
+import covid_refresh
+
+
+# A Flask app serving just the API over the synthetic data
+@pytest.fixture
+def client(source, tmp_path):
+    covid_refresh.load(source, str(tmp_path / 'snapshots'), 'us')
+    app = flask.Flask(__name__)
+    covid_api.install(app)
+    return app.test_client()
+
+
+# A quoted ETag as the client sends it back
+def quoted(response):
+    return '"%s"' % response.headers['ETag'].strip('"')
+
+
+def test_responses_carry_caching_headers(client):
+    response = client.get('/api/series?state=Texas&from=2020-04-01&to=2020-04-03')
+    assert response.status_code == 200 and response.mimetype == 'application/json'
+    body = response.get_json()
+    assert body['dates'] == ['2020-04-01', '2020-04-02', '2020-04-03'] and len(body['cases']) == 3
+    assert not response.headers['ETag'].startswith('W/')
+    assert response.headers['Cache-Control'] == 'public, max-age=%d' % covid_api.ApiMaxAge
+    assert response.headers['Vary'] == 'Accept, Accept-Encoding'
+
+    # Parameter order & parameters the endpoint doesn't read don't change the tag
+    same = client.get('/api/series?to=2020-04-03&from=2020-04-01&state=Texas&level=county')
+    assert same.headers['ETag'] == response.headers['ETag']
+    other = client.get('/api/series?state=Texas&from=2020-04-01&to=2020-04-04')
+    assert other.headers['ETag'] != response.headers['ETag']
+
+
+def test_if_none_match_gets_a_304(client):
+    url = '/api/series?state=Texas&from=2020-04-01&to=2020-04-03'
+    first = client.get(url)
+    for tags in [quoted(first), '"other", ' + quoted(first), '*']:
+        repeat = client.get(url, headers={'If-None-Match': tags})
+        assert repeat.status_code == 304 and repeat.data == b''
+        assert repeat.headers['ETag'] == first.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_gzip_negotiation(client):
+    url = '/api/map?level=county&date=2020-04-01'
+    plain = client.get(url)
+    packed = client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+    assert 'Content-Encoding' not in plain.headers
+    assert packed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(packed.data) == plain.data
+    # The two bodies are different representations, so they get different tags
+    assert quoted(packed) == quoted(plain)[:-1] + '-gz"'
+
+    # The gzipped tag only counts for a client still taking gzip, & the plain one only for a client that doesn't
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': quoted(packed)}).status_code == 304
+    assert client.get(url, headers={'If-None-Match': quoted(packed)}).status_code == 200
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': quoted(plain)}).status_code == 200
+
+    # Small bodies aren't compressed, & a '-gz' tag never matches them
+    url = '/api/series?from=2020-04-01&to=2020-04-01&format=csv'
+    small = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert len(small.data) < covid_api.MinGzipBytes and 'Content-Encoding' not in small.headers
+    assert not quoted(small).endswith('-gz"')
+    fake = quoted(small)[:-1] + '-gz"'
+    assert client.get(url, headers={'Accept-Encoding': 'gzip', 'If-None-Match': fake}).status_code == 200
+
+
+def test_csv_from_the_format_parameter_or_accept_header(client):
+    by_parameter = client.get('/api/map?date=2020-04-01&format=csv')
+    by_header = client.get('/api/map?date=2020-04-01', headers={'Accept': 'text/csv'})
+    for response in [by_parameter, by_header]:
+        assert response.mimetype == 'text/csv'
+        assert response.data.decode('utf-8').splitlines()[0] == 'state,code,value'
+    assert by_parameter.data == by_header.data
+
+
+@pytest.mark.parametrize('url, status', [
+    ('/api/nope', 404),
+    ('/api/series?scope=mars', 404),
+    ('/api/series?state=Atlantis', 404),
+    ('/api/series?state=Texas&county=Nowhere', 404),
+    ('/api/series?county=County%200', 400),
+    ('/api/series?from=2020-04-03&to=2020-04-01', 400),
+    ('/api/series?from=April', 400),
+    ('/api/series?from=2019-01-01', 404),
+    ('/api/map?var=Hospitalisations', 400),
+    ('/api/map?var=Cases:bogus', 400),
+    ('/api/map?level=world', 400),
+])
+def test_errors(client, url, status):
+    response = client.get(url)
+    assert response.status_code == status
+    assert response.mimetype == 'application/json' and 'error' in json.loads(response.data)
+
+
+def test_data_still_loading(client, monkeypatch):
+    monkeypatch.setattr(covid_api, 'current', lambda scope: None)
+    response = client.get('/api/series')
+    assert response.status_code == 503 and response.headers['Retry-After'] == '30'
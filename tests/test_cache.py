@@ -0,0 +1,75 @@
+# Figure cache -- concurrent requests for a figure still being built wait for that one build (single-flight)
+import threading
+import time
+
+import pytest
+
+from covid_cache import FigureCache
+
+Callers = 8
+
+
+# Call get_or_build for key from Callers threads at once, with a build that blocks until every other caller is waiting
+# on it -- returns the results (or errors) & how many times build ran
+def build_concurrently(cache, key, result=None, error=None):
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(threading.current_thread().name)
+        release.wait(10)
+        if error is not None:
+            raise error
+        return result
+
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(cache.get_or_build(key, build))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(Callers)]
+    for thread in threads:
+        thread.start()
+    # Everyone but the leader has joined its flight
+    deadline = time.monotonic() + 10
+    while cache.coalesced < Callers - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    return outcomes, len(builds)
+
+
+def test_concurrent_callers_share_one_build():
+    cache = FigureCache(16, directory=None, export_dir=None)
+    figure = {'data': [1, 2, 3]}
+    outcomes, builds = build_concurrently(cache, ('map', 'v1', 'Cases', ()), result=figure)
+    assert builds == 1 and cache.coalesced == Callers - 1
+    assert len(outcomes) == Callers and all(outcome is figure for outcome in outcomes)
+
+    # Later callers get the cached figure without building
+    assert cache.get_or_build(('map', 'v1', 'Cases', ()), lambda: pytest.fail('built again')) is figure
+
+
+def test_failed_build_reaches_every_caller_and_is_retried():
+    cache = FigureCache(16, directory=None, export_dir=None)
+    outcomes, builds = build_concurrently(cache, ('scatter', 'v1', 'Texas'), error=KeyError('Texas'))
+    assert builds == 1
+    assert len(outcomes) == Callers and all(isinstance(outcome, KeyError) for outcome in outcomes)
+
+    # Nothing is left in flight or cached, so the next request builds again
+    assert cache.get_or_build(('scatter', 'v1', 'Texas'), lambda: {'ok': True}) == {'ok': True}
+
+
+def test_shared_directory_serves_other_processes_builds(tmp_path):
+    key = ('map', 'v1', 'Deaths', ('percap',))
+    FigureCache(16, directory=str(tmp_path), export_dir=None).get_or_build(key, lambda: {'z': [1.5]})
+    other = FigureCache(16, directory=str(tmp_path), export_dir=None)
+    assert other.get_or_build(key, lambda: pytest.fail('built again')) == {'z': [1.5]}
+
+    # Dropping the version removes its folder
+    other.invalidate('v2')
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,112 @@
+# Downloads of the source files, against a stand-in for the JHU server on localhost -- unchanged files are answered
+# with a 304 & reused, server errors are retried, and an unreachable source falls back to the last data loaded
+import functools
+import http.server
+import os
+import threading
+import urllib.error
+
+import numpy as np
+import pytest
+
+import covid_data
+import covid_fetch
+import covid_refresh
+from covid_data import CasesFile, DeathsFile
+
+
+# Serves the files in a folder with an ETag of their contents' version, answering If-None-Match with a 304
+# Fails the next server.failures requests with a 503, & counts the requests & full bodies sent
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        if server.failures:
+            server.failures -= 1
+            self.send_error(503)
+            return
+        path = os.path.join(server.folder, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        etag = '"%s"' % covid_data.file_version(path)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        with open(path, 'rb') as f:
+            body = f.read()
+        server.bodies += 1
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# The source folder served from a background thread -- its base URL is server.url
+@pytest.fixture
+def server(source):
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.folder, httpd.failures, httpd.requests, httpd.bodies = source, 0, 0, 0
+    httpd.url = 'http://127.0.0.1:%d/data' % httpd.server_address[1]
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_unchanged_file_reuses_download(server, tmp_path):
+    url = server.url + '/' + CasesFile
+    first = covid_fetch.fetch(url, str(tmp_path), backoff=0)
+    with open(first.path, 'rb') as f:
+        body = f.read()
+    assert first.changed
+
+    second = covid_fetch.fetch(url, str(tmp_path), backoff=0)
+    assert not second.changed
+    assert (second.path, second.version) == (first.path, first.version)
+    with open(second.path, 'rb') as f:
+        assert f.read() == body
+    assert (server.requests, server.bodies) == (2, 1)
+
+
+def test_server_errors_are_retried(server, tmp_path):
+    url = server.url + '/' + CasesFile
+    server.failures = 2
+    assert covid_fetch.fetch(url, str(tmp_path), attempts=3, backoff=0).changed
+    assert server.requests == 3
+
+    # Out of attempts, the last error is raised
+    server.failures = 2
+    with pytest.raises(urllib.error.HTTPError) as error:
+        covid_fetch.fetch(url, str(tmp_path / 'other'), attempts=2, backoff=0)
+    assert error.value.code == 503
+
+
+def test_unreachable_source_falls_back_to_last_download(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(covid_data, 'fetch_all', functools.partial(covid_fetch.fetch_all, backoff=0))
+    snapshot_dir = str(tmp_path / 'snapshots')
+    series, key = covid_data.load_data(server.url, snapshot_dir, scope='us')
+    # Downloads go alongside the snapshots
+    assert sorted(os.listdir(covid_data.sources_dir(snapshot_dir))) == sorted(
+        [CasesFile, CasesFile + '.json', DeathsFile, DeathsFile + '.json'])
+    dataset = covid_refresh.load(server.url, snapshot_dir, 'us')
+    assert dataset.version == key and server.bodies == 2
+
+    server.shutdown()
+    server.server_close()
+    offline, offline_key = covid_data.load_data(server.url, snapshot_dir, scope='us')
+    assert offline_key == key
+    np.testing.assert_array_equal(offline.values('Cases'), series.values('Cases'))
+    # Refreshing while the source is down keeps the current data
+    assert not covid_refresh.refresh(server.url, snapshot_dir, 'us')
+    assert covid_refresh.current(scope='us') is dataset
+
+    # With no snapshot to fall back to, the error is raised
+    with pytest.raises(OSError):
+        covid_data.load_data(server.url, str(tmp_path / 'empty'), scope='us')
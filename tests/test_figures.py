@@ -0,0 +1,42 @@
+# Line graph downsampling (Largest-Triangle-Three-Buckets) & the zoom window the browser reports
+import numpy as np
+
+import covid_refresh
+from covid_figures import graph_window, lttb
+
+
+def test_lttb_keeps_the_ends_and_returns_points_points():
+    rng = np.random.default_rng(2)
+    values = np.cumsum(rng.normal(size=(5, 1000)), axis=1)
+    values[1, 300:320] = np.nan
+    kept, sampled = lttb(values, 100)
+    assert kept.shape == sampled.shape == (5, 100)
+    assert (kept[:, 0] == 0).all() and (kept[:, -1] == 999).all()
+    # One point from each bucket, in date order, with the values at those days
+    assert (np.diff(kept, axis=1) > 0).all()
+    np.testing.assert_array_equal(sampled, np.take_along_axis(values, kept, axis=1))
+
+
+def test_lttb_keeps_spikes():
+    values = np.zeros((2, 500))
+    values[0, 123] = 50
+    values[1, 377] = -50
+    kept, _ = lttb(values, 20)
+    assert 123 in kept[0] and 377 in kept[1]
+
+
+def test_lttb_leaves_short_lines_alone():
+    values = np.arange(200, dtype=np.float64).reshape(2, 100)
+    for points in [100, 150]:
+        kept, sampled = lttb(values, points)
+        assert kept is None and sampled is values
+
+
+def test_graph_window_is_whole_months(source, tmp_path):
+    data = covid_refresh.load(source, str(tmp_path / 'snapshots'), 'us')
+    window = graph_window(data, ['2020-04-10T12:00:00', '2020-04-20'])
+    assert [data.DateAxis[day] for day in window] == ['2020-04-01', '2020-04-30']
+    # Nothing (or nonsense) visible, or the whole history, is no window
+    assert graph_window(data, None) is None
+    assert graph_window(data, ['yesterday', 'today']) is None
+    assert graph_window(data, [data.DateAxis[0], data.DateAxis[-1]]) is None
@@ -0,0 +1,27 @@
+# Derived metrics -- ranks follow one rule at every level: 1 + the number of regions strictly above, so tied regions
+# share the best rank
+import numpy as np
+
+from covid_metrics import CountRows, compute, metric_at
+
+
+def test_tied_regions_share_the_best_rank():
+    # Three days of five regions -- everyone at 0 on the first day, a pair tied on the second, no population for one
+    totals = np.array([[0, 10, 30], [0, 20, 20], [0, 20, 10], [0, 5, 40], [0, 7, 9]], dtype=np.int32)
+    scale = np.array([1.0, 1.0, 1.0, 1.0, np.nan])
+    ranks = compute(totals, scale)['rank']
+    expected = np.array([[1, 3, 2], [1, 1, 3], [1, 1, 4], [1, 4, 1], [np.nan] * 3])
+    np.testing.assert_array_equal(ranks, expected)
+
+
+def test_precomputed_and_on_demand_ranks_agree():
+    rng = np.random.default_rng(5)
+    # Small counts, so there are plenty of ties
+    totals = np.cumsum(rng.integers(0, 3, (40, 30)), axis=1).astype(np.int32)
+    scale = rng.choice([1.0, 2.0, np.nan], 40)
+    precomputed = compute(totals, scale)['rank']
+    days = np.arange(30)
+    # A few rows are counted, more are looked up in each day's sorted values -- both must match
+    for rows in [np.array([[0], [7], [39]]), np.arange(CountRows + 5)[:, np.newaxis], slice(None)]:
+        np.testing.assert_array_equal(metric_at(totals, scale, rows, days, 'rank'), precomputed[rows, days]
+                                      if not isinstance(rows, slice) else precomputed)
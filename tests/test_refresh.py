@@ -0,0 +1,52 @@
+# A refresh extends the current Dataset by just the new dates & publishes it in one step -- the result must be the
+# same as loading everything from scratch
+import os
+
+import numpy as np
+
+from conftest import drop_dates
+from covid_data import CasesFile, DeathsFile, load_data
+import covid_refresh
+from covid_store import Dataset
+
+
+# Every array two Aggregates hold must match, including ones only one of them has worked out so far
+def assert_same_aggregates(extended, full):
+    for store in ['_matrices', '_averages', '_metrics', '_tiers']:
+        assert getattr(extended, store).keys() == getattr(full, store).keys()
+        for key, values in getattr(full, store).items():
+            np.testing.assert_allclose(getattr(extended, store)[key], values, rtol=1e-5, equal_nan=True, err_msg=key)
+    for tier, ends in full.ends.items():
+        np.testing.assert_array_equal(extended.ends[tier], ends)
+
+
+def test_refresh_matches_full_load(source, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    restore = drop_dates([os.path.join(source, CasesFile), os.path.join(source, DeathsFile)], 10)
+    before = covid_refresh.load(source, snapshot_dir, 'us')
+    assert not covid_refresh.refresh(source, snapshot_dir, 'us')
+
+    published = []
+    listener = covid_refresh.on_publish(published.append)
+    try:
+        restore()
+        assert covid_refresh.refresh(source, snapshot_dir, 'us')
+    finally:
+        covid_refresh._listeners.remove(listener)
+
+    # The new Dataset was swapped in whole, & the one readers already held is untouched
+    after = covid_refresh.current(scope='us')
+    assert published == [after]
+    assert after.num_dates == before.num_dates + 10
+    assert before.Agg.matrix('State', 'Cases').shape[1] == before.num_dates
+
+    full = Dataset(*load_data(source, str(tmp_path / 'full'), scope='us'), scope='us')
+    assert after.version == full.version
+    for variable in ['Cases', 'Deaths']:
+        np.testing.assert_array_equal(after.series.values(variable), full.series.values(variable))
+    assert_same_aggregates(after.Agg, full.Agg)
+
+    # County metrics are worked out on demand from the extended totals
+    for metric in ['growth', 'rank']:
+        np.testing.assert_allclose(after.Agg.county_metric('Cases', metric, after.num_dates - 1),
+                                   full.Agg.county_metric('Cases', metric, after.num_dates - 1), equal_nan=True)
@@ -0,0 +1,61 @@
+# The world scope -- countries are its regions & provinces its rows, with populations & ISO-3 map codes from the JHU
+# lookup table, and every served scope loads from the one source
+import os
+
+import numpy as np
+
+from benchmarks.synthetic import OtherCountries, global_countries
+import covid_refresh
+from covid_figures import county_locations
+from covid_scopes import SCOPES
+
+
+def test_load_scopes_loads_the_world(all_scopes_source, tmp_path, monkeypatch):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    monkeypatch.setattr(covid_refresh, 'Scopes', ['us', 'global'])
+    us, world = covid_refresh.load_scopes(all_scopes_source, snapshot_dir)
+    assert (us.scope, world.scope) == ('us', 'global')
+    assert covid_refresh.current(scope='global') is world
+    # Each scope keeps its own snapshot pointer
+    assert {'LATEST', 'LATEST-global'} <= set(os.listdir(snapshot_dir))
+
+    series = world.series
+    names, codes = global_countries()
+    assert series.country == 'World'
+    assert series.states == sorted(names + OtherCountries)
+    assert world.Agg.regions['State'] == series.states
+
+    # Countries are mapped by their ISO-3 code -- ships & the like aren't in the lookup table, so have none
+    code_of = dict(zip(series.states, series.codes))
+    assert [code_of[name] for name in names] == codes
+    assert all(code_of[name] == '' for name in OtherCountries)
+    for name in OtherCountries:
+        assert series.population[series.state_rows(name)].tolist() == [0]
+
+
+def test_countries_without_provinces(all_scopes_source, tmp_path):
+    world = covid_refresh.load(all_scopes_source, str(tmp_path / 'snapshots'), 'global')
+    series = world.series
+    names, _ = global_countries()
+    cases = world.Agg.matrix('State', 'Cases')
+
+    # A country with provinces has its own row ('') & theirs, one without is just its own row
+    assert series.counties[series.state_rows(names[0])] == ['', 'Province 0']
+    for name in names[12:]:
+        rows = series.state_rows(name)
+        assert series.counties[rows] == ['']
+        s = series.states.index(name)
+        np.testing.assert_array_equal(cases[s], series.cases[rows][0])
+    # Only the provinces are offered as subregions
+    assert [option['value'] for option in world.RegionOptions if '|' in option['value']] == \
+        sorted('%s|Province %d' % (names[i], i) for i in range(12))
+
+
+def test_world_has_no_county_map(all_scopes_source, tmp_path):
+    world = covid_refresh.load(all_scopes_source, str(tmp_path / 'snapshots'), 'global')
+    assert not SCOPES['global'].subregion_map
+    assert SCOPES['global'].location_mode == 'ISO-3'
+    # No FIPS codes, so no rows the county map could draw
+    assert not world.series.fips.any()
+    rows, locations = county_locations(world.series)
+    assert len(rows) == 0 and locations == []
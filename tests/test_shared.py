@@ -0,0 +1,82 @@
+# Shared data mode -- the loader publishes each version's aggregates next to its snapshot & repoints SHARED, workers
+# map it read-only & switch to each new version, and aggregates no worker can still be mapping are pruned
+import os
+import time
+
+import numpy as np
+
+from conftest import drop_dates
+from covid_data import CasesFile, DeathsFile, LatestFile, SharedFile, PreviousSuffix, latest_snapshot
+import covid_refresh
+
+
+# Whether an array is a read-only view of a mapped file rather than a copy in this process' memory
+def mapped(values):
+    return not values.flags.writeable and not values.flags.owndata
+
+
+# Publish the loader's current Dataset for workers -- returns it
+def publish_shared(snapshot_dir):
+    dataset = covid_refresh.current(scope='us')
+    covid_refresh.share(dataset, snapshot_dir)
+    return dataset
+
+
+# Act as a web worker that has only ever seen what the loader shared -- returns the Dataset it attached to
+def attach_fresh(snapshot_dir):
+    covid_refresh._current.pop('us', None)
+    assert covid_refresh.attach(snapshot_dir, 'us')
+    return covid_refresh.current(scope='us')
+
+
+def test_workers_follow_shared_versions_and_old_aggregates_are_pruned(source, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshots')
+    paths = [os.path.join(source, CasesFile), os.path.join(source, DeathsFile)]
+    restore = drop_dates(paths, 10)
+
+    # Version 1 -- shared, then mapped by a worker
+    covid_refresh.load(source, snapshot_dir, 'us')
+    first = publish_shared(snapshot_dir)
+    worker = attach_fresh(snapshot_dir)
+    assert worker.version == first.version and worker is not first
+    assert mapped(worker.series.cases)
+    assert mapped(worker.Agg.matrix('State', 'Cases'))
+    np.testing.assert_array_equal(worker.Agg.matrix('State', 'Cases'), first.Agg.matrix('State', 'Cases'))
+    np.testing.assert_array_equal(worker.Agg.metric('State', 'Deaths', 'rank'),
+                                  first.Agg.metric('State', 'Deaths', 'rank'))
+    # Nothing new to attach to
+    assert not covid_refresh.attach(snapshot_dir, 'us')
+
+    # Version 2 -- the loader refreshes (building on the mapped data) & shares, & a watching worker switches to it
+    restore()
+    drop_dates(paths, 5)
+    assert covid_refresh.refresh(source, snapshot_dir, 'us')
+    second = publish_shared(snapshot_dir)
+    assert latest_snapshot(snapshot_dir, LatestFile) == latest_snapshot(snapshot_dir, SharedFile) == second.version
+    assert latest_snapshot(snapshot_dir, SharedFile + PreviousSuffix) == first.version
+
+    covid_refresh._current['us'] = worker
+    watcher = covid_refresh.Watcher(0.01, snapshot_dir)
+    watcher.start()
+    try:
+        deadline = time.monotonic() + 10
+        while covid_refresh.current(scope='us').version != second.version and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        watcher.stop()
+        watcher.join(10)
+    switched = covid_refresh.current(scope='us')
+    assert switched.version == second.version and switched.num_dates == first.num_dates + 5
+    assert mapped(switched.Agg.matrix('Country', 'Cases'))
+
+    # Version 3 -- version 1's aggregates are deleted, version 2's kept for workers that haven't switched yet
+    restore()
+    assert covid_refresh.refresh(source, snapshot_dir, 'us')
+    third = publish_shared(snapshot_dir)
+    assert latest_snapshot(snapshot_dir, SharedFile + PreviousSuffix) == second.version
+
+    def has_aggregates(dataset):
+        return os.path.isdir(os.path.join(snapshot_dir, dataset.version, 'aggregates'))
+    assert not has_aggregates(first)
+    assert has_aggregates(second) and has_aggregates(third)
+    assert attach_fresh(snapshot_dir).num_dates == third.num_dates
@@ -0,0 +1,81 @@
+# Week & month roll-ups -- extending the Aggregates a few days at a time (across week & month ends) must give the same
+# buckets as rolling up the whole history at once, and those buckets must be the calendar weeks & months
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import date_label
+from covid_series import TimeSeries
+from covid_store import Aggregates, LEVELS, TIERS, VARIABLES
+
+# A Saturday, so the first week is two days long
+FirstDay = datetime.date(2020, 2, 29)
+Days = 75
+
+
+# Random cumulative cases & deaths of a few counties in a few states over Days days
+def make_series():
+    rng = np.random.default_rng(3)
+    states = ['Alabama'] * 3 + ['Texas'] * 4 + ['Utah'] * 2
+    counties = ['County %d' % i for i in range(len(states))]
+    labels = [date_label(FirstDay + datetime.timedelta(days=d)) for d in range(Days)]
+    cases = np.cumsum(rng.integers(0, 50, (len(states), Days)), axis=1).astype(np.int32)
+    deaths = np.cumsum(rng.integers(0, 3, (len(states), Days)), axis=1).astype(np.int32)
+    return TimeSeries.from_rows(states, counties, labels, cases, deaths, rng.integers(1000, 100000, len(states)))
+
+
+# The first days of a TimeSeries
+def first_days(series, days):
+    return TimeSeries(series.states, series.state_ids, series.counties, series.date_labels[:days],
+                      series.cases[:, :days], series.deaths[:, :days], series.population, series.country,
+                      series.fips, series.codes)
+
+
+def test_tiers_after_extend_match_full_roll_up():
+    full = make_series()
+    Agg = Aggregates(first_days(full, 10))
+    # A day at a time over the end of March, then a few days at once over the end of April
+    for days in list(range(11, 40)) + [47, 61, 62, Days]:
+        Agg = Agg.extend(first_days(full, days))
+        whole = Aggregates(first_days(full, days))
+        for tier in TIERS:
+            np.testing.assert_array_equal(Agg.ends[tier], whole.ends[tier])
+        assert Agg._tiers.keys() == whole._tiers.keys()
+        for key, values in whole._tiers.items():
+            np.testing.assert_allclose(Agg._tiers[key], values, equal_nan=True, err_msg=str((days, key)))
+
+
+def test_tiers_are_calendar_weeks_and_months():
+    series = make_series()
+    Agg = Aggregates(first_days(series, 30)).extend(series)
+    dates = pd.to_datetime([FirstDay + datetime.timedelta(days=d) for d in range(Days)])
+    for level in LEVELS:
+        for variable in VARIABLES:
+            if level == 'County':
+                totals = series.values(variable).astype(np.float64)
+            else:
+                totals = Agg.matrix(level, variable)
+            for tier, rule in [('week', 'W-SUN'), ('month', 'M')]:
+                frame = pd.DataFrame(totals.transpose(), index=dates)
+                # The last day's total & the average new values per day of each bucket (the first day has none)
+                expected_total = frame.resample(rule).last().to_numpy().transpose()
+                expected_new = frame.diff().resample(rule).mean().to_numpy().transpose()
+                np.testing.assert_allclose(Agg._tiers[(tier, level, variable, 'total')], expected_total)
+                np.testing.assert_allclose(Agg._tiers[(tier, level, variable, 'new')], expected_new)
+
+
+def test_county_moving_average_of_a_bad_period_is_empty():
+    series = make_series()
+    Agg = Aggregates(series)
+    segments = [('day', np.arange(Days))]
+    region = [(series.states[0], series.counties[0])]
+    for period in [0, -3, -Days - 5]:
+        days, values = Agg.regions_points(region, 'Cases', segments, 'average', period)
+        assert values.shape == (1, Days) and np.isnan(values).all()
+
+    # A good period is the mean of the new values over it
+    days, values = Agg.regions_points(region, 'Cases', segments, 'average', 7)
+    new = np.diff(series.values('Cases')[0].astype(np.float64))
+    np.testing.assert_allclose(values[0, 7:], [new[day - 7:day].mean() for day in range(7, Days)])
+    assert np.isnan(values[0, :7]).all()
@@ -0,0 +1,99 @@
+# Build the simplified county outlines used by the county map (assets/us_counties.json)
+# Reads a US Census cartographic boundary county shapefile (e.g. cb_2016_us_county_500k.shp, as shipped in the
+# plotly-geo package), simplifies every ring with Douglas-Peucker, rounds the coordinates & writes a compact GeoJSON
+# FeatureCollection keyed by five digit FIPS code. Needs pyshp (pip install pyshp), which the app itself doesn't
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, Root)
+from covid_figures import CountyGeometryFile
+
+
+# Keep the points of a line that are further than tolerance from the simplified line (Douglas-Peucker)
+def simplify(points, tolerance):
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last <= first + 1:
+            continue
+        start, end = points[first], points[last]
+        segment = end - start
+        inner = points[first + 1:last] - start
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            distances = np.abs(segment[0] * inner[:, 1] - segment[1] * inner[:, 0]) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack += [(first, split), (split, last)]
+    return points[keep]
+
+
+# Simplified & rounded ring as a list of [lon, lat] -- None if it collapses to nothing
+def simplify_ring(ring, tolerance, decimals):
+    points = simplify(np.asarray(ring, dtype=np.float64), tolerance).round(decimals)
+    # Drop points that rounding has made repeats of the previous one
+    points = points[np.r_[True, np.any(np.diff(points, axis=0) != 0, axis=1)]]
+    if len(points) < 4:
+        return None
+    return points.tolist()
+
+
+# Whether a ring of [lon, lat] points winds clockwise (a negative shoelace area)
+def clockwise(ring):
+    x, y = np.asarray(ring).T
+    return np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]) < 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the simplified county outlines for the county map')
+    parser.add_argument('shapefile', help='Census cartographic boundary county shapefile (.shp)')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='simplification tolerance in degrees')
+    parser.add_argument('--decimals', type=int, default=2, help='decimal places kept in coordinates')
+    parser.add_argument('--output', default=os.path.join(Root, CountyGeometryFile))
+    args = parser.parse_args()
+
+    import shapefile
+
+    features = []
+    with shapefile.Reader(args.shapefile) as reader:
+        for record in reader.iterShapeRecords():
+            fips = record.record['STATEFP'] + record.record['COUNTYFP']
+            shape = record.shape
+            parts = list(shape.parts) + [len(shape.points)]
+            polygons = []
+            for i in range(len(parts) - 1):
+                ring = simplify_ring(shape.points[parts[i]:parts[i + 1]], args.tolerance, args.decimals)
+                if ring is None:
+                    continue
+                # Shapefiles wind outer rings clockwise (which is also what Plotly's d3 projection expects) & holes
+                # anticlockwise, each hole following its outer ring
+                if clockwise(ring) or not polygons:
+                    polygons.append([ring])
+                else:
+                    polygons[-1].append(ring)
+            if polygons:
+                features.append({
+                    'type': 'Feature',
+                    'id': fips,
+                    'geometry': {'type': 'MultiPolygon', 'coordinates': polygons},
+                })
+
+    features.sort(key=lambda feature: feature['id'])
+    with open(args.output, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f, separators=(',', ':'))
+    print('Wrote %d counties (%.0f KB) to %s' % (len(features), os.path.getsize(args.output) / 1024, args.output))
+
+
+if __name__ == '__main__':
+    main()